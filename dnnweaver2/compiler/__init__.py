@@ -2,9 +2,13 @@ from dnnweaver2.tensorOps.cnn import *
 from dnnweaver2.graph import Graph
 from dnnweaver2.tensor import Tensor
 
-from dnnweaver2.optimizer.optimizer import optimize_for_order, get_stats_fast
+from dnnweaver2.optimizer.optimizer import optimize_for_order, optimize_layers, optimize_graph, get_stats_fast, get_worker_pool, SEARCH_BUDGET
+from dnnweaver2.optimizer.optimizer import OBJECTIVES, OBJECTIVE_CYCLES, OBJECTIVE_DRAM_BUDGET
+from dnnweaver2.optimizer.optimizer import _get_conv_params_with_pool
+from dnnweaver2.optimizer.cache import TilingCache
 from dnnweaver2.isa import *
-from dnnweaver2.isa import ScratchPad, AccessType
+from dnnweaver2.isa import ScratchPad, AccessType, InstructionStream
+from dnnweaver2.simulator.stats import EnergyCost, DEFAULT_ENERGY_COST, load_energy_cost, get_energy_cost
 
 from collections import OrderedDict, namedtuple
 import numpy as np
@@ -15,10 +19,23 @@ import math
 import logging
 
 from dnnweaver2.compiler.pu_compiler import PUCompiler
+from dnnweaver2.compiler.binary import BlockIndex, write_binary
+from dnnweaver2.compiler.linker import Linker, base_address, offset_relocations
 
 InstructionBlock = namedtuple('InstructionBlock', ['Op_name', 'Instructions'])
+# Second set of DDR buffers for the graph input and output. Patches is a
+# list of (index, instruction, alternate_instruction) for the instructions
+# that differ when the alternate buffers are used.
+DoubleBuffer = namedtuple('DoubleBuffer', ['Input_addr', 'Output_addr', 'Patches'])
 
 class FPGASpec(object):
+    """
+    DDR memory of the FPGA board
+    Args:
+        num_ddr: number of DDR channels
+        size_ddr: size of each DDR channel in bytes
+        bandwidth_per_ddr: width of each DDR interface in bits
+    """
     def __init__(self, num_ddr=1, size_ddr=2**32, bandwidth_per_ddr=512):
         assert num_ddr > 0
         assert size_ddr > 0
@@ -28,20 +45,148 @@ class FPGASpec(object):
         self.bandwidth_per_ddr = bandwidth_per_ddr
 
 class FPGAMemoryManager(object):
-    def __init__(self, fpga_spec=None, log_level=logging.INFO):
-        # assert isinstance(fpga_spec, FPGASpec)
-        # self.fpga_spec = fpga_spec
-        # self.size_ddr = self.fpga_spec.size_ddr
+    """
+    Assigns DDR addresses to the tensors of a graph
+    plan() computes the lifetime of every tensor, in macro nodes, from the
+    op order and packs the tensors by interval coloring: tensors whose
+    lifetimes do not overlap can share memory. Addresses are deterministic.
+    """
+    def __init__(self, fpga_spec=None, alignment=1024, log_level=logging.INFO):
+        self.fpga_spec = fpga_spec
+        self.alignment = alignment
         self.curr_ddr_ptr = 0
+        self.peak_footprint = 0
         self.log = logging.getLogger('FPGA memory manager')
         self.log.setLevel(log_level)
 
+    def _align(self, size):
+        return int(math.ceil(size / float(self.alignment))) * self.alignment
+
+    def get_alloc_size(self, tensor):
+        """
+        Returns the number of bytes reserved for a tensor in DDR
+        Convolution outputs hold the 64-bit partial sums spilled from OBUF.
+        """
+        size = tensor.fpga_size_in_bytes
+        if isinstance(tensor.op, Convolution):
+            size = size * 64 / tensor.dtype.bits
+        return self._align(size)
+
+    @staticmethod
+    def get_address_map(graph):
+        """
+        Returns a dict from tensor name to DDR address for the allocated tensors
+        """
+        address_map = {}
+        for tname, t in graph.tensor_registry.items():
+            if t.fpga_addr is not None:
+                address_map[tname] = int(t.fpga_addr)
+        return address_map
+
+    @staticmethod
+    def get_macro_node_index(graph):
+        """
+        Returns a dict mapping each op to the index of its macro node
+        A Convolution starts a new macro node; other ops join the current one.
+        """
+        op_index = {}
+        curr = 0
+        for opname, op in graph.op_registry.items():
+            if isinstance(op, Convolution) and len(op_index) > 0:
+                curr += 1
+            op_index[op] = curr
+        return op_index
+
+    def get_lifetimes(self, graph):
+        """
+        Returns an OrderedDict mapping each tensor to its (first, last) macro
+        node index, both inclusive
+        Parameters, graph inputs and tensors whose spatial padding is written
+        once by the host must keep their contents across inferences, so they
+        live for the whole graph. So do graph outputs: FPGAManager.run_pipeline
+        reads one while the next inference runs.
+        """
+        op_index = self.get_macro_node_index(graph)
+        last = max(op_index.values()) if len(op_index) > 0 else 0
+        lifetimes = OrderedDict()
+        for tname, t in graph.tensor_registry.items():
+            if not isinstance(t, Tensor):
+                continue
+            spatial_pad = any(p[0] + p[1] > 0 for p in t.fpga_pad[1:-1])
+            if t.op is None or t.op not in op_index or spatial_pad or len(t.output_nodes) == 0:
+                lifetimes[t] = (0, last)
+                continue
+            start = op_index[t.op]
+            consumers = [op_index[op] for op in t.output_nodes if op in op_index]
+            end = max(consumers) if len(consumers) > 0 else last
+            lifetimes[t] = (start, max(start, end))
+        return lifetimes
+
+    def plan(self, graph):
+        """
+        Assigns addresses to all tensors in the graph that do not have one
+        Tensors are placed largest first, each at the lowest aligned address
+        that does not overlap a placed tensor with an overlapping lifetime.
+        Returns the peak DDR footprint in bytes.
+        """
+        lifetimes = self.get_lifetimes(graph)
+        order = [t for t in lifetimes if t.fpga_addr is None]
+        order.sort(key=lambda t: (-self.get_alloc_size(t), lifetimes[t][0], t.name))
+
+        placed = [(t, t.fpga_addr, t.fpga_addr + self.get_alloc_size(t))
+                  for t in lifetimes if t.fpga_addr is not None]
+        for t in order:
+            start, end = lifetimes[t]
+            size = self.get_alloc_size(t)
+            conflicts = []
+            for other, lo, hi in placed:
+                if other in lifetimes:
+                    other_start, other_end = lifetimes[other]
+                    if other_end < start or end < other_start:
+                        continue
+                conflicts.append((lo, hi))
+            addr = 0
+            for lo, hi in sorted(conflicts):
+                if addr + size <= lo:
+                    break
+                addr = max(addr, self._align(hi))
+            t.fpga_addr = addr
+            placed.append((t, addr, addr + size))
+            self.log.debug('Assigned address {}:{} to tensor {}, live in macro nodes {}'.format(
+                addr, addr + t.fpga_size_in_bytes, t, lifetimes[t]))
+
+        self.peak_footprint = max([self.peak_footprint] + [hi for _, _, hi in placed])
+        self.curr_ddr_ptr = max(self.curr_ddr_ptr, self.peak_footprint)
+        if self.fpga_spec is not None and self.peak_footprint > self.fpga_spec.size_ddr:
+            raise ValueError('DDR footprint of {} bytes exceeds DDR size of {} bytes'.format(
+                self.peak_footprint, self.fpga_spec.size_ddr))
+        total = sum(self.get_alloc_size(t) for t in lifetimes)
+        self.log.info('Peak DDR footprint: {:,} bytes ({:,} bytes without reuse)'.format(
+            self.peak_footprint, total))
+        return self.peak_footprint
+
+    def alloc_copy(self, tensor):
+        """
+        Reserves space for a second copy of a tensor after all planned
+        tensors and returns its address
+        """
+        assert isinstance(tensor, Tensor)
+        addr = self.curr_ddr_ptr
+        self.log.debug('Assigned address {}:{} to a copy of tensor {}'.format(addr, addr+tensor.fpga_size_in_bytes, tensor))
+        self.curr_ddr_ptr += self.get_alloc_size(tensor)
+        self.peak_footprint = max(self.peak_footprint, self.curr_ddr_ptr)
+        return addr
+
     def alloc(self, tensor):
+        """
+        Assigns an address after all planned tensors to a single tensor
+        """
         assert isinstance(tensor, Tensor)
         if tensor.fpga_addr is None:
             tensor.fpga_addr = self.curr_ddr_ptr
             self.log.debug('Assigned address {}:{} to tensor {}'.format(self.curr_ddr_ptr, self.curr_ddr_ptr+tensor.fpga_size_in_bytes, tensor))
-            self.curr_ddr_ptr += 4*int(math.ceil(tensor.fpga_size_in_bytes / 1024.) * 1024) + 1024 * np.random.randint(1, 16)
+            self.curr_ddr_ptr += self.get_alloc_size(tensor)
+            self.peak_footprint = max(self.peak_footprint, self.curr_ddr_ptr)
 
 class MacroNode(object):
     def __init__(self, op):
@@ -56,7 +201,23 @@ class MacroNode(object):
 
 class GraphCompiler(object):
 
-    def __init__(self, fpga_spec=None, log_level=logging.INFO):
+    def __init__(self, fpga_spec=None, tiling_cache=None, num_workers=None, sequential=False,
+                 search_budget=SEARCH_BUDGET, extended_tiles=True, cross_layer=False,
+                 objective=OBJECTIVE_CYCLES, dram_budget=None, energy_cost=DEFAULT_ENERGY_COST,
+                 log_level=logging.INFO):
+        """
+        Args:
+            cross_layer: tile adjacent layers together assuming their
+                         activations stay on chip, see optimize_graph. The
+                         code generator does not keep activations on chip,
+                         so this is only for plan_graph and the Simulator.
+            objective: what the tiling search minimizes, one of
+                       optimizer.OBJECTIVES, see get_objective_cost
+            dram_budget: DRAM traffic budget in bits per layer, for the
+                         dram_budget objective
+            energy_cost: EnergyCost, or the path of a JSON file for
+                         load_energy_cost
+        """
         self.log = logging.getLogger('Graph Compiler')
         self.log.setLevel(log_level)
         self.fpga_spec = fpga_spec
@@ -68,8 +229,40 @@ class GraphCompiler(object):
             self.fpga_manager = FPGAMemoryManager(self.fpga_spec, log_level=log_level)
         self.pu_compiler = PUCompiler(self.fpga_manager, log_level=self.log.level)
         self.conv_tiling = OrderedDict()
-
-    def optimize_tiling(self, op, graph, acc_obj, pool_kernel=None, pool_stride=None):
+        self.tiling_cache = tiling_cache
+        self.num_workers = num_workers
+        self.sequential = sequential
+        self.search_budget = search_budget
+        self.extended_tiles = extended_tiles
+        self.cross_layer = cross_layer
+        if objective not in OBJECTIVES:
+            raise ValueError('Unknown objective {}, expected one of {}'.format(objective, ', '.join(OBJECTIVES)))
+        if (objective == OBJECTIVE_DRAM_BUDGET) != (dram_budget is not None):
+            raise ValueError('A DRAM budget is needed for, and only for, the {} objective'.format(
+                OBJECTIVE_DRAM_BUDGET))
+        self.objective = objective
+        self.dram_budget = dram_budget
+        if isinstance(energy_cost, str):
+            energy_cost = load_energy_cost(energy_cost)
+        assert isinstance(energy_cost, EnergyCost)
+        self.energy_cost = energy_cost
+        # Set by compile when double_buffer is set
+        self.double_buffer = None
+        # Macro nodes of the last compiled graph, and the optimizer's stats
+        # for their tilings, see simulator.executor.compare_with_optimizer
+        self.macro_nodes = []
+        self.predicted_stats = []
+        # BlockIndex of each macro node in the last compiled instruction array
+        self.block_index = []
+        # Relocations of the tensor base addresses in that array, and a
+        # Linker to place the tensors elsewhere without compiling again
+        self.relocations = []
+        self.linker = None
+        self.pool = None
+        if self.tiling_cache is not None:
+            assert isinstance(self.tiling_cache, TilingCache)
+
+    def _get_conv_params(self, op, acc_obj):
         K = op.weights.fpga_shape[-2]
         O = op.output_tensors.fpga_shape[-2]
         S = op.stride[-1]
@@ -80,12 +273,117 @@ class GraphCompiler(object):
         B = op.data.fpga_shape[-4]
         im2col = False
 
-        # set energy cost to 0 since this version of the compiler is optimized for performance
-        energy_cost = (0,0,0,0,0,0,0,0,0,0)
-        conv_params = (acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost)
-        tiling, order, _, _ = optimize_for_order(conv_params, sequential=False, pool_kernel=pool_kernel, pool_stride=pool_stride)
+        energy_cost = get_energy_cost(self.energy_cost, acc_obj)
+        return (acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost)
 
-        conv_params_with_pool = (acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride)
+    def get_objective(self):
+        """
+        Returns a description of the tiling objective, e.g. 'edp' or
+        'dram_budget=1000000'
+        """
+        if self.objective == OBJECTIVE_DRAM_BUDGET:
+            return '{}={}'.format(self.objective, int(self.dram_budget))
+        return self.objective
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = get_worker_pool(self.num_workers)
+        return self.pool
+
+    def close(self):
+        """
+        Shuts down the worker pool used for the tiling search
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def optimize_tiling(self, op, graph, acc_obj, pool_kernel=None, pool_stride=None):
+        return self.optimize_tilings([(op, pool_kernel, pool_stride)], acc_obj)[0]
+
+    def optimize_tilings(self, conv_ops, acc_obj):
+        """
+        Optimizes tiling for a list of (conv_op, pool_kernel, pool_stride)
+        All layers missing from the tiling cache are searched in one batch
+        """
+        best_tilings = [None] * len(conv_ops)
+        search = []
+        for i, (op, pool_kernel, pool_stride) in enumerate(conv_ops):
+            conv_params = self._get_conv_params(op, acc_obj)
+            cache_key = None
+            if self.tiling_cache is not None:
+                cache_key = self.tiling_cache.get_key(conv_params, pool_kernel=pool_kernel, pool_stride=pool_stride,
+                                                      search_params=(self.extended_tiles, self.search_budget,
+                                                                     self.get_objective()))
+                cached = self.tiling_cache.get(cache_key)
+                if cached is not None:
+                    self.log.debug('Found tiling for {} in cache'.format(op.name))
+                    tiling, order = cached
+                    best_tilings[i] = self._get_tiling_dict(op, tiling, order)
+                    continue
+            search.append((i, conv_params, pool_kernel, pool_stride, cache_key))
+
+        if len(search) > 0:
+            self.log.debug('Searching tiling for {} layers'.format(len(search)))
+            layers = [(conv_params, pool_kernel, pool_stride) for _, conv_params, pool_kernel, pool_stride, _ in search]
+            pool = None if self.sequential else self._get_pool()
+            try:
+                results = optimize_layers(layers, sequential=self.sequential, pool=pool,
+                                          extended=self.extended_tiles, budget=self.search_budget,
+                                          objective=self.objective, dram_budget=self.dram_budget)
+            except KeyboardInterrupt:
+                # The pool is terminated by optimize_layers
+                self.pool = None
+                raise
+            for (i, _, _, _, cache_key), (tiling, order, _, _) in zip(search, results):
+                best_tilings[i] = self._get_tiling_dict(conv_ops[i][0], tiling, order)
+                if self.tiling_cache is not None:
+                    self.tiling_cache.put(cache_key, tiling, order)
+
+        return best_tilings
+
+    def optimize_graph_tilings(self, conv_ops, boundaries, acc_obj):
+        """
+        Optimizes tiling for a chain of (conv_op, pool_kernel, pool_stride)
+        together, keeping activations on chip across the boundaries where
+        it reduces the total cycles. The tiling cache is not used, since
+        the best tiling of a layer depends on its neighbours.
+        Args:
+            boundaries: one boolean per pair of adjacent layers, True if
+                        the output of a layer is only consumed by the next
+        Returns:
+            best_tilings: one tiling dict per layer
+            resident: one boolean per boundary, an estimate only, see
+                      optimize_graph
+        """
+        layers = [(self._get_conv_params(op, acc_obj), pool_kernel, pool_stride)
+                  for op, pool_kernel, pool_stride in conv_ops]
+        self.log.debug('Searching tiling for {} layers with cross-layer residency'.format(len(layers)))
+        pool = None if self.sequential else self._get_pool()
+        try:
+            results, resident = optimize_graph(layers, boundaries, sequential=self.sequential, pool=pool,
+                                               extended=self.extended_tiles, budget=self.search_budget,
+                                               objective=self.objective, dram_budget=self.dram_budget)
+        except KeyboardInterrupt:
+            # The pool is terminated by optimize_graph
+            self.pool = None
+            raise
+        best_tilings = []
+        for (op, _, _), (tiling, order, _, _) in zip(conv_ops, results):
+            best_tilings.append(self._get_tiling_dict(op, tiling, order))
+        return best_tilings, resident
+
+    def _get_tiling_dict(self, op, tiling, order):
+        if order is None:
+            raise ValueError('No tiling of {} fits in the SRAM of the accelerator'.format(op.name))
+        K = op.weights.fpga_shape[-2]
 
         # Convert tiling and order to an ordered dict
         best_tiling = OrderedDict()
@@ -98,17 +396,18 @@ class GraphCompiler(object):
         return best_tiling
 
     def _alloc_tensor(self, graph):
-        for tname, t in graph.tensor_registry.items():
-            if isinstance(t, Tensor):
-                self.fpga_manager.alloc(t)
+        return self.fpga_manager.plan(graph)
 
-    def _conv_compile(self, conv_op, pu_op, tiling, array_n, array_m, last=False):
+    def _conv_compile(self, conv_op, pu_op, tiling, array_n, array_m, last=False, relocations=None):
         """
         Compiler for convolution layers
+        Args:
+            relocations: list to append the Relocation of every tensor base
+                         address to, with indices into the returned stream
         TODO: replace hard-coded array sizes
         """
-        inst_array = []
-        inst_array.append(SetupInstruction(16, 16).get_binary())
+        inst_array = InstructionStream()
+        inst_array.setup(16, 16)
 
         self.log.debug('Convolution op: {}'.format(conv_op.name))
 
@@ -125,15 +424,10 @@ class GraphCompiler(object):
         pool_pad_h = pool_pad_h_t + pool_pad_h_b
         pool_pad_w = pool_pad_w_l + pool_pad_w_r
 
-        inst_array.append(BaseAddressInstruction(ScratchPad.IBUF, 0, conv_op.data.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.WBUF, 0, conv_op.weights.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.BIAS, 0, conv_op.bias.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.OBUF, 0, conv_op.output_tensors.fpga_addr).get_binary())
-
-        inst_array.append(BaseAddressInstruction(ScratchPad.IBUF, 1, conv_op.data.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.WBUF, 1, conv_op.weights.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.BIAS, 1, conv_op.bias.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.OBUF, 1, conv_op.output_tensors.fpga_addr).get_binary())
+        for index in range(2):
+            for buf, t in ((ScratchPad.IBUF, conv_op.data), (ScratchPad.WBUF, conv_op.weights),
+                           (ScratchPad.BIAS, conv_op.bias), (ScratchPad.OBUF, conv_op.output_tensors)):
+                base_address(inst_array, buf, index, t, relocations)
 
         # Parallelize loops IC/ic and OC/oc
         tiling['IC/ic'] = (tiling['IC/ic'][0], int(math.ceil(tiling['IC/ic'][1]/float(array_n))))
@@ -238,29 +532,29 @@ class GraphCompiler(object):
         num_outer_loops = 0
         for l, it in tiling.items():
             if it[0] > 1:
-                inst_array.append(LoopInstruction(16, 16, it[0]-1).get_binary())
+                inst_array.loop(16, 16, it[0]-1)
                 for buf, s in outer_loop_strides[l].items():
                     dim, dim_stride = s
                     tensor = tensor_mapping[buf]
                     shape = tensor_tile_shape[buf]
                     stride = (np.prod(shape[dim+1:]) * dim_stride * tensor.dtype.bits) / 8
                     if stride >= (1<<16):
-                        inst_array.append(GenAddrHighInstruction(buf, AccessType.LD, 16, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, 16, stride).get_binary())
+                        inst_array.gen_addr_high(buf, AccessType.LD, 16, stride)
+                    inst_array.gen_addr_low(buf, AccessType.LD, 16, stride)
                     if tensor.op == conv_op:
                         if stride >= (1<<16):
-                            inst_array.append(GenAddrHighInstruction(buf, AccessType.ST, 16, stride).get_binary())
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, 16, stride).get_binary())
+                            inst_array.gen_addr_high(buf, AccessType.ST, 16, stride)
+                        inst_array.gen_addr_low(buf, AccessType.ST, 16, stride)
 
                 num_outer_loops += 1
 
         if num_outer_loops == 0:
-            inst_array.append(LoopInstruction(16, 16, 0).get_binary())
+            inst_array.loop(16, 16, 0)
             for buf, s in outer_loop_strides[l].items():
                 tensor = tensor_mapping[buf]
-                inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, 16, 0).get_binary())
+                inst_array.gen_addr_low(buf, AccessType.LD, 16, 0)
                 if tensor.op == conv_op:
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, 16, 0).get_binary())
+                    inst_array.gen_addr_low(buf, AccessType.ST, 16, 0)
 
         ih = (oh - 1) * conv_op.stride[-2] + kh
         iw = (ow - 1) * conv_op.stride[-1] + kw
@@ -279,28 +573,28 @@ class GraphCompiler(object):
         for buf, tile_shape in padded_tile_shape_mapping.items():
             num_loops = 0
             tensor = tensor_mapping[buf]
-            inst_array.append(LDMemInstruction(buf, tensor.dtype.bits//8, buf+1, 1).get_binary())
+            inst_array.ld_mem(buf, tensor.dtype.bits//8, buf+1, 1)
             if buf == 1:
-                inst_array.append(STMemInstruction(buf, tensor.dtype.bits//8, buf+1, 1).get_binary())
+                inst_array.st_mem(buf, tensor.dtype.bits//8, buf+1, 1)
             shape = tensor_tile_shape[buf]
             for dim in reversed(range(len(tile_shape))):
                 s = tile_shape[dim]
                 if s > 1:
                     stride = (np.prod(shape[dim+1:]) * 1 * tensor.dtype.bits) / 8
-                    inst_array.append(LoopInstruction(buf+1, buf+1, s-1).get_binary())
+                    inst_array.loop(buf+1, buf+1, s-1)
                     if stride >= (1<<16):
-                        inst_array.append(GenAddrHighInstruction(buf, AccessType.LD, buf+1, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, buf+1, stride).get_binary())
+                        inst_array.gen_addr_high(buf, AccessType.LD, buf+1, stride)
+                    inst_array.gen_addr_low(buf, AccessType.LD, buf+1, stride)
                     if buf == 1:
                         if stride >= (1<<16):
-                            inst_array.append(GenAddrHighInstruction(buf, AccessType.ST, buf+1, stride).get_binary())
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, buf+1, stride).get_binary())
+                            inst_array.gen_addr_high(buf, AccessType.ST, buf+1, stride)
+                        inst_array.gen_addr_low(buf, AccessType.ST, buf+1, stride)
                     num_loops += 1
             if num_loops == 0:
-                inst_array.append(LoopInstruction(buf+1, buf+1, 0).get_binary())
-                inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, buf+1, 0).get_binary())
+                inst_array.loop(buf+1, buf+1, 0)
+                inst_array.gen_addr_low(buf, AccessType.LD, buf+1, 0)
                 if buf == 1:
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, buf+1, 0).get_binary())
+                    inst_array.gen_addr_low(buf, AccessType.ST, buf+1, 0)
 
         inner_loop_strides = {
             'IC/ic': {
@@ -355,7 +649,7 @@ class GraphCompiler(object):
             it = inner_loop_tiling[l]
 
             if it > 1:
-                inst_array.append(LoopInstruction(0, 0, it-1).get_binary())
+                inst_array.loop(0, 0, it-1)
                 for buf, s in inner_loop_strides[l].items():
                     dim, dim_stride = s
                     tensor = tensor_mapping[buf]
@@ -363,40 +657,112 @@ class GraphCompiler(object):
                     stride = np.prod(tile_shape[dim+1:]) * dim_stride
                     if stride >= (1<<16):
                         raise ValueError('stride for inner loop is too high: {}'.format(stride))
-                        # inst_array.append(GenAddrHighInstruction(buf, AccessType.RD, 0, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.RD, 0, stride).get_binary())
+                        # inst_array.gen_addr_high(buf, AccessType.RD, 0, stride)
+                    inst_array.gen_addr_low(buf, AccessType.RD, 0, stride)
                     if tensor.op == conv_op:
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.WR, 0, stride).get_binary())
+                        inst_array.gen_addr_low(buf, AccessType.WR, 0, stride)
                         if stride >= (1<<16):
                             raise ValueError('stride for inner loop is too high: {}'.format(stride))
-                            # inst_array.append(GenAddrHighInstruction(buf, AccessType.WR, 0, stride).get_binary())
+                            # inst_array.gen_addr_high(buf, AccessType.WR, 0, stride)
                 num_inner_loops += 1
 
         if num_inner_loops == 0:
-            inst_array.append(LoopInstruction(0, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.IBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.WBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.OBUF, AccessType.WR, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.OBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.BIAS, AccessType.RD, 0, 0).get_binary())
+            inst_array.loop(0, 0, 0)
+            inst_array.gen_addr_low(ScratchPad.IBUF, AccessType.RD, 0, 0)
+            inst_array.gen_addr_low(ScratchPad.WBUF, AccessType.RD, 0, 0)
+            inst_array.gen_addr_low(ScratchPad.OBUF, AccessType.WR, 0, 0)
+            inst_array.gen_addr_low(ScratchPad.OBUF, AccessType.RD, 0, 0)
+            inst_array.gen_addr_low(ScratchPad.BIAS, AccessType.RD, 0, 0)
 
         # PU operations now
-        pu_inst = self.pu_compiler.compile_layer(tiling, conv_op.output_tensors, pu_op, simd_lanes=array_m)
-        for i in pu_inst:
-            inst_array.append(i)
-        inst_array.append(BlockEndInstruction(last).get_binary())
+        pu_relocations = None if relocations is None else []
+        pu_inst = self.pu_compiler.compile_layer(tiling, conv_op.output_tensors, pu_op, simd_lanes=array_m,
+                                                 relocations=pu_relocations)
+        if relocations is not None:
+            relocations.extend(offset_relocations(pu_relocations, len(inst_array)))
+        inst_array.extend(pu_inst)
+        inst_array.block_end(last)
 
         return inst_array
 
     def compile_macro_node(self, graph, acc_obj):
         pass
 
-    def compile(self, graph, acc_obj):
-
-        array_n, array_m = acc_obj.N, acc_obj.M
-        assert isinstance(graph, Graph)
+    def _compile_macro_nodes(self, macro_node_array, optimal_tilings, array_n, array_m):
+        """
+        Returns the instruction array of the macro nodes, the BlockIndex of
+        each macro node and the relocations of the array
+        """
         inst_binary = []
+        relocations = []
+        for i in range(len(macro_node_array)):
+            macro_node = macro_node_array[i]
+            self.log.debug('#'*50)
+            self.log.debug('Compiling macro op: {}'.format(macro_node.name))
+            self.log.debug('\tConvolution op: {}'.format(macro_node.sys_array_op.name))
+            self.log.debug('\tOther ops:')
+            for op in macro_node.pu_op:
+                self.log.debug('\t\t{}'.format(op.name))
 
+            optimal_tiling = optimal_tilings[i]
+            self.conv_tiling[macro_node.sys_array_op] = optimal_tiling
+            self.log.debug('Optimal tiling and ordering:')
+            indent = 1
+            for loop, tile in optimal_tiling.items():
+                self.log.debug('{}Loop: {:>6}, Tile: {}'.format(indent * '==', loop, tile))
+                indent += 1
+
+            last = i == len(macro_node_array) - 1
+            block_relocations = []
+            inst_array = self._conv_compile(conv_op=macro_node.sys_array_op, pu_op=macro_node.pu_op, tiling=optimal_tiling, array_n=array_n, array_m=array_m, last=last, relocations=block_relocations)
+            inst_binary.append(InstructionBlock(macro_node, inst_array))
+            relocations.append(block_relocations)
+            self.log.debug('#'*50)
+
+        self.log.debug('Compiling macro ops - done!')
+
+        block_index = []
+        inst_relocations = []
+        stream = InstructionStream()
+        for i, block_relocations in zip(inst_binary, relocations):
+            block_index.append(BlockIndex(i.Op_name.name, len(stream), len(i.Instructions)))
+            inst_relocations.extend(offset_relocations(block_relocations, len(stream)))
+            stream.extend(i.Instructions)
+        return stream.encode(), block_index, inst_relocations
+
+    def _get_double_buffer(self, graph, macro_node_array, inst_array):
+        """
+        Reserves alternate DDR buffers for the graph input and output, and
+        returns a DoubleBuffer with the instructions that differ from
+        inst_array when they are used
+        """
+        tin = None
+        for macro_node in macro_node_array:
+            if macro_node.sys_array_op.data.op is None:
+                tin = macro_node.sys_array_op.data
+                break
+        # Same output tensor as FPGAManager.find_sink_op
+        tout = None
+        for tname, t in graph.tensor_registry.items():
+            if len(t.output_nodes) == 0:
+                tout = t
+                break
+        assert tin is not None and tout is not None
+
+        alt_addr = (self.fpga_manager.alloc_copy(tin), self.fpga_manager.alloc_copy(tout))
+        address_map = self.fpga_manager.get_address_map(graph)
+        address_map[tin.name], address_map[tout.name] = alt_addr
+
+        patches = [(i, int(inst_array[i]), word) for i, word in self.linker.patches(inst_array, address_map)]
+        self.log.debug('Double buffering: {} instructions differ'.format(len(patches)))
+        return DoubleBuffer(alt_addr[0], alt_addr[1], patches)
+
+    def get_macro_nodes(self, graph):
+        """
+        Groups the ops of a graph into macro nodes: a Convolution followed
+        by the ops that run on the PU
+        """
+        assert isinstance(graph, Graph)
         self.log.debug('#'*50)
         self.log.debug('Combining graph ops to create macro op')
         macro_node_array = []
@@ -416,6 +782,13 @@ class GraphCompiler(object):
         macro_node_array.append(curr_node)
         self.log.debug('Combining graph ops to create macro op - done!')
 
+        return macro_node_array
+
+    def _set_fpga_pad(self, macro_node_array, array_n, array_m):
+        """
+        Pads the channels of the tensors of every macro node to multiples of
+        the array size
+        """
         for i in range(len(macro_node_array)):
             macro_node = macro_node_array[i]
             conv_pad = list(macro_node.sys_array_op.pad)
@@ -449,51 +822,85 @@ class GraphCompiler(object):
             pool_out_pad = ((0,0),(0,0),(0,0),(0,oc_padding))
             macro_node.pu_op[-1].output_tensors.fpga_pad = pool_out_pad
 
-        self.log.debug('#'*50)
-        for i in range(len(macro_node_array)):
-            macro_node = macro_node_array[i]
-            self.log.debug('#'*50)
-            self.log.debug('Compiling macro op: {}'.format(macro_node.name))
-            self.log.debug('\tConvolution op: {}'.format(macro_node.sys_array_op.name))
-            self.log.debug('\tOther ops:')
-            for op in macro_node.pu_op:
-                self.log.debug('\t\t{}'.format(op.name))
+    def plan_graph(self, graph, acc_obj):
+        """
+        Groups, pads and tiles the graph as compile does, without allocating
+        DDR or generating instructions
+        Sets self.macro_nodes and self.predicted_stats, see compile.
+        Returns the macro nodes and their tilings.
+        """
+        array_n, array_m = acc_obj.N, acc_obj.M
+        macro_node_array = self.get_macro_nodes(graph)
+        self._set_fpga_pad(macro_node_array, array_n, array_m)
 
-            self.log.debug('Optimizing tiling for Convolution layer {}'.format(macro_node.sys_array_op.name))
+        self.log.debug('#'*50)
+        self.log.debug('Optimizing tiling for Convolution layers, objective: {}'.format(self.get_objective()))
+        conv_ops = []
+        for macro_node in macro_node_array:
             pool_stride = None
             pool_kernel = None
             for op in macro_node.pu_op:
                 if isinstance(op, MaxPooling):
-                    pool_pad = op.pad
                     pool_stride = op.stride
                     pool_kernel = op.pooling_kernel
-            optimal_tiling = self.optimize_tiling(macro_node.sys_array_op, graph, acc_obj, pool_stride=pool_stride, pool_kernel=pool_kernel)
-            self.conv_tiling[macro_node.sys_array_op] = optimal_tiling
-            self.log.debug('Optimal tiling and ordering:')
-            indent = 1
-            for loop, tile in optimal_tiling.items():
-                self.log.debug('{}Loop: {:>6}, Tile: {}'.format(indent * '==', loop, tile))
-                indent += 1
+            conv_ops.append((macro_node.sys_array_op, pool_kernel, pool_stride))
+        if self.cross_layer:
+            # Activations can only stay on chip when the next macro node is
+            # the sole consumer of the output
+            boundaries = []
+            for i in range(len(macro_node_array) - 1):
+                out_tensor = macro_node_array[i].pu_op[-1].output_tensors
+                boundaries.append(out_tensor is macro_node_array[i+1].sys_array_op.data and
+                                  len(out_tensor.output_nodes) == 1)
+            optimal_tilings, resident = self.optimize_graph_tilings(conv_ops, boundaries, acc_obj)
+            for i in range(len(resident)):
+                self.log.debug('Boundary {} -> {}: resident: {}'.format(
+                    macro_node_array[i].name, macro_node_array[i+1].name, resident[i]))
+        else:
+            optimal_tilings = self.optimize_tilings(conv_ops, acc_obj)
+            resident = [False] * (len(macro_node_array) - 1)
 
-            last = i == len(macro_node_array) - 1
-            self.log.debug('Allocating tensors for macro op: {}'.format(macro_node.name))
-            self._alloc_tensor(graph)
-            inst_array = self._conv_compile(conv_op=macro_node.sys_array_op, pu_op=macro_node.pu_op, tiling=optimal_tiling, array_n=array_n, array_m=array_m, last=last)
-            inst_binary.append(InstructionBlock(macro_node, inst_array))
-            self.log.debug('#'*50)
+        self.macro_nodes = macro_node_array
+        self.predicted_stats = []
+        for i, ((op, pool_kernel, pool_stride), tiling) in enumerate(zip(conv_ops, optimal_tilings)):
+            conv_params = _get_conv_params_with_pool(self._get_conv_params(op, acc_obj), pool_kernel, pool_stride)
+            order = [l for l in tiling if l not in ('KH/kh', 'KW/kw')]
+            self.predicted_stats.append(get_stats_fast(conv_params, tiling, order,
+                                                       resident_input=i > 0 and resident[i-1],
+                                                       resident_output=i < len(resident) and resident[i]))
 
-        self.log.debug('Compiling macro ops - done!')
+        return macro_node_array, optimal_tilings
+
+    def compile(self, graph, acc_obj, double_buffer=False, binary_path=None):
+        """
+        Compiles the graph to an instruction array of uint32 words
+        Args:
+            double_buffer: also reserve a second set of buffers for the graph
+                           input and output, see FPGAManager.run_pipeline.
+                           The result is stored in self.double_buffer.
+            binary_path: if given, the instructions and their layer index are
+                         written there, see compiler.binary.load_binary
+        Cross-layer residency is only modelled by the optimizer: code
+        generation loads and stores every activation through DDR, so a
+        compiler with cross_layer set cannot compile.
+        """
+        if self.cross_layer:
+            raise ValueError('cross_layer only predicts on-chip activations, use plan_graph or the Simulator; '
+                             'compile with cross_layer=False')
+
+        array_n, array_m = acc_obj.N, acc_obj.M
+        macro_node_array, optimal_tilings = self.plan_graph(graph, acc_obj)
+
+        self.log.debug('Allocating tensors')
+        self._alloc_tensor(graph)
 
-        inst_array = []
-        for i in inst_binary:
-            inst = i.Instructions
-            op_name = i.Op_name
-            for _i in inst:
-                inst_array.append(_i)
-            # inst_array += inst
-
-        with open('inst.bin', 'w') as f:
-            for inst in inst_array:
-                f.write('{}'.format(inst))
-                f.write('\n')
-        return np.array(inst_array, dtype=np.int32)
+        inst_array, self.block_index, self.relocations = self._compile_macro_nodes(macro_node_array, optimal_tilings, array_n, array_m)
+        self.linker = Linker(self.relocations)
+
+        if double_buffer:
+            self.double_buffer = self._get_double_buffer(graph, macro_node_array, inst_array)
+
+        if binary_path is not None:
+            write_binary(binary_path, inst_array, self.block_index, array_n, array_m, acc_obj.prec,
+                         self.relocations, self.get_objective())
+        return inst_array
@@ -0,0 +1,124 @@
+import mmap
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from dnnweaver2.compiler.linker import Relocation
+
+# Bump whenever the layout of the binary changes
+BINARY_VERSION = 3
+BINARY_MAGIC = b'DNNW2BIN'
+
+# magic, version, array N, array M, precision, number of blocks,
+# number of relocations, number of instruction words, length of the tiling
+# objective in bytes
+_HEADER = struct.Struct('<8sIIIIIIII')
+# offset and length in words, length of the name in bytes
+_BLOCK_ENTRY = struct.Struct('<III')
+# instruction index, scratchpad, address index, addend, length of the tensor
+# name in bytes
+_RELOCATION_ENTRY = struct.Struct('<IIIqI')
+# The instructions start on a page boundary, so that they can be DMA'd
+# straight from the mapped file
+_ALIGNMENT = 4096
+
+INSTRUCTION_DTYPE = np.dtype('<u4')
+
+# Position of the instructions of a macro node in the instruction array
+BlockIndex = namedtuple('BlockIndex', ['Name', 'Offset', 'Length'])
+
+def _align(n):
+    return -(-n // _ALIGNMENT) * _ALIGNMENT
+
+def write_binary(path, inst_array, blocks, array_n, array_m, prec, relocations=(), objective=''):
+    """
+    Writes a compiled instruction array with its layer index
+    Layout: header, tiling objective, block table, block names, relocation
+    table, tensor names, then the instructions as little-endian uint32 words
+    from the next page boundary.
+    Args:
+        inst_array: instruction words, as returned by GraphCompiler.compile
+        blocks: list of BlockIndex, see GraphCompiler.block_index
+        array_n, array_m, prec: accelerator the instructions were compiled for
+        relocations: list of Relocation, see GraphCompiler.relocations
+        objective: objective of the tiling search, see
+                   GraphCompiler.get_objective
+    """
+    inst_array = np.asarray(inst_array, dtype=INSTRUCTION_DTYPE)
+    names = [b.Name.encode('utf-8') for b in blocks]
+    table = b''.join(_BLOCK_ENTRY.pack(b.Offset, b.Length, len(n)) for b, n in zip(blocks, names))
+    tensors = [r.Tensor.encode('utf-8') for r in relocations]
+    reloc_table = b''.join(_RELOCATION_ENTRY.pack(r.Index, r.Scratchpad, r.Addr_index, r.Addend, len(n))
+                           for r, n in zip(relocations, tensors))
+    objective = objective.encode('utf-8')
+    header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, array_n, array_m, prec,
+                          len(blocks), len(tensors), inst_array.size, len(objective))
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(objective)
+        f.write(table)
+        f.write(b''.join(names))
+        f.write(reloc_table)
+        f.write(b''.join(tensors))
+        f.seek(_align(f.tell()))
+        f.write(inst_array.tobytes())
+
+class InstructionBinary(object):
+    """
+    Memory-mapped instruction binary, see write_binary
+    instructions is a read-only uint32 array backed by the mapped file, that
+    can be passed to FPGAManager.write('pci_cl_data', ...). relocations can be
+    given to compiler.linker.Linker to place the tensors elsewhere. objective
+    is the tiling objective the instructions were compiled for.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, 'rb')
+        magic, version, self.array_n, self.array_m, self.prec, num_blocks, num_relocations, num_words, \
+            objective_size = _HEADER.unpack(self.fd.read(_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError('{} is not a dnnweaver2 instruction binary'.format(path))
+        if version != BINARY_VERSION:
+            raise ValueError('Binary {} has version {}, expected {}'.format(path, version, BINARY_VERSION))
+        self.objective = self.fd.read(objective_size).decode('utf-8')
+
+        entries = [_BLOCK_ENTRY.unpack(self.fd.read(_BLOCK_ENTRY.size)) for _ in range(num_blocks)]
+        self.blocks = []
+        for offset, length, name_size in entries:
+            name = self.fd.read(name_size).decode('utf-8')
+            self.blocks.append(BlockIndex(name, offset, length))
+        entries = [_RELOCATION_ENTRY.unpack(self.fd.read(_RELOCATION_ENTRY.size)) for _ in range(num_relocations)]
+        self.relocations = []
+        for index, scratchpad, addr_index, addend, name_size in entries:
+            tensor = self.fd.read(name_size).decode('utf-8')
+            self.relocations.append(Relocation(index, tensor, scratchpad, addr_index, addend))
+        data_start = _align(self.fd.tell())
+
+        self.mmap = mmap.mmap(self.fd.fileno(), 0, prot=mmap.PROT_READ)
+        self.instructions = np.frombuffer(self.mmap, dtype=INSTRUCTION_DTYPE, count=num_words,
+                                          offset=data_start)
+
+    def __len__(self):
+        return self.instructions.size
+
+    def block(self, name):
+        """
+        Returns the instructions of the macro node called name
+        """
+        for b in self.blocks:
+            if b.Name == name:
+                return self.instructions[b.Offset:b.Offset + b.Length]
+        raise KeyError(name)
+
+    def close(self):
+        # Drop the array first, the mapping cannot be closed while exported
+        self.instructions = None
+        self.mmap.close()
+        self.fd.close()
+
+def load_binary(path):
+    """
+    Returns an InstructionBinary for the file at path
+    """
+    return InstructionBinary(path)
@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+import numpy as np
+
+from dnnweaver2.isa import OPCodes
+
+# Base address instruction whose address depends on where a tensor is placed
+#   Index: position of the instruction word in its instruction array
+#   Tensor: name of the tensor
+#   Scratchpad, Addr_index: scratchpad_ID and index of the instruction
+#   Addend: bytes added to the tensor address, e.g. the offset of the padding
+Relocation = namedtuple('Relocation', ['Index', 'Tensor', 'Scratchpad', 'Addr_index', 'Addend'])
+
+# BaseAddressInstruction holds 21 bits of the address per index
+_ADDR_BITS = 21
+
+def base_address(stream, scratchpad, index, tensor, relocations=None, addend=0):
+    """
+    Appends the base address instruction for tensor to an InstructionStream,
+    and its Relocation to relocations if it is not None
+    """
+    if relocations is not None:
+        relocations.append(Relocation(len(stream), tensor.name, scratchpad, index, int(addend)))
+    return stream.base_address(scratchpad, index, tensor.fpga_addr + addend)
+
+def offset_relocations(relocations, offset):
+    """
+    Returns the relocations with their instruction index moved by offset
+    """
+    return [r._replace(Index=r.Index + offset) for r in relocations]
+
+class Linker(object):
+    """
+    Rewrites the base address words of compiled instructions for a new
+    placement of the tensors, without compiling again
+    Args:
+        relocations: list of Relocation, see GraphCompiler.relocations
+    """
+    def __init__(self, relocations):
+        self.tensors = sorted(set(r.Tensor for r in relocations))
+        tensor_id = dict((t, i) for i, t in enumerate(self.tensors))
+        self.index = np.array([r.Index for r in relocations], dtype=np.intp)
+        self.tensor_id = np.array([tensor_id[r.Tensor] for r in relocations], dtype=np.intp)
+        self.addend = np.array([r.Addend for r in relocations], dtype=np.int64)
+        self.shift = np.array([_ADDR_BITS * r.Addr_index for r in relocations], dtype=np.int64)
+        op_spec = np.array([(r.Scratchpad << 3) + r.Addr_index for r in relocations], dtype=np.uint32)
+        self.fixed = (np.uint32(OPCodes.BASE_ADDR) << np.uint32(28)) | (op_spec << np.uint32(21))
+
+    def __len__(self):
+        return self.index.size
+
+    def words(self, address_map):
+        """
+        Returns the base address words for address_map, a dict from tensor name
+        to DDR address, in the order of the relocations
+        """
+        try:
+            addr = np.array([address_map[t] for t in self.tensors], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError('No address for tensor {}'.format(e.args[0]))
+        addr_index = (addr[self.tensor_id] + self.addend) >> self.shift
+        # loop_id holds the 5 bits above the 16-bit immediate
+        return self.fixed | (addr_index & ((1 << _ADDR_BITS) - 1)).astype(np.uint32)
+
+    def link(self, inst_array, address_map, out=None):
+        """
+        Returns inst_array with the base addresses of address_map
+        Args:
+            out: array to write the result to, inst_array itself to patch in
+                 place, or None for a copy
+        """
+        if out is None:
+            out = np.array(inst_array, dtype=np.uint32)
+        elif out is not inst_array:
+            out[:] = inst_array
+        out[self.index] = self.words(address_map)
+        return out
+
+    def patches(self, inst_array, address_map):
+        """
+        Returns the (index, word) pairs of the instructions that change when
+        inst_array is linked for address_map
+        """
+        words = self.words(address_map)
+        changed = np.flatnonzero(np.asarray(inst_array)[self.index] != words)
+        return [(int(self.index[i]), int(words[i])) for i in changed]
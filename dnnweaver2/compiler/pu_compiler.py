@@ -3,6 +3,7 @@ from dnnweaver2.graph import Graph
 from dnnweaver2.tensor import Tensor
 
 from dnnweaver2.isa import *
+from dnnweaver2.compiler.linker import base_address
 
 from collections import OrderedDict, namedtuple
 import numpy as np
@@ -30,9 +31,13 @@ class PUCompiler(object):
     def release_reg(self, i):
         self.rf[i] = 0
 
-    def compile_layer(self, conv_tiling, conv_out_tensor, pu_ops, simd_lanes=4):
+    def compile_layer(self, conv_tiling, conv_out_tensor, pu_ops, simd_lanes=4, relocations=None):
         """
         Compiler for PU layers
+        Returns the instructions as an InstructionStream
+        Args:
+            relocations: list to append the Relocation of every tensor base
+                         address to, with indices into the returned stream
         """
 
         pool_pad = ((0,0), (0,0), (0,0), (0,0))
@@ -92,7 +97,9 @@ class PUCompiler(object):
                 'KW/kw': (0, 0)
             }
 
-        pu_inst_list = [None]
+        pu_inst_list = InstructionStream()
+        # Replaced by the PU block start once the block size is known
+        pu_inst_list.pu_block_start(0)
 
         conv_tile_shape = (b, oh, ow, oc)
         pool_tile_shape = (b, pool_oh, pool_ow, oc)
@@ -107,8 +114,8 @@ class PUCompiler(object):
 
         bn_pre_pool = False
 
-        bn_mean_addr = None
-        bn_scale_addr = None
+        bn_mean = None
+        bn_scale = None
 
         for op in pu_ops:
             if isinstance(op, BatchNorm):
@@ -116,8 +123,8 @@ class PUCompiler(object):
                 ld1_required = True
                 if pre_pool:
                     bn_pre_pool = True
-                bn_mean_addr = op.mean.fpga_addr
-                bn_scale_addr = op.scale.fpga_addr
+                bn_mean = op.mean
+                bn_scale = op.scale
             if isinstance(op, MaxPooling):
                 pool_op = op
                 pre_pool = False
@@ -133,42 +140,40 @@ class PUCompiler(object):
         else:
             t_out = conv_out_tensor
 
-        t_out_addr = t_out.fpga_addr
         pad_offset = 0
         for i in range(len(t_out.shape)):
             pad_offset += t_out.fpga_pad[i][0] * np.prod(t_out.fpga_shape[i+1:])
         pad_offset = int(pad_offset * t_out.dtype.bits / 8)
-        t_out_addr += pad_offset
 
-        pu_inst_list.append(BaseAddressInstruction(0,0,0))
+        pu_inst_list.base_address(0,0,0)
 
-        pu_inst_list.append(BaseAddressInstruction(1,0,t_out_addr))
-        pu_inst_list.append(BaseAddressInstruction(1,1,t_out_addr))
+        base_address(pu_inst_list, 1, 0, t_out, relocations, pad_offset)
+        base_address(pu_inst_list, 1, 1, t_out, relocations, pad_offset)
 
         if ld0_required:
-            pu_inst_list.append(BaseAddressInstruction(2,0,bn_mean_addr))
-            pu_inst_list.append(BaseAddressInstruction(2,1,bn_mean_addr))
+            base_address(pu_inst_list, 2, 0, bn_mean, relocations)
+            base_address(pu_inst_list, 2, 1, bn_mean, relocations)
         if ld1_required:
-            pu_inst_list.append(BaseAddressInstruction(3,0,bn_scale_addr))
-            pu_inst_list.append(BaseAddressInstruction(3,1,bn_scale_addr))
-
-        pu_inst_list.append(LoopInstruction(0, 0, pool_kw-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc))
-        pu_inst_list.append(LoopInstruction(0, 0, pool_kh-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc*ow))
-        pu_inst_list.append(LoopInstruction(0, 0, pool_ow-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc*pool_sw))
-        pu_inst_list.append(LoopInstruction(0, 0, pool_oh-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc*pool_sh*ow))
-        pu_inst_list.append(LoopInstruction(0, 0, oc-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, 1))
-        pu_inst_list.append(LoopInstruction(0, 0, b-1))
-        pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc*oh*ow))
+            base_address(pu_inst_list, 3, 0, bn_scale, relocations)
+            base_address(pu_inst_list, 3, 1, bn_scale, relocations)
+
+        pu_inst_list.loop(0, 0, pool_kw-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, oc)
+        pu_inst_list.loop(0, 0, pool_kh-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, oc*ow)
+        pu_inst_list.loop(0, 0, pool_ow-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, oc*pool_sw)
+        pu_inst_list.loop(0, 0, pool_oh-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, oc*pool_sh*ow)
+        pu_inst_list.loop(0, 0, oc-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, 1)
+        pu_inst_list.loop(0, 0, b-1)
+        pu_inst_list.gen_addr_low(0, 0, 0, oc*oh*ow)
 
         if ld0_required:
-            pu_inst_list.append(LDMemInstruction(2, 32, 0, 0))
+            pu_inst_list.ld_mem(2, 32, 0, 0)
         if ld1_required:
-            pu_inst_list.append(LDMemInstruction(3, 32, 0, 0))
+            pu_inst_list.ld_mem(3, 32, 0, 0)
 
         _pool_tile = {
             'B/b': b,
@@ -186,11 +191,11 @@ class PUCompiler(object):
                     P_B,P_OH,P_OW, P_OC = conv_out_tensor.fpga_shape
                 dim, dim_stride = pooled_output_strides[loop]
                 shape = (P_B,P_OH,P_OW,int(math.ceil(float(P_OC)/simd_lanes)))
-                pu_inst_list.append(LoopInstruction(5, 5, it[0]-1))
+                pu_inst_list.loop(5, 5, it[0]-1)
                 stride = int(np.prod(shape[dim+1:]) * dim_stride * 2 * simd_lanes) * _pool_tile[loop]
                 if stride > (1<<15):
-                    pu_inst_list.append(GenAddrHighInstruction(5, 5, 0, stride))
-                pu_inst_list.append(GenAddrLowInstruction(5, 5, 0, stride))
+                    pu_inst_list.gen_addr_high(5, 5, 0, stride)
+                pu_inst_list.gen_addr_low(5, 5, 0, stride)
                 base_addr_loops += 1
 
                 if loop == 'OC/oc' and ld0_required:
@@ -198,19 +203,19 @@ class PUCompiler(object):
                 else:
                     stride = 0
                 assert stride < (1<<15)
-                pu_inst_list.append(GenAddrLowInstruction(6, 6, 0, stride))
+                pu_inst_list.gen_addr_low(6, 6, 0, stride)
                 if loop == 'OC/oc' and ld1_required:
                     stride = 2 * simd_lanes * oc
                 else:
                     stride = 0
                 assert stride < (1<<15)
-                pu_inst_list.append(GenAddrLowInstruction(7, 7, 0, stride))
+                pu_inst_list.gen_addr_low(7, 7, 0, stride)
 
         if base_addr_loops == 0:
-            pu_inst_list.append(LoopInstruction(5, 5, 0))
-            pu_inst_list.append(GenAddrLowInstruction(5, 5, 0, 0))
-            pu_inst_list.append(GenAddrLowInstruction(6, 6, 0, 0))
-            pu_inst_list.append(GenAddrLowInstruction(7, 7, 0, 0))
+            pu_inst_list.loop(5, 5, 0)
+            pu_inst_list.gen_addr_low(5, 5, 0, 0)
+            pu_inst_list.gen_addr_low(6, 6, 0, 0)
+            pu_inst_list.gen_addr_low(7, 7, 0, 0)
 
         if len(pu_ops) > 0:
             P_B, P_OH, P_OW, P_OC = pu_ops[-1].output_tensors.fpga_shape
@@ -218,51 +223,51 @@ class PUCompiler(object):
             P_B, P_OH, P_OW, P_OC = conv_out_tensor.fpga_shape
         P_OC = int(math.ceil(P_OC / float(simd_lanes)))
 
-        pu_inst_list.append(LoopInstruction(1, 1, pool_ow-1))
+        pu_inst_list.loop(1, 1, pool_ow-1)
         if P_OC > (1<<15):
-            pu_inst_list.append(GenAddrHighInstruction(1, 1, 0, P_OC))
-        pu_inst_list.append(GenAddrLowInstruction(1, 1, 0, P_OC))
-        pu_inst_list.append(LoopInstruction(1, 1, pool_oh-1))
+            pu_inst_list.gen_addr_high(1, 1, 0, P_OC)
+        pu_inst_list.gen_addr_low(1, 1, 0, P_OC)
+        pu_inst_list.loop(1, 1, pool_oh-1)
         if P_OC*P_OW > (1<<15):
-            pu_inst_list.append(GenAddrHighInstruction(1, 1, 0, P_OC*P_OW))
-        pu_inst_list.append(GenAddrLowInstruction(1, 1, 0, P_OC*P_OW))
-        pu_inst_list.append(LoopInstruction(1, 1, oc-1))
-        pu_inst_list.append(GenAddrLowInstruction(1, 1, 0, 1))
-        pu_inst_list.append(LoopInstruction(1, 1, b-1))
+            pu_inst_list.gen_addr_high(1, 1, 0, P_OC*P_OW)
+        pu_inst_list.gen_addr_low(1, 1, 0, P_OC*P_OW)
+        pu_inst_list.loop(1, 1, oc-1)
+        pu_inst_list.gen_addr_low(1, 1, 0, 1)
+        pu_inst_list.loop(1, 1, b-1)
         if P_OC*P_OW*P_OH > (1<<15):
-            pu_inst_list.append(GenAddrHighInstruction(1, 1, 0, P_OC*P_OW*P_OH))
-        pu_inst_list.append(GenAddrLowInstruction(1, 1, 0, P_OC*P_OH*P_OW))
+            pu_inst_list.gen_addr_high(1, 1, 0, P_OC*P_OW*P_OH)
+        pu_inst_list.gen_addr_low(1, 1, 0, P_OC*P_OH*P_OW)
 
 
         if ld0_required:
             # if bn_pre_pool:
-            #     pu_inst_list.append(LoopInstruction(2, 2, pool_kw-1))
-            #     pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 0))
-            #     pu_inst_list.append(LoopInstruction(2, 2, pool_kh-1))
-            #     pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 0))
-            pu_inst_list.append(LoopInstruction(2, 2, pool_ow-1))
-            pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 0))
-            pu_inst_list.append(LoopInstruction(2, 2, pool_oh-1))
-            pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 0))
-            pu_inst_list.append(LoopInstruction(2, 2, oc-1))
-            pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 1))
-            pu_inst_list.append(LoopInstruction(2, 2, b-1))
-            pu_inst_list.append(GenAddrLowInstruction(2, 2, 0, 0))
+            #     pu_inst_list.loop(2, 2, pool_kw-1)
+            #     pu_inst_list.gen_addr_low(2, 2, 0, 0)
+            #     pu_inst_list.loop(2, 2, pool_kh-1)
+            #     pu_inst_list.gen_addr_low(2, 2, 0, 0)
+            pu_inst_list.loop(2, 2, pool_ow-1)
+            pu_inst_list.gen_addr_low(2, 2, 0, 0)
+            pu_inst_list.loop(2, 2, pool_oh-1)
+            pu_inst_list.gen_addr_low(2, 2, 0, 0)
+            pu_inst_list.loop(2, 2, oc-1)
+            pu_inst_list.gen_addr_low(2, 2, 0, 1)
+            pu_inst_list.loop(2, 2, b-1)
+            pu_inst_list.gen_addr_low(2, 2, 0, 0)
 
         if ld1_required:
             # if bn_pre_pool:
-            #     pu_inst_list.append(LoopInstruction(3, 3, pool_kw-1))
-            #     pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 0))
-            #     pu_inst_list.append(LoopInstruction(3, 3, pool_kh-1))
-            #     pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 0))
-            pu_inst_list.append(LoopInstruction(3, 3, pool_ow-1))
-            pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 0))
-            pu_inst_list.append(LoopInstruction(3, 3, pool_oh-1))
-            pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 0))
-            pu_inst_list.append(LoopInstruction(3, 3, oc-1))
-            pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 1))
-            pu_inst_list.append(LoopInstruction(3, 3, b-1))
-            pu_inst_list.append(GenAddrLowInstruction(3, 3, 0, 0))
+            #     pu_inst_list.loop(3, 3, pool_kw-1)
+            #     pu_inst_list.gen_addr_low(3, 3, 0, 0)
+            #     pu_inst_list.loop(3, 3, pool_kh-1)
+            #     pu_inst_list.gen_addr_low(3, 3, 0, 0)
+            pu_inst_list.loop(3, 3, pool_ow-1)
+            pu_inst_list.gen_addr_low(3, 3, 0, 0)
+            pu_inst_list.loop(3, 3, pool_oh-1)
+            pu_inst_list.gen_addr_low(3, 3, 0, 0)
+            pu_inst_list.loop(3, 3, oc-1)
+            pu_inst_list.gen_addr_low(3, 3, 0, 1)
+            pu_inst_list.loop(3, 3, b-1)
+            pu_inst_list.gen_addr_low(3, 3, 0, 0)
 
         compute_instructions = []
 
@@ -372,20 +377,17 @@ class PUCompiler(object):
             dest_reg = self.release_reg(dest_reg)
 
         for inst in compute_instructions:
-            pu_inst_list.append(inst)
+            inst.emit(pu_inst_list)
 
 
         num_repeats = b * pool_ow * pool_oh * oc
-        pu_inst_list.append(PUBlockRepeat(num_repeats))
+        pu_inst_list.pu_block_repeat(num_repeats)
 
         for i in self.rf:
             assert i == 0
 
-        inst_array = []
         if len(pu_inst_list) > 1:
-            pu_inst_list[0] = PUBlockStart(len(pu_inst_list)-2)
-            for i in pu_inst_list:
-                inst_array.append(i.get_binary())
-            return inst_array
+            pu_inst_list.set(0, OPCodes.PU_BLOCK, 0, 0, len(pu_inst_list)-2)
+            return pu_inst_list
         else:
             return None
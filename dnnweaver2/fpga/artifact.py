@@ -0,0 +1,156 @@
+import json
+import logging
+import mmap
+import struct
+
+import numpy as np
+
+from dnnweaver2.fpga.memspace import MemSpace, _as_uint8
+from dnnweaver2.tensor import Tensor
+from dnnweaver2.scalar.dtypes import FixedPoint
+
+# Bump whenever the layout of the artifact changes
+ARTIFACT_VERSION = 1
+ARTIFACT_MAGIC = b'DNNW2ART'
+
+# magic, version, header size
+_PREAMBLE = struct.Struct('<8sIQ')
+# Regions start on page boundaries, so that they can be DMA'd straight from
+# the mapped file
+_ALIGNMENT = 4096
+# Regions are replayed in chunks of this many bytes
+_CHUNK = 1 << 24
+
+def _align(n):
+    return -(-n // _ALIGNMENT) * _ALIGNMENT
+
+class RecordingMemSpace(MemSpace):
+    """
+    Memory space that records the writes to the instruction memory and DDR
+    All-zero writes are recorded without their data.
+    """
+    def __init__(self, log_level=logging.INFO):
+        self.log = logging.getLogger('Recording Memspace')
+        self.log.setLevel(log_level)
+        # (namespace, addr, size, bytes or None for zeros)
+        self.regions = []
+
+    def write(self, namespace, addr, data):
+        assert namespace in self.namespaces
+        if namespace == 'pci_cl_ctrl':
+            raise ValueError('Control register writes cannot be recorded')
+        data = _as_uint8(data)
+        if data.any():
+            self.regions.append((namespace, int(addr), data.size, data.tobytes()))
+        else:
+            self.regions.append((namespace, int(addr), data.size, None))
+        self.log.debug('Recorded {} bytes at {} address {}'.format(data.size, namespace, addr))
+
+    def read(self, namespace, addr, size=None):
+        if namespace == 'pci_cl_ctrl':
+            return 0
+        raise ValueError('Reads from {} cannot be recorded'.format(namespace))
+
+def _tensor_to_dict(t):
+    return {'name': t.name, 'shape': list(t.shape), 'fpga_pad': [list(p) for p in t.fpga_pad],
+            'fpga_addr': int(t.fpga_addr), 'bits': t.dtype.bits, 'frac_bits': t.dtype.frac_bits}
+
+def _tensor_from_dict(d):
+    t = Tensor(tuple(d['shape']), d['name'], None, dtype=FixedPoint(d['bits'], d['frac_bits']))
+    t.fpga_pad = tuple(tuple(p) for p in d['fpga_pad'])
+    t.fpga_addr = d['fpga_addr']
+    return t
+
+def write_artifact(path, regions, input_t, output_t, address_map, double_buffer=None, name=None):
+    """
+    Writes a deployment artifact
+    Args:
+        regions: list of (namespace, addr, size, data) writes, in the order in
+                 which they must be replayed, as recorded by RecordingMemSpace
+        input_t, output_t: graph input and output tensors
+        address_map: dict from tensor name to DDR address
+        double_buffer: GraphCompiler.double_buffer, or None
+    """
+    offset = 0
+    region_desc = []
+    for namespace, addr, size, data in regions:
+        desc = {'namespace': namespace, 'addr': addr, 'size': size, 'offset': None}
+        if data is not None:
+            desc['offset'] = offset
+            offset = _align(offset + size)
+        region_desc.append(desc)
+
+    header = {'version': ARTIFACT_VERSION,
+              'name': name,
+              'input': _tensor_to_dict(input_t),
+              'output': _tensor_to_dict(output_t),
+              'address_map': address_map,
+              'double_buffer': None,
+              'regions': region_desc}
+    if double_buffer is not None:
+        header['double_buffer'] = {'input_addr': int(double_buffer.Input_addr),
+                                   'output_addr': int(double_buffer.Output_addr),
+                                   'patches': [[int(x) for x in p] for p in double_buffer.Patches]}
+    header = json.dumps(header).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, len(header)))
+        f.write(header)
+        for (namespace, addr, size, data), desc in zip(regions, region_desc):
+            if data is not None:
+                f.seek(data_start + desc['offset'])
+                f.write(data)
+        f.truncate(data_start + offset)
+
+class Artifact(object):
+    """
+    Memory-mapped deployment artifact, see FPGAManager.build_artifact
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, 'rb')
+        magic, version, header_size = _PREAMBLE.unpack(self.fd.read(_PREAMBLE.size))
+        if magic != ARTIFACT_MAGIC:
+            raise ValueError('{} is not a dnnweaver2 artifact'.format(path))
+        if version != ARTIFACT_VERSION:
+            raise ValueError('Artifact {} has version {}, expected {}'.format(path, version, ARTIFACT_VERSION))
+        self.header = json.loads(self.fd.read(header_size).decode('utf-8'))
+        self.data_start = _align(_PREAMBLE.size + header_size)
+        self.mmap = mmap.mmap(self.fd.fileno(), 0, prot=mmap.PROT_READ)
+
+        self.name = self.header['name']
+        self.address_map = self.header['address_map']
+        self.input_t = _tensor_from_dict(self.header['input'])
+        self.output_t = _tensor_from_dict(self.header['output'])
+        self.double_buffer = None
+        if self.header['double_buffer'] is not None:
+            # Imported here, the compiler is not needed otherwise
+            from dnnweaver2.compiler import DoubleBuffer
+            d = self.header['double_buffer']
+            self.double_buffer = DoubleBuffer(d['input_addr'], d['output_addr'],
+                                              [tuple(p) for p in d['patches']])
+
+    def regions(self):
+        """
+        Yields the (namespace, addr, data) writes to replay, where data is a
+        uint8 array of at most _CHUNK bytes
+        The data is copied out of the mapped file, so the file can be closed
+        even if a failed write still holds on to it.
+        """
+        zeros = None
+        for r in self.header['regions']:
+            for start in range(0, r['size'], _CHUNK):
+                size = min(_CHUNK, r['size'] - start)
+                if r['offset'] is not None:
+                    yield r['namespace'], r['addr'] + start, \
+                            np.frombuffer(self.mmap, dtype=np.uint8, count=size,
+                                          offset=self.data_start + r['offset'] + start).copy()
+                    continue
+                if zeros is None or size > zeros.size:
+                    zeros = np.zeros(size, dtype=np.uint8)
+                yield r['namespace'], r['addr'] + start, zeros[:size]
+
+    def close(self):
+        self.mmap.close()
+        self.fd.close()
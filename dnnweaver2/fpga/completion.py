@@ -0,0 +1,137 @@
+import abc
+from time import sleep
+from timeit import default_timer as timer
+
+class WaitStats(object):
+    """
+    Counters for the time spent waiting for the accelerator
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.num_waits = 0
+        self.num_polls = 0
+        self.num_timeouts = 0
+        self.total_time = 0.
+        self.max_time = 0.
+
+    def record(self, elapsed, num_polls):
+        self.num_waits += 1
+        self.num_polls += num_polls
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    @property
+    def mean_time(self):
+        if self.num_waits == 0:
+            return 0.
+        return self.total_time / self.num_waits
+
+    def __str__(self):
+        return 'waits: {}, polls: {}, timeouts: {}, mean: {:.3f} ms, max: {:.3f} ms'.format(
+                self.num_waits, self.num_polls, self.num_timeouts,
+                self.mean_time * 1e3, self.max_time * 1e3)
+
+class WaitStrategy(abc.ABC):
+    """
+    Interface for the ways of waiting between polls of the accelerator
+    """
+
+    @abc.abstractmethod
+    def delays(self, start):
+        """
+        Yields the time in seconds to sleep before each poll
+        Args:
+            start: timer() value when the wait started
+        """
+        pass
+
+class SpinWait(WaitStrategy):
+    """
+    Polls without sleeping: lowest latency, but uses a full core
+    """
+    def delays(self, start):
+        while True:
+            yield 0
+
+class BackoffWait(WaitStrategy):
+    """
+    Sleeps between polls, doubling the sleep up to max_delay
+    """
+    def __init__(self, initial_delay=1e-5, max_delay=1e-3, factor=2.):
+        assert 0 < initial_delay <= max_delay
+        assert factor >= 1
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+
+    def delays(self, start):
+        delay = self.initial_delay
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.max_delay)
+
+class HybridWait(BackoffWait):
+    """
+    Spins for spin_time seconds, then backs off as BackoffWait
+    Short runs finish with spin latency, long runs do not hold a core.
+    """
+    def __init__(self, spin_time=1e-4, initial_delay=1e-5, max_delay=1e-4, factor=2.):
+        super(HybridWait, self).__init__(initial_delay, max_delay, factor)
+        self.spin_time = spin_time
+
+    def delays(self, start):
+        while timer() - start < self.spin_time:
+            yield 0
+        for delay in super(HybridWait, self).delays(start):
+            yield delay
+
+def get_wait_strategy(strategy='hybrid', **kwargs):
+    """
+    Returns the wait strategy for a name
+    Args:
+        strategy: 'spin', 'backoff' or 'hybrid'
+        kwargs: arguments of BackoffWait or HybridWait
+    """
+    if strategy == 'spin':
+        return SpinWait(**kwargs)
+    elif strategy == 'backoff':
+        return BackoffWait(**kwargs)
+    elif strategy == 'hybrid':
+        return HybridWait(**kwargs)
+    else:
+        raise ValueError('Unknown wait strategy: {}'.format(strategy))
+
+def wait_until(poll, strategy, timeout=None, stats=None):
+    """
+    Calls poll until it returns True, sleeping as given by strategy
+    Args:
+        poll: function returning True when done
+        timeout: seconds after which an IOError is raised, or None to wait
+                 forever
+        stats: WaitStats to record the wait in
+    Returns the time spent waiting, in seconds.
+    """
+    start = timer()
+    num_polls = 1
+    done = poll()
+    if not done:
+        for delay in strategy.delays(start):
+            now = timer()
+            if timeout is not None and now - start >= timeout:
+                if stats is not None:
+                    stats.num_timeouts += 1
+                    stats.record(now - start, num_polls)
+                raise IOError('Timed out after {:.3f} s and {} polls'.format(now - start, num_polls))
+            if delay > 0:
+                if timeout is not None:
+                    delay = min(delay, start + timeout - now)
+                sleep(delay)
+            num_polls += 1
+            if poll():
+                break
+    elapsed = timer() - start
+    if stats is not None:
+        stats.record(elapsed, num_polls)
+    return elapsed
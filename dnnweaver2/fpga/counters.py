@@ -0,0 +1,160 @@
+import json
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+# Fields of the control registers
+#   Index: 32-bit register index, Shift/Bits: position of the field
+#   Kind: 'counter' for counts that only grow (and wrap), 'level' for FIFO
+#         fill levels, 'state' for state machine encodings
+Register = namedtuple('Register', ['Name', 'Index', 'Shift', 'Bits', 'Kind'])
+
+REGISTER_MAP = (
+    Register('accelerator_state',          2,  0, 32, 'state'),
+    Register('tag_req_count',              3,  0, 32, 'counter'),
+    Register('compute_done_count',         4,  0, 32, 'counter'),
+    Register('pu_compute_done_count',      5,  0, 32, 'counter'),
+    Register('pu_compute_start_count',     6,  0, 32, 'counter'),
+    Register('stmem_tag',                  7,  0,  1, 'state'),
+    Register('stmem_ddr_pe_sw',            7,  1,  1, 'state'),
+    Register('stmem_state',                7, 16, 16, 'state'),
+    Register('ld0_stream_write_count',    13,  0, 16, 'counter'),
+    Register('ld0_stream_read_count',     13, 16, 16, 'counter'),
+    Register('ld1_stream_write_count',    14,  0, 16, 'counter'),
+    Register('ld1_stream_read_count',     14, 16, 16, 'counter'),
+    Register('pu_axi_awbuf_fifo_count',   15,  0, 16, 'level'),
+    Register('pu_axi_wdata_fifo_count',   15, 16, 16, 'level'),
+    Register('ibuf_rd_req',               16,  0, 32, 'counter'),
+    Register('ibuf_rd_finished',          17,  0, 32, 'counter'),
+    Register('obuf_wr_req',               18,  0, 32, 'counter'),
+    Register('obuf_wr_finished',          19,  0, 32, 'counter'),
+    Register('obuf_rd_req',               20,  0, 32, 'counter'),
+    Register('obuf_rd_finished',          21,  0, 32, 'counter'),
+    Register('obuf_ld_stream_write_count', 22,  0, 16, 'counter'),
+    Register('obuf_ld_stream_read_count', 22, 16, 16, 'counter'),
+    Register('ddr_st_stream_write_count', 23,  0, 16, 'counter'),
+    Register('ddr_st_stream_read_count',  23, 16, 16, 'counter'),
+    Register('ddr_st_stream_fifo_count',  24,  0, 16, 'level'),
+    Register('obuf_ld_stream_fifo_count', 24, 16, 16, 'level'),
+    Register('ddr_ld0_stream_fifo_count', 25,  0, 16, 'level'),
+    Register('ddr_ld1_stream_fifo_count', 25, 16, 16, 'level'),
+    Register('pu_wr_req',                 26,  0, 32, 'counter'),
+    Register('pu_wr_finished',            27,  0, 32, 'counter'),
+    Register('pu_rd_req',                 28,  0, 32, 'counter'),
+    Register('pu_rd_finished',            29,  0, 32, 'counter'),
+    Register('pu_state',                  30,  0, 32, 'state'),
+    Register('pu_obuf_reads',             31,  0, 32, 'counter'),
+)
+
+# The registers are read as one window starting at register 0
+NUM_REGISTERS = max(r.Index for r in REGISTER_MAP) + 1
+
+COUNTER_DTYPE = np.dtype([(r.Name, np.uint32) for r in REGISTER_MAP])
+
+_index = np.array([r.Index for r in REGISTER_MAP], dtype=np.intp)
+_shift = np.array([r.Shift for r in REGISTER_MAP], dtype=np.uint32)
+_mask = np.array([(1 << r.Bits) - 1 for r in REGISTER_MAP], dtype=np.uint64).astype(np.uint32)
+_is_counter = np.array([r.Kind == 'counter' for r in REGISTER_MAP])
+
+def decode_registers(words):
+    """
+    Decodes the register window, an array of NUM_REGISTERS uint32 words,
+    into a record of COUNTER_DTYPE
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    assert words.size >= NUM_REGISTERS
+    values = (words[_index] >> _shift) & _mask
+    return values.view(COUNTER_DTYPE)[0]
+
+def counter_delta(before, after):
+    """
+    Returns a record with the change of each counter between two snapshots,
+    modulo the counter width, and the final value of the other fields
+    """
+    before = before.reshape(1).view(np.uint32)
+    after = after.reshape(1).view(np.uint32)
+    delta = np.where(_is_counter, (after - before) & _mask, after).astype(np.uint32)
+    return delta.view(COUNTER_DTYPE)[0]
+
+class CounterHistory(object):
+    """
+    Rolling window of the counter deltas of the last runs
+    """
+    def __init__(self, window=1024):
+        assert window > 0
+        self.window = window
+        self.deltas = np.zeros(window, dtype=COUNTER_DTYPE)
+        self.times = np.zeros(window, dtype=np.float64)
+        self.num_runs = 0
+
+    def __len__(self):
+        return min(self.num_runs, self.window)
+
+    def record(self, delta, elapsed):
+        i = self.num_runs % self.window
+        self.deltas[i] = delta
+        self.times[i] = elapsed
+        self.num_runs += 1
+
+    def values(self, field):
+        """
+        Returns the values of field, or 'time' for the run times, over the
+        window
+        """
+        if field == 'time':
+            return self.times[:len(self)]
+        return self.deltas[field][:len(self)]
+
+    def histogram(self, field, bins=16):
+        return np.histogram(self.values(field), bins=bins)
+
+    def summary(self, bins=16):
+        fields = OrderedDict()
+        for name in ('time',) + COUNTER_DTYPE.names:
+            v = self.values(name)
+            if v.size == 0:
+                continue
+            counts, edges = np.histogram(v, bins=bins)
+            fields[name] = OrderedDict([
+                ('min', float(v.min())),
+                ('max', float(v.max())),
+                ('mean', float(v.mean())),
+                ('p50', float(np.percentile(v, 50))),
+                ('p99', float(np.percentile(v, 99))),
+                ('hist_counts', counts.tolist()),
+                ('hist_edges', edges.tolist()),
+                ])
+        return OrderedDict([('num_runs', self.num_runs), ('window', len(self)), ('fields', fields)])
+
+class PerfCounters(object):
+    """
+    Counter deltas of the runs of the accelerator, kept per label
+    The label groups runs, e.g. by graph or by layer when the instructions
+    of a layer are run on their own.
+    """
+    def __init__(self, window=1024):
+        self.window = window
+        self.history = OrderedDict()
+        self.last_delta = None
+
+    def record(self, before, after, elapsed, label='inference'):
+        delta = counter_delta(before, after)
+        if label not in self.history:
+            self.history[label] = CounterHistory(self.window)
+        self.history[label].record(delta, elapsed)
+        self.last_delta = delta
+        return delta
+
+    def summary(self, bins=16):
+        return OrderedDict((label, h.summary(bins)) for label, h in self.history.items())
+
+    def to_json(self, path=None, bins=16):
+        """
+        Returns the summary of every label as a JSON string, and writes it to
+        path if given
+        """
+        s = json.dumps(self.summary(bins), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(s)
+        return s
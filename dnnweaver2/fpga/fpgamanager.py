@@ -1,17 +1,22 @@
 import sys
 import logging
 import numpy as np
-import itertools
 import array
 import math
+import zlib
 from time import time, sleep
+from timeit import default_timer as timer
 
-from dnnweaver2.fpga.memspace import FPGAMemSpace
+from dnnweaver2.fpga.memspace import MemSpace, get_memspace, aligned_empty
+from dnnweaver2.fpga.artifact import RecordingMemSpace, Artifact, write_artifact
+from dnnweaver2.fpga.completion import WaitStrategy, WaitStats, get_wait_strategy, wait_until
+from dnnweaver2.fpga.counters import PerfCounters, decode_registers, NUM_REGISTERS
 from dnnweaver2.tensorOps.cnn import Convolution, BatchNorm
+from dnnweaver2.utils.utils import LRUCache
 
 
 def ddr_to_np_array(ddr, start, end, dtype):
-    return np.array(array.array(get_dtype_str(dtype), ddr[start:end].tobytes()))
+    return np.frombuffer(ddr[start:end], dtype=get_dtype_str(dtype)).copy()
 
 def ceilAByB(a, b):
     return int(math.ceil(a / float(b)))
@@ -19,38 +24,51 @@ def ceilAByB(a, b):
 def _pad_tensor(t, pad_value=0):
     return np.pad(t.data, t.fpga_pad, 'constant', constant_values=(pad_value, pad_value))
 
+# Gather indices for data_transform, keyed by (idx_list, stride_list, size)
+_layout_index_cache = LRUCache(64)
+
+def get_layout_index(idx_list, stride_list, size):
+    """
+    Returns the int64 array of input indices for data_transform, in DDR order
+    """
+    key = (tuple(idx_list), tuple(stride_list), size)
+    index = _layout_index_cache.get(key)
+    if index is None:
+        index = np.zeros((), dtype=np.int64)
+        for n, s in zip(idx_list, stride_list):
+            index = np.add.outer(index, np.arange(n, dtype=np.int64) * s)
+        index = index.reshape(-1)
+        if index.size > 0 and (index.min() < 0 or index.max() >= size):
+            raise IndexError('Layout accesses element {} of an array of size {}'.format(
+                index.min() if index.min() < 0 else index.max(), size))
+        index.setflags(write=False)
+        _layout_index_cache.put(key, index)
+    return index
+
 def data_transform(arr, idx_list, stride_list, verbose=False):
-#    t1 = time()
-    arr_size = arr.size
-    shape = arr.shape
-    arr = arr.flatten()
-#    t2 = time()
-    ddr_arr = np.empty(arr_size, dtype=arr.dtype)
-#    t3 = time()
-    stride_list = np.array(stride_list)
-#    t4 = time()
-    ddr_idx = 0
-#    dot_sum = 0.0
-#    rest_sum = 0.0
-    for indices in itertools.product(*[range(x) for x in idx_list]):
-#        t4_1 = time()
-        input_idx = np.dot(stride_list, indices)
-#        t4_2 = time()
-#        dot_sum += t4_2 - t4_1
-        if verbose:
-            print(stride_list, indices, input_idx, arr[input_idx])
-        ddr_arr[ddr_idx] = arr[input_idx]
-        ddr_idx += 1
-#        t4_3 = time()
-#        rest_sum = t4_3 - t4_2
-#    t5 = time()
-#    string = "data_transform time: %.4f %.4f %.4f %.4f %.4f %.4f" % ((t2-t1), (t3-t2), (t4-t3), (t5-t4), dot_sum, rest_sum)
-#    sys.stdout.write("\r" + str(string) + "\n")
-#    sys.stdout.flush()
+    """
+    Reorders arr into DDR layout: the output walks the index space idx_list
+    in row-major order and element (i_0, i_1, ...) is arr.flat[sum(i_k * s_k)]
+    Non-negative strides are gathered with a strided view of arr. Other
+    layouts use a cached index array.
+    """
+    arr = np.ascontiguousarray(arr).reshape(-1)
+    idx_list = [int(n) for n in idx_list]
+    stride_list = [int(s) for s in stride_list]
+    if len(idx_list) == 0 or 0 in idx_list:
+        ddr_arr = arr[:1 if len(idx_list) == 0 else 0].copy()
+    elif min(stride_list) >= 0 and sum((n - 1) * s for n, s in zip(idx_list, stride_list)) < arr.size:
+        view = np.lib.stride_tricks.as_strided(arr, shape=idx_list,
+                                               strides=[s * arr.itemsize for s in stride_list],
+                                               writeable=False)
+        ddr_arr = view.reshape(-1)
+        if np.may_share_memory(ddr_arr, arr):
+            ddr_arr = ddr_arr.copy()
+    else:
+        ddr_arr = np.take(arr, get_layout_index(idx_list, stride_list, arr.size))
 
-    # ddr_arr = ddr_arr.reshape(shape)
     if verbose:
-        print(ddr_arr.flatten().reshape(ddr_arr.size/4,4))
+        print(ddr_arr.flatten().reshape(ddr_arr.size//4,4))
     return ddr_arr
 
 def np_array_to_ddr(arr, idx_list, stride_list, verbose=False):
@@ -73,6 +91,46 @@ def np_array_to_ddr(arr, idx_list, stride_list, verbose=False):
 #    return np.array(array.array(dtype_str, ddr_arr.tobytes()), dtype=np.int8)
     return ddr_arr
 
+def get_halo_runs(shape, pad, itemsize, max_gap=4096):
+    """
+    Returns (starts, sizes) in bytes of contiguous runs that cover the
+    padding of a tensor in DDR, with the given padding and element size
+    Padding in the last (channel) dimension is ignored, since it is only
+    ever multiplied by zero weights. Runs separated by at most max_gap bytes
+    are merged, so a run can also cover part of the interior.
+    """
+    nd = len(shape)
+    fpga_shape = [n + lo + hi for n, (lo, hi) in zip(shape, pad)]
+    strides = [int(np.prod(fpga_shape[d+1:])) * itemsize for d in range(nd)]
+    halo_dims = [d for d in range(nd-1) if pad[d][0] + pad[d][1] > 0]
+    if len(halo_dims) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # For each dim, the lo and hi padding blocks of every interior index of
+    # the outer dims
+    starts = []
+    sizes = []
+    prefix = np.zeros(1, dtype=np.int64)
+    for d in range(halo_dims[-1] + 1):
+        lo, hi = pad[d]
+        for size, offset in ((lo, 0), (hi, lo + shape[d])):
+            if size > 0:
+                starts.append(prefix + offset * strides[d])
+                sizes.append(np.full(prefix.size, size * strides[d], dtype=np.int64))
+        prefix = np.add.outer(prefix, (lo + np.arange(shape[d], dtype=np.int64)) * strides[d]).reshape(-1)
+    starts = np.concatenate(starts)
+    ends = starts + np.concatenate(sizes)
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+
+    first = np.ones(starts.size, dtype=bool)
+    first[1:] = starts[1:] > np.maximum.accumulate(ends)[:-1] + max_gap
+    idx = np.flatnonzero(first)
+    run_starts = starts[idx]
+    run_ends = np.maximum.reduceat(ends, idx)
+    return run_starts, run_ends - run_starts
+
 def get_dtype_str(dtype):
     if dtype == np.int8:
         dtype_str = 'B'
@@ -89,28 +147,126 @@ class FPGAManager(object):
             pci_cl_ctrl_device='/dev/xdma0_user',
             c2h_dma_device='/dev/xdma0_c2h_0',
             h2c_dma_device='/dev/xdma0_h2c_0',
+            backend='xdma',
+            memspace_args=None,
+            wait_strategy='hybrid',
+            wait_timeout=None,
+            collect_counters=True,
+            counter_window=1024,
             log_level=logging.INFO):
+        """
+        Args:
+            backend: 'xdma' for the board, or 'file' and 'numpy' to emulate
+                     the memory spaces, see memspace.get_memspace. A
+                     MemSpace object is used as is.
+            memspace_args: extra arguments for the emulated backends, e.g.
+                           {'path': 'ddr.bin', 'ddr_size': 1<<30}
+            wait_strategy: how wait_fpga_execution polls the accelerator,
+                           'spin', 'backoff' or 'hybrid', see
+                           completion.get_wait_strategy. A WaitStrategy
+                           object is used as is.
+            wait_timeout: default timeout of wait_fpga_execution in
+                          seconds, or None to wait forever
+            collect_counters: snapshot the performance counters around
+                              every run, and keep the deltas of the last
+                              counter_window runs in perf_counters
+        """
         self.log = logging.getLogger('FPGA Manager')
         self.log.setLevel(log_level)
-        self.fpga_memspace = FPGAMemSpace(
-                pci_cl_ctrl_device=pci_cl_ctrl_device,
-                c2h_dma_device=c2h_dma_device,
-                h2c_dma_device=h2c_dma_device,
-                log_level=logging.INFO)
+        if memspace_args is None:
+            memspace_args = {}
+        if isinstance(backend, MemSpace):
+            self.fpga_memspace = backend
+        elif backend == 'xdma':
+            memspace_args = dict(memspace_args,
+                    pci_cl_ctrl_device=pci_cl_ctrl_device,
+                    c2h_dma_device=c2h_dma_device,
+                    h2c_dma_device=h2c_dma_device)
+        if not isinstance(backend, MemSpace):
+            self.fpga_memspace = get_memspace(backend, log_level=log_level, **memspace_args)
+        if isinstance(wait_strategy, WaitStrategy):
+            self.wait_strategy = wait_strategy
+        else:
+            self.wait_strategy = get_wait_strategy(wait_strategy)
+        self.wait_timeout = wait_timeout
+        self.wait_stats = WaitStats()
+        self.collect_counters = collect_counters
+        self.perf_counters = PerfCounters(counter_window)
+        # Counters, time and label of the run in progress
+        self._run_start = None
         self.input_op = None
+        self.input_t = None
         self.output_t = None
+        # Second set of input/output buffers from GraphCompiler.double_buffer,
+        # and the index of the set that the loaded instructions use
+        self.double_buffer = None
+        self.curr_buffer = 0
+        # (addr, size) -> contents of the DDR regions written by
+        # initialize_graph, so that initializing again can skip them
+        self.ddr_manifest = {}
+        self._fill_pages = {}
+        # Padded input buffer reused by send_input_nparr and send_input_image
+        self._input_staging = None
+        self._input_scratch = None
+
+    def _get_input_staging(self):
+        """
+        Returns the persistent staging buffer for the input tensor, padded as
+        in DDR with a zero halo, and a view of its interior
+        """
+        tin = self.input_t
+        if self._input_staging is None or self._input_staging.shape != tin.fpga_shape:
+            self._input_staging = aligned_empty(tin.fpga_shape, np.int16)
+            self._input_staging.fill(0)
+            self._input_scratch = np.empty(tin.shape, dtype=np.float32)
+        interior = self._unpad_tensor(tin, self._input_staging)
+        return self._input_staging, interior
+
+    def send_input_image(self, image, scale=1.0, addr=None):
+        """
+        Quantizes a float or uint8 image to the input tensor's fixed-point
+        format, with rounding and saturation, and sends it to the fpga
+        The image is quantized straight into the padded staging buffer, which
+        is then written to DDR as is.
+        Args:
+            image: float or uint8 array with the shape of the input tensor
+            scale: the image is multiplied by scale before quantization,
+                   e.g. 1./255 for uint8 pixels
+        """
+        tin = self.input_t
+        if addr is None:
+            addr = tin.fpga_addr
+        assert image.shape == tin.shape
+        assert image.dtype == np.uint8 or image.dtype.kind == 'f', \
+                'Expected a float or uint8 image, got {}'.format(image.dtype)
+        staging, interior = self._get_input_staging()
+        bits = tin.dtype.bits
+        scratch = self._input_scratch
+        np.multiply(image, scale * (1 << tin.dtype.frac_bits), out=scratch, casting='same_kind')
+        np.rint(scratch, out=scratch)
+        np.clip(scratch, -(1 << (bits-1)), (1 << (bits-1)) - 1, out=interior, casting='unsafe')
+        self.log.debug('Sending image {} to fpga'.format(image.shape))
+        self._invalidate_manifest(addr, staging.nbytes)
+        self.fpga_memspace.write('ddr', addr, staging)
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
-    def send_input_nparr(self, input_nparr):
+    def send_input_nparr(self, input_nparr, addr=None):
+        """
+        Sends a fixed-point input array to the fpga
+        Float and uint8 arrays are passed on to send_input_image.
+        """
+        if input_nparr.dtype == np.uint8 or input_nparr.dtype.kind == 'f':
+            return self.send_input_image(input_nparr, addr=addr)
         # data
-        op = self.input_op
-        op.data.data = input_nparr
-        tin = op.data
-        self.log.debug('Sending tensor {} to fpga'.format(op.data))
-        pad = op.pad
-        b, I, _, ic = tin.fpga_shape
-        padded_data = _pad_tensor(tin)
-        self.fpga_memspace.write('ddr', tin.fpga_addr, padded_data)
+        tin = self.input_t
+        tin.data = input_nparr
+        if addr is None:
+            addr = tin.fpga_addr
+        self.log.debug('Sending tensor {} to fpga'.format(tin))
+        staging, interior = self._get_input_staging()
+        interior[...] = input_nparr
+        self._invalidate_manifest(addr, staging.nbytes)
+        self.fpga_memspace.write('ddr', addr, staging)
         self.log.debug('tensor data: \n{}'.format(tin.data))
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
@@ -132,17 +288,79 @@ class FPGAManager(object):
                 t.fpga_pad[3][0]:t.fpga_pad[3][0]+t.shape[3]
                 ]
 
+    def alloc_output_buffer(self):
+        """
+        Returns a page-aligned buffer for recv_output_nparr
+        """
+        return aligned_empty(self.output_t.fpga_shape, np.int16)
+
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
-    def recv_output_nparr(self):
+    def recv_output_nparr(self, addr=None, out=None):
+        """
+        Reads the output tensor from DDR straight into out, a buffer from
+        alloc_output_buffer, and returns a view of it without the padding.
+        A new buffer is allocated if out is None.
+        """
         t = self.output_t
-        op = self.output_t.op
+        if addr is None:
+            addr = t.fpga_addr
+        if out is None:
+            out = self.alloc_output_buffer()
+        assert out.shape == t.fpga_shape and out.dtype == np.int16
         self.log.debug('{}'.format(t))
-        self.log.debug('OP name: {}'.format(op.name))
-        self.log.debug('OP output address: {}'.format(t.fpga_addr))
-        got_out_fpga = np.array(array.array('h', self.fpga_memspace.read('ddr', t.fpga_addr, t.fpga_size_in_bytes)), dtype=np.int16).reshape(t.fpga_shape)
+        self.log.debug('OP output address: {}'.format(addr))
+        got_out_fpga = self.fpga_memspace.readinto('ddr', addr, out)
         got_out_fpga = self._unpad_tensor(t, got_out_fpga)
         return got_out_fpga
 
+    def _select_buffer(self, buf):
+        """
+        Patches the loaded instructions to use buffer set buf (0 or 1)
+        Only the instructions that hold the input or output address change.
+        """
+        if buf == self.curr_buffer:
+            return
+        for idx, inst, alt_inst in self.double_buffer.Patches:
+            word = alt_inst if buf == 1 else inst
+            self.fpga_memspace.write('pci_cl_data', idx * 4, np.array([word], dtype=np.uint32))
+        self.curr_buffer = buf
+
+    def run_pipeline(self, inputs):
+        """
+        Runs inference on an iterable of inputs, yielding the outputs in order
+        The input and output tensors alternate between two sets of DDR
+        buffers, so that input N+1 is padded and uploaded, and output N-1 is
+        read back, while the accelerator runs input N.
+        Args:
+            inputs: iterable of input arrays, as for send_input_nparr
+        Requires a graph compiled with double_buffer=True, and its
+        GraphCompiler.double_buffer passed to initialize_graph.
+        """
+        assert self.double_buffer is not None
+        input_addr = (self.input_t.fpga_addr, self.double_buffer.Input_addr)
+        output_addr = (self.output_t.fpga_addr, self.double_buffer.Output_addr)
+
+        inputs = iter(inputs)
+        curr = next(inputs, None)
+        if curr is None:
+            return
+        buf = 0
+        self.send_input_nparr(curr, input_addr[buf])
+        prev_buf = None
+        while curr is not None:
+            self._select_buffer(buf)
+            self.start()
+            next_input = next(inputs, None)
+            if next_input is not None:
+                self.send_input_nparr(next_input, input_addr[1-buf])
+            if prev_buf is not None:
+                yield self.recv_output_nparr(output_addr[prev_buf])
+            self.wait_fpga_execution()
+            prev_buf = buf
+            buf = 1 - buf
+            curr = next_input
+        yield self.recv_output_nparr(output_addr[prev_buf])
+
     def initialize_graph_tensors(self, graph):
         self.log.debug('Initializing tensors')
         for tname, t in graph.tensor_registry.items():
@@ -158,30 +376,29 @@ class FPGAManager(object):
             self.log.debug('Tensor initialized with data: \n{}'.format(t.data))
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
-    def initialize_graph(self, graph, array_m, array_n):
+    def initialize_graph(self, graph, array_m, array_n, double_buffer=None):
         self.log.info('Systolic array: {}x{}'.format(array_n, array_m))
+        self.double_buffer = double_buffer
+        self.curr_buffer = 0
+        self._input_staging = None
         self.log.info('Initializing graph: {}'.format(graph.name))
         self.find_sink_op(graph)
-        self.log.info('clearing data in DDR')
-        self.fpga_memspace.write('ddr', 0, np.zeros((1<<28), dtype=np.int8))
-        self.log.info('clearing data in DDR - done!')
+        num_bytes = 0
         for opname, op in graph.op_registry.items():
             if isinstance(op, Convolution):
                 # data
                 if op.data.op is None:
                     self.input_op = op
+                    self.input_t = op.data
                     tin = op.data
                     self.log.debug('Sending tensor {} to fpga addr {}'.format(op.data, tin.fpga_addr))
-                    pad = op.pad
-                    b, I, _, ic = tin.fpga_shape
                     padded_data = _pad_tensor(tin)
-                    self.fpga_memspace.write('ddr', tin.fpga_addr, padded_data)
+                    num_bytes += self._init_write(tin.fpga_addr, padded_data)
                     self.log.debug('tensor data: \n{}'.format(tin.data))
 
                 else:
-                    # Need zero-padding for inputs
-                    op.data.data = np.zeros(op.data.shape, dtype=np.int16)
-                    self.fpga_memspace.write('ddr', op.data.fpga_addr, _pad_tensor(op.data))
+                    # Need zero-padding for inputs; the hardware writes the rest
+                    num_bytes += self._init_halo(op.data, np.int16, 0)
 
                 # weights
                 tw = op.weights
@@ -190,7 +407,7 @@ class FPGAManager(object):
                 assert oc % array_m == 0
                 tw_data = _pad_tensor(tw).reshape(int(oc/array_m),array_m,kh,kw,ic)
                 tw_ddr = np.transpose(tw_data, (0,2,3,4,1)).copy()
-                self.fpga_memspace.write('ddr', tw.fpga_addr, tw_ddr)
+                num_bytes += self._init_write(tw.fpga_addr, tw_ddr)
                 self.log.debug('tensor data: \n{}'.format(tw.data))
 
                 # bias
@@ -198,147 +415,205 @@ class FPGAManager(object):
                 self.log.debug('Sending tensor {} to fpga addr {}'.format(tbias, tbias.fpga_addr))
                 self.log.debug('tensor data: \n{}'.format(tbias.data))
                 tbias_ddr = np.pad(tbias.data, tbias.fpga_pad, 'constant', constant_values=(0,0))
-                self.fpga_memspace.write('ddr', tbias.fpga_addr, tbias_ddr)
-
-                # Need negative padding for conv output
-                padding = sum(x[0]+x[1] for x in op.output_tensors.fpga_pad)
-                if padding > 0:
-                    # raise ValueError
-                    # neg = np.zeros(op.output_tensors.fpga_shape, dtype=np.int64) * -1 * (1<<28)
-                    neg = np.ones(op.output_tensors.fpga_shape, dtype=np.int64) * -1 * (1<<31)
-                    self.fpga_memspace.write('ddr', op.output_tensors.fpga_addr, neg)
-                else:
-                    self.fpga_memspace.write('ddr', op.output_tensors.fpga_addr, np.zeros(op.output_tensors.fpga_size, dtype=np.int64))
+                num_bytes += self._init_write(tbias.fpga_addr, tbias_ddr)
+
+                # Need negative padding for conv output, which holds 64-bit
+                # partial sums
+                num_bytes += self._init_halo(op.output_tensors, np.int64, -1 * (1<<31))
 
             elif isinstance(op, BatchNorm):
                 mean = op.mean
                 scale = op.scale
                 self.log.debug('Sending tensor {} to fpga addr {}'.format(mean, mean.fpga_addr))
                 mean_ddr = np_array_to_ddr(mean.data, [mean.size], [1])
-                self.fpga_memspace.write('ddr', mean.fpga_addr, mean_ddr)
+                num_bytes += self._init_write(mean.fpga_addr, mean_ddr)
                 self.log.debug('tensor data: \n{}'.format(mean.data))
                 self.log.debug('Sending tensor {} to fpga addr {}'.format(scale, scale.fpga_addr))
                 scale_ddr = np_array_to_ddr(scale.data, [scale.size], [1])
-                self.fpga_memspace.write('ddr', scale.fpga_addr, scale_ddr)
+                num_bytes += self._init_write(scale.fpga_addr, scale_ddr)
                 self.log.debug('tensor data: \n{}'.format(scale.data))
+        self.log.info('Initializing graph - done! Wrote {:,} bytes to DDR'.format(num_bytes))
+
+    def _invalidate_manifest(self, addr, size):
+        for key in [k for k in self.ddr_manifest if k[0] < addr + size and addr < k[0] + k[1]]:
+            del self.ddr_manifest[key]
+
+    def _init_write(self, addr, data):
+        """
+        Writes a constant array to DDR, unless the manifest shows that it is
+        already there. Returns the number of bytes written.
+        """
+        data = np.ascontiguousarray(data)
+        key = (int(addr), data.nbytes)
+        contents = ('crc32', zlib.crc32(data) & 0xffffffff)
+        if self.ddr_manifest.get(key) == contents:
+            return 0
+        self._invalidate_manifest(*key)
+        self.fpga_memspace.write('ddr', addr, data)
+        self.ddr_manifest[key] = contents
+        return data.nbytes
+
+    def _init_halo(self, t, dtype, value):
+        """
+        Fills the padding of tensor t, with elements of the given dtype, with
+        value. Returns the number of bytes written.
+        """
+        dtype = np.dtype(dtype)
+        if (dtype, value) not in self._fill_pages:
+            self._fill_pages[(dtype, value)] = np.full((1<<16) // dtype.itemsize, value, dtype=dtype)
+        page = self._fill_pages[(dtype, value)]
+        contents = ('fill', dtype.str, value)
+
+        num_bytes = 0
+        starts, sizes = get_halo_runs(t.shape, t.fpga_pad, dtype.itemsize)
+        for start, size in zip(starts, sizes):
+            key = (int(t.fpga_addr + start), int(size))
+            if self.ddr_manifest.get(key) == contents:
+                continue
+            self._invalidate_manifest(*key)
+            for offset in range(0, key[1], page.nbytes):
+                chunk = min(page.nbytes, key[1] - offset) // dtype.itemsize
+                self.fpga_memspace.write('ddr', key[0] + offset, page[:chunk])
+            self.ddr_manifest[key] = contents
+            num_bytes += key[1]
+        return num_bytes
+
+    @classmethod
+    def build_artifact(cls, path, graph, inst_array, array_m, array_n, double_buffer=None, log_level=logging.INFO):
+        """
+        Writes a deployment artifact with everything that loading inst_array
+        and initialize_graph write to the board: the instructions, and every
+        constant tensor padded and in DDR layout. The graph must be compiled
+        and its tensors initialized.
+        """
+        memspace = RecordingMemSpace()
+        manager = cls(backend=memspace, log_level=log_level)
+        manager.write('pci_cl_data', 0, inst_array)
+        manager.initialize_graph(graph, array_m, array_n, double_buffer=double_buffer)
+        address_map = {}
+        for tname, t in graph.tensor_registry.items():
+            if t.fpga_addr is not None:
+                address_map[tname] = int(t.fpga_addr)
+        write_artifact(path, memspace.regions, manager.input_t, manager.output_t, address_map,
+                       double_buffer=double_buffer, name=graph.name)
+        manager.log.info('Wrote artifact {} with {} regions'.format(path, len(memspace.regions)))
+
+    def load_artifact(self, path):
+        """
+        Loads the instructions and DDR contents from an artifact written by
+        build_artifact, in place of compile and initialize_graph
+        Returns the header of the artifact, with its name and address map.
+        """
+        artifact = Artifact(path)
+        self.log.info('Loading artifact: {}'.format(artifact.name))
+        self.ddr_manifest = {}
+        try:
+            for namespace, addr, data in artifact.regions():
+                self.fpga_memspace.write(namespace, addr, data)
+        finally:
+            artifact.close()
+        self.input_t = artifact.input_t
+        self._input_staging = None
+        self.output_t = artifact.output_t
+        self.double_buffer = artifact.double_buffer
+        self.curr_buffer = 0
+        self.log.info('Loading artifact - done!')
+        return artifact.header
 
     def write(self, namespace, addr, data):
+        if namespace == 'ddr':
+            self._invalidate_manifest(addr, np.asarray(data).nbytes)
         self.fpga_memspace.write(namespace, addr, data)
 
     def read(self, namespace, addr, size=None):
         return self.fpga_memspace.read(namespace, addr, size=size)
 
+    def close(self):
+        self.fpga_memspace.close()
+
     def get_fpga_state(self):
         return self.fpga_memspace.read('pci_cl_ctrl', 8)
 
-    def wait_fpga_execution(self):
-        state = self.get_fpga_state()
-        if state != 0:
-            while state != 0:
-                state = self.get_fpga_state()
-#                sleep(0.0001)
-
-    def start(self):
+    def wait_fpga_execution(self, timeout=None):
+        """
+        Waits until the accelerator is idle, and returns the time waited
+        Raises IOError after timeout seconds; defaults to wait_timeout.
+        The wait is recorded in wait_stats.
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        elapsed = wait_until(lambda: self.get_fpga_state() == 0, self.wait_strategy,
+                             timeout=timeout, stats=self.wait_stats)
+        if self._run_start is not None:
+            before, start_time, label = self._run_start
+            self._run_start = None
+            self.perf_counters.record(before, self.read_counters(), timer() - start_time, label)
+        return elapsed
+
+    def start(self, label='inference'):
+        """
+        Starts the accelerator
+        With collect_counters, the counter deltas of the run are recorded
+        under label by wait_fpga_execution.
+        """
+        if self.collect_counters:
+            self._run_start = (self.read_counters(), timer(), label)
         self.fpga_memspace.write('pci_cl_ctrl', 0, 1)
         self.fpga_memspace.write('pci_cl_ctrl', 0, 0)
 
-    def print_fpga_registers(self):
-        ibuf_rd_req = self.fpga_memspace.read('pci_cl_ctrl', 16*4)
-        ibuf_rd_finished = self.fpga_memspace.read('pci_cl_ctrl', 17*4)
-        obuf_wr_req = self.fpga_memspace.read('pci_cl_ctrl', 18*4)
-        obuf_wr_finished = self.fpga_memspace.read('pci_cl_ctrl', 19*4)
-        obuf_rd_req = self.fpga_memspace.read('pci_cl_ctrl', 20*4)
-        obuf_rd_finished = self.fpga_memspace.read('pci_cl_ctrl', 21*4)
-
-        reg22 = self.fpga_memspace.read('pci_cl_ctrl', 22*4)
-        obuf_ld_stream_read_count = reg22 >> 16
-        obuf_ld_stream_write_count = reg22 % (1<<16)
-        reg23 = self.fpga_memspace.read('pci_cl_ctrl', 23*4)
-        ddr_st_stream_read_count = reg23 >> 16
-        ddr_st_stream_write_count = reg23 % (1<<16)
-
-        reg24 = self.fpga_memspace.read('pci_cl_ctrl', 24*4)
-        obuf_ld_stream_fifo_count = reg24 >> 16
-        ddr_st_stream_fifo_count = reg24 % (1<<16)
-        reg25 = self.fpga_memspace.read('pci_cl_ctrl', 25*4)
-        ddr_ld1_stream_fifo_count = reg25 >> 16
-        ddr_ld0_stream_fifo_count = reg25 % (1<<16)
-
-        pu_wr_req = self.fpga_memspace.read('pci_cl_ctrl', 26*4)
-        pu_wr_finished = self.fpga_memspace.read('pci_cl_ctrl', 27*4)
-        pu_rd_req = self.fpga_memspace.read('pci_cl_ctrl', 28*4)
-        pu_rd_finished = self.fpga_memspace.read('pci_cl_ctrl', 29*4)
-        pu_state = self.fpga_memspace.read('pci_cl_ctrl', 30*4)
-        pu_obuf_reads = self.fpga_memspace.read('pci_cl_ctrl', 31*4)
-        accelerator_state = self.fpga_memspace.read('pci_cl_ctrl', 2*4)
-        tag_req_count = self.fpga_memspace.read('pci_cl_ctrl', 3*4)
-        compute_done_count = self.fpga_memspace.read('pci_cl_ctrl', 4*4)
-        pu_compute_start_count = self.fpga_memspace.read('pci_cl_ctrl', 6*4)
-        pu_compute_done_count = self.fpga_memspace.read('pci_cl_ctrl', 5*4)
-
-        reg7 = self.fpga_memspace.read('pci_cl_ctrl', 7*4)
-        stmem_state = reg7 >> 16
-        stmem_tag = reg7 % 2
-        stmem_ddr_pe_sw = (reg7 >> 1) % 2
-
-
-        reg13 = self.fpga_memspace.read('pci_cl_ctrl', 13*4)
-        reg14 = self.fpga_memspace.read('pci_cl_ctrl', 14*4)
-        reg15 = self.fpga_memspace.read('pci_cl_ctrl', 15*4)
-        ld0_stream_read_count = reg13 >> 16
-        ld0_stream_write_count = reg13 % (1<<16)
-
-        ld1_stream_read_count = reg14 >> 16
-        ld1_stream_write_count = reg14 % (1<<16)
-
-        pu_axi_wdata_fifo_count = reg15 >> 16
-        pu_axi_awbuf_fifo_count = reg15 % (1<<16)
-
+    def read_counters(self):
+        """
+        Returns the performance counters and state registers, read in one
+        go, as a record of counters.COUNTER_DTYPE
+        """
+        return decode_registers(self.fpga_memspace.read_registers(0, NUM_REGISTERS))
 
+    def print_fpga_registers(self):
+        r = self.read_counters()
         self.log.info('*'*50)
         self.log.info('Printing fpga registers:')
         self.log.info('*'*50)
-        self.log.info('fpga  : pu   state                  : {}'.format(pu_state))
-        self.log.info('fpga  : accelerator state           : {}'.format(accelerator_state))
-        self.log.info('fpga  : stmem state                 : {}'.format(stmem_state))
+        self.log.info('fpga  : pu   state                  : {}'.format(r['pu_state']))
+        self.log.info('fpga  : accelerator state           : {}'.format(r['accelerator_state']))
+        self.log.info('fpga  : stmem state                 : {}'.format(r['stmem_state']))
         self.log.info('*'*50)
         self.log.info('AXI')
-        self.log.info('fpga  : ibuf axi rd requested       : {}'.format(ibuf_rd_req))
-        self.log.info('fpga  : ibuf axi rd finished        : {}'.format(ibuf_rd_finished))
-        self.log.info('fpga  : obuf axi wr requested       : {}'.format(obuf_wr_req))
-        self.log.info('fpga  : obuf axi wr finished        : {}'.format(obuf_wr_finished))
-        self.log.info('fpga  : obuf axi rd requested       : {}'.format(obuf_rd_req))
-        self.log.info('fpga  : obuf axi rd finished        : {}'.format(obuf_rd_finished))
-        self.log.info('fpga  : pu   axi wr requested       : {}'.format(pu_wr_req))
-        self.log.info('fpga  : pu   axi wr finished        : {}'.format(pu_wr_finished))
-        self.log.info('fpga  : pu   axi rd requested       : {}'.format(pu_rd_req))
-        self.log.info('fpga  : pu   axi rd finished        : {}'.format(pu_rd_finished))
+        self.log.info('fpga  : ibuf axi rd requested       : {}'.format(r['ibuf_rd_req']))
+        self.log.info('fpga  : ibuf axi rd finished        : {}'.format(r['ibuf_rd_finished']))
+        self.log.info('fpga  : obuf axi wr requested       : {}'.format(r['obuf_wr_req']))
+        self.log.info('fpga  : obuf axi wr finished        : {}'.format(r['obuf_wr_finished']))
+        self.log.info('fpga  : obuf axi rd requested       : {}'.format(r['obuf_rd_req']))
+        self.log.info('fpga  : obuf axi rd finished        : {}'.format(r['obuf_rd_finished']))
+        self.log.info('fpga  : pu   axi wr requested       : {}'.format(r['pu_wr_req']))
+        self.log.info('fpga  : pu   axi wr finished        : {}'.format(r['pu_wr_finished']))
+        self.log.info('fpga  : pu   axi rd requested       : {}'.format(r['pu_rd_req']))
+        self.log.info('fpga  : pu   axi rd finished        : {}'.format(r['pu_rd_finished']))
 
         self.log.info('FIFO')
-        self.log.info('fpga  : obuf stream rd count        : {}'.format(obuf_ld_stream_read_count))
-        self.log.info('fpga  : obuf stream wr count        : {}'.format(obuf_ld_stream_write_count))
-        self.log.info('fpga  : obuf stream fifo count      : {}'.format(obuf_ld_stream_fifo_count))
-        self.log.info('fpga  : ddr  stream rd count        : {}'.format(ddr_st_stream_read_count))
-        self.log.info('fpga  : ddr  stream wr count        : {}'.format(ddr_st_stream_write_count))
-        self.log.info('fpga  : ddr  stream fifo count      : {}'.format(ddr_st_stream_fifo_count))
-        self.log.info('fpga  : ld0  stream fifo count      : {}'.format(ddr_ld0_stream_fifo_count))
-        self.log.info('fpga  : ld1  stream fifo count      : {}'.format(ddr_ld1_stream_fifo_count))
-        self.log.info('fpga  : pu   obuf reads             : {}'.format(pu_obuf_reads))
+        self.log.info('fpga  : obuf stream rd count        : {}'.format(r['obuf_ld_stream_read_count']))
+        self.log.info('fpga  : obuf stream wr count        : {}'.format(r['obuf_ld_stream_write_count']))
+        self.log.info('fpga  : obuf stream fifo count      : {}'.format(r['obuf_ld_stream_fifo_count']))
+        self.log.info('fpga  : ddr  stream rd count        : {}'.format(r['ddr_st_stream_read_count']))
+        self.log.info('fpga  : ddr  stream wr count        : {}'.format(r['ddr_st_stream_write_count']))
+        self.log.info('fpga  : ddr  stream fifo count      : {}'.format(r['ddr_st_stream_fifo_count']))
+        self.log.info('fpga  : ld0  stream fifo count      : {}'.format(r['ddr_ld0_stream_fifo_count']))
+        self.log.info('fpga  : ld1  stream fifo count      : {}'.format(r['ddr_ld1_stream_fifo_count']))
+        self.log.info('fpga  : pu   obuf reads             : {}'.format(r['pu_obuf_reads']))
 
         self.log.info('*'*50)
-        self.log.info('fpga  : axi awreq buf fifo count    : {}'.format(pu_axi_awbuf_fifo_count))
-        self.log.info('fpga  : axi wdata buf fifo count    : {}'.format(pu_axi_wdata_fifo_count))
-        self.log.info('fpga  : ld0 write count             : {}'.format(ld0_stream_write_count))
-        self.log.info('fpga  : ld0 read count              : {}'.format(ld0_stream_read_count))
-        self.log.info('fpga  : ld1 write count             : {}'.format(ld1_stream_write_count))
-        self.log.info('fpga  : ld1 read count              : {}'.format(ld1_stream_read_count))
+        self.log.info('fpga  : axi awreq buf fifo count    : {}'.format(r['pu_axi_awbuf_fifo_count']))
+        self.log.info('fpga  : axi wdata buf fifo count    : {}'.format(r['pu_axi_wdata_fifo_count']))
+        self.log.info('fpga  : ld0 write count             : {}'.format(r['ld0_stream_write_count']))
+        self.log.info('fpga  : ld0 read count              : {}'.format(r['ld0_stream_read_count']))
+        self.log.info('fpga  : ld1 write count             : {}'.format(r['ld1_stream_write_count']))
+        self.log.info('fpga  : ld1 read count              : {}'.format(r['ld1_stream_read_count']))
         self.log.info('*'*50)
 
         self.log.info('Blocks')
-        self.log.info('fpga  : tag req count               : {}'.format(tag_req_count))
-        self.log.info('fpga  : compute done count          : {}'.format(compute_done_count))
-        self.log.info('fpga  : pu compute start count      : {}'.format(pu_compute_start_count))
-        self.log.info('fpga  : pu compute done count       : {}'.format(pu_compute_done_count))
-        self.log.info('fpga  : stmem tag                   : {}'.format(stmem_tag))
-        self.log.info('fpga  : stmem_ddr_pe_sw             : {}'.format(stmem_ddr_pe_sw))
+        self.log.info('fpga  : tag req count               : {}'.format(r['tag_req_count']))
+        self.log.info('fpga  : compute done count          : {}'.format(r['compute_done_count']))
+        self.log.info('fpga  : pu compute start count      : {}'.format(r['pu_compute_start_count']))
+        self.log.info('fpga  : pu compute done count       : {}'.format(r['pu_compute_done_count']))
+        self.log.info('fpga  : stmem tag                   : {}'.format(r['stmem_tag']))
+        self.log.info('fpga  : stmem_ddr_pe_sw             : {}'.format(r['stmem_ddr_pe_sw']))
         self.log.info('*'*50)
@@ -1,17 +1,54 @@
+import abc
 import logging
 import mmap
 import os
+import struct
 import numpy as np
 import array
-import codecs
 
-decode_hex = codecs.getdecoder("hex_codec")
-def to_bytes(n, length, endianess='big'):
-    h = '%x' % n
-    s = decode_hex(('0'*(len(h) % 2) + h).zfill(length*2))[0]
-    return s if endianess == 'big' else s[::-1]
+# Control registers are 32-bit little-endian words
+_ctrl_reg = struct.Struct('<I')
 
-class FPGAMemSpace(object):
+class MemSpace(abc.ABC):
+    """
+    Interface for the memory spaces of the accelerator
+    Namespaces:
+        pci_cl_ctrl: control registers, read and written 4 bytes at a time
+        pci_cl_data: instruction memory
+        ddr: accelerator DDR
+    """
+    namespaces = ('pci_cl_data', 'pci_cl_ctrl', 'ddr')
+
+    @abc.abstractmethod
+    def write(self, namespace, addr, data):
+        pass
+
+    @abc.abstractmethod
+    def read(self, namespace, addr, size=None):
+        pass
+
+    def readinto(self, namespace, addr, out):
+        """
+        Fills the contiguous NumPy array out with out.nbytes bytes read from
+        addr, and returns out
+        """
+        assert out.flags.c_contiguous
+        _as_uint8(out)[:] = np.frombuffer(self.read(namespace, addr, out.nbytes), dtype=np.uint8)
+        return out
+
+    def read_registers(self, addr, count):
+        """
+        Returns count control registers starting at addr, as a uint32 array
+        """
+        return np.array([self.read('pci_cl_ctrl', addr + 4*i) for i in range(count)], dtype=np.uint32)
+
+    def close(self):
+        pass
+
+class FPGAMemSpace(MemSpace):
+    """
+    XDMA character devices of the KU115 board
+    """
     def __init__(self,
             pci_cl_ctrl_device='/dev/xdma/card0/user',
             c2h_dma_device='/dev/xdma/card0/c2h0',
@@ -36,8 +73,7 @@ class FPGAMemSpace(object):
         assert namespace in ('pci_cl_data', 'pci_cl_ctrl', 'ddr')
 
         if namespace == 'pci_cl_ctrl':
-            self.pci_cl_ctrl_mmap.seek(addr)
-            self.pci_cl_ctrl_mmap.write(to_bytes(data, 4, 'little'))
+            _ctrl_reg.pack_into(self.pci_cl_ctrl_mmap, addr, data)
         elif namespace == 'pci_cl_data':
             os.lseek(self.h2c_fd, addr+self.inst_buffer_addr, 0)
             os.write(self.h2c_fd, data)
@@ -45,18 +81,17 @@ class FPGAMemSpace(object):
             self.log.debug('Writing data {} with dtype {} to address {}'.format(
                 data, data.dtype, addr))
             os.lseek(self.h2c_fd, addr, 0)
-            os.write(self.h2c_fd, data)
+            # Write straight from the array's buffer; the device may accept
+            # fewer bytes than requested
+            view = memoryview(_as_uint8(data))
+            while len(view) > 0:
+                view = view[os.write(self.h2c_fd, view):]
 
     def read(self, namespace, addr, size=None):
         assert namespace in ('pci_cl_data', 'pci_cl_ctrl', 'ddr')
 
         if namespace == 'pci_cl_ctrl':
-            self.pci_cl_ctrl_mmap.seek(addr)
-            v = self.pci_cl_ctrl_mmap.read(4)
-            if isinstance(v, bytes):
-                v = v.decode('utf-8')
-            v = '0x'+''.join([hex(ord(i))[2:].zfill(2) for i in reversed(v)])
-            return int(v, 16)
+            return _ctrl_reg.unpack_from(self.pci_cl_ctrl_mmap, addr)[0]
         elif namespace == 'pci_cl_data':
             os.lseek(self.c2h_fd, addr+self.inst_buffer_addr, 0)
             return np.array(array.array('i', os.read(self.c2h_fd, size)), dtype=np.int32)
@@ -65,3 +100,150 @@ class FPGAMemSpace(object):
             os.lseek(self.c2h_fd, addr, 0)
             return os.read(self.c2h_fd, int(size))
 
+    def read_registers(self, addr, count):
+        # One copy of the whole window out of the mapped BAR
+        return np.frombuffer(self.pci_cl_ctrl_mmap[addr:addr+4*count], dtype='<u4').astype(np.uint32)
+
+    def readinto(self, namespace, addr, out):
+        assert namespace == 'ddr'
+        assert out.flags.c_contiguous
+        self.log.debug('Reading tensor of size {} Bytes from address {}'.format(out.nbytes, addr))
+        os.lseek(self.c2h_fd, addr, 0)
+        view = memoryview(_as_uint8(out))
+        while len(view) > 0:
+            num_bytes = os.readv(self.c2h_fd, [view])
+            if num_bytes == 0:
+                raise IOError('Short read from {} at address {}'.format(namespace, addr))
+            view = view[num_bytes:]
+        return out
+
+    def close(self):
+        self.pci_cl_ctrl_mmap.close()
+        self.pci_cl_ctrl_fd.close()
+        os.close(self.h2c_fd)
+        os.close(self.c2h_fd)
+
+def _as_uint8(data):
+    """
+    Returns a flat uint8 view of data, copying only non-contiguous arrays
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(data, dtype=np.uint8)
+    return np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+
+def aligned_empty(shape, dtype, alignment=4096):
+    """
+    Returns an uninitialized array whose data starts on an alignment boundary
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buf = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -buf.ctypes.data % alignment
+    return buf[offset:offset+nbytes].view(dtype).reshape(shape)
+
+class BufferMemSpace(MemSpace):
+    """
+    Emulates the memory spaces of the accelerator in a single buffer
+    The buffer holds the control registers, then the instruction memory,
+    then the DDR. Nothing executes the instructions: the state register
+    reads 0, so FPGAManager.wait_fpga_execution returns immediately.
+    """
+    ctrl_size = 32*1024
+
+    def __init__(self, buf, inst_size, log_level=logging.INFO):
+        self.log = logging.getLogger('FPGA Memspace')
+        self.log.setLevel(log_level)
+        self.buf = np.frombuffer(buf, dtype=np.uint8)
+        self.offset = {'pci_cl_ctrl': 0,
+                       'pci_cl_data': self.ctrl_size,
+                       'ddr': self.ctrl_size + inst_size}
+        self.size = {'pci_cl_ctrl': self.ctrl_size,
+                     'pci_cl_data': inst_size,
+                     'ddr': self.buf.size - self.ctrl_size - inst_size}
+        assert self.size['ddr'] > 0
+
+    @staticmethod
+    def get_buffer_size(ddr_size, inst_size):
+        return BufferMemSpace.ctrl_size + inst_size + ddr_size
+
+    def _slice(self, namespace, addr, size):
+        assert namespace in self.namespaces
+        if addr < 0 or addr + size > self.size[namespace]:
+            raise ValueError('Access to {}:{} is outside of {} of size {}'.format(
+                addr, addr + size, namespace, self.size[namespace]))
+        start = self.offset[namespace] + addr
+        return self.buf[start:start+size]
+
+    def write(self, namespace, addr, data):
+        if namespace == 'pci_cl_ctrl':
+            data = _ctrl_reg.pack(data)
+        else:
+            self.log.debug('Writing data with dtype {} to {} address {}'.format(
+                getattr(data, 'dtype', None), namespace, addr))
+        data = _as_uint8(data)
+        self._slice(namespace, addr, data.size)[:] = data
+
+    def read(self, namespace, addr, size=None):
+        if namespace == 'pci_cl_ctrl':
+            return _ctrl_reg.unpack_from(self._slice(namespace, addr, 4))[0]
+        size = int(size)
+        if namespace == 'pci_cl_data':
+            return self._slice(namespace, addr, size).view(np.int32).copy()
+        self.log.debug('Reading tensor of size {} Bytes from address {}'.format(size, addr))
+        return self._slice(namespace, addr, size).tobytes()
+
+    def readinto(self, namespace, addr, out):
+        assert out.flags.c_contiguous
+        _as_uint8(out)[:] = self._slice(namespace, addr, out.nbytes)
+        return out
+
+    def read_registers(self, addr, count):
+        return self._slice('pci_cl_ctrl', addr, 4*count).view('<u4').astype(np.uint32)
+
+class FileMemSpace(BufferMemSpace):
+    """
+    Memory spaces in a sparse memory-mapped file
+    Another process, e.g. a simulator of the accelerator, can map the same
+    file to act as the device.
+    """
+    def __init__(self, path, ddr_size=1<<30, inst_size=1<<20, log_level=logging.INFO):
+        self.path = path
+        size = self.get_buffer_size(ddr_size, inst_size)
+        self.fd = open(path, 'a+b')
+        if os.fstat(self.fd.fileno()).st_size < size:
+            # Grows the file without writing to it, so the file stays sparse
+            self.fd.truncate(size)
+        self.mmap = mmap.mmap(self.fd.fileno(), size, prot=mmap.PROT_READ|mmap.PROT_WRITE)
+        super(FileMemSpace, self).__init__(self.mmap, inst_size, log_level=log_level)
+        self.log.debug('Mapped {} bytes of {}'.format(size, path))
+
+    def close(self):
+        # Drop the array view first, mmap cannot close with exported buffers
+        self.buf = None
+        self.mmap.close()
+        self.fd.close()
+
+class NumpyMemSpace(BufferMemSpace):
+    """
+    Memory spaces in an in-process NumPy buffer
+    """
+    def __init__(self, ddr_size=1<<30, inst_size=1<<20, log_level=logging.INFO):
+        # np.zeros leaves the pages unallocated until they are written
+        buf = np.zeros(self.get_buffer_size(ddr_size, inst_size), dtype=np.uint8)
+        super(NumpyMemSpace, self).__init__(buf, inst_size, log_level=log_level)
+
+def get_memspace(backend='xdma', log_level=logging.INFO, **kwargs):
+    """
+    Returns the memory space for a backend
+    Args:
+        backend: 'xdma' for the board, 'file' for a memory-mapped file, or
+                 'numpy' for an in-process buffer
+        kwargs: arguments of FPGAMemSpace, FileMemSpace or NumpyMemSpace
+    """
+    if backend == 'xdma':
+        return FPGAMemSpace(log_level=log_level, **kwargs)
+    elif backend == 'file':
+        return FileMemSpace(log_level=log_level, **kwargs)
+    elif backend == 'numpy':
+        return NumpyMemSpace(log_level=log_level, **kwargs)
+    raise ValueError('Unknown memspace backend: {}'.format(backend))
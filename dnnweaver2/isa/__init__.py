@@ -1,5 +1,8 @@
+import array
 import math
 
+import numpy as np
+
 
 class OPCodes:
     SETUP       = 0
@@ -100,6 +103,12 @@ class ComputeInstruction(object):
         dest = self._dst_reg_to_str(self.dest_addr)
         return self._fn_to_str(src0, src1, dest)
 
+    def emit(self, stream):
+        """
+        Appends the instruction to an InstructionStream, returns its index
+        """
+        return stream.append_word(self.get_binary())
+
     def get_binary(self):
         b = self.dest_addr
         b += self.src0_addr << 4
@@ -157,6 +166,11 @@ class ComputeRshift(ComputeInstruction):
         super(ComputeRshift, self).__init__(fn, 0, src0_addr, dest_addr, imm=None, src1_addr=src1_addr)
 
 class BFInstruction(object):
+    """
+    Instruction with the op_code, op_spec, loop_id and immediate fields
+    The subclasses append through the InstructionStream builder of the same
+    name, which holds their encoding.
+    """
 
     def __init__(self, op_code, op_spec, loop_id, immediate):
         self.op_code = op_code
@@ -165,19 +179,22 @@ class BFInstruction(object):
         self.immediate = immediate
 
     def get_binary(self):
-        assert self.op_code   >= 0 and self.op_code   < (1 << 5)
-        assert self.op_spec   >= 0 and self.op_spec   < (1 << 6)
-        assert self.loop_id   >= 0 and self.loop_id   < (1 << 5)
-        assert self.immediate >= 0 and self.immediate < (1 << 16)
-        binary = self.op_code << 28
-        binary+= self.op_spec << 21
-        binary+= self.loop_id << 16
-        binary+= self.immediate
-        return binary
+        stream = InstructionStream()
+        self.emit(stream)
+        return int(stream.encode()[0])
+
+    def emit(self, stream):
+        """
+        Appends the instruction to an InstructionStream, returns its index
+        """
+        return stream.append(self.op_code, self.op_spec, self.loop_id, self.immediate)
 
 class PUBlockStart(BFInstruction):
     def __init__(self, num_instructions):
-        BFInstruction.__init__(self, OPCodes.PU_BLOCK, 0, 0, num_instructions)
+        self.num_instructions = num_instructions
+
+    def emit(self, stream):
+        return stream.pu_block_start(self.num_instructions)
 
 class BaseAddressInstruction(BFInstruction):
 
@@ -186,54 +203,35 @@ class BaseAddressInstruction(BFInstruction):
         self.scratchpad_ID = scratchpad_ID
         self.index = index
         self.address = address
-        addr_index = (address >> (index*21))
-        immediate = addr_index % (1 << 21)
-        loop_id = addr_index >> 16
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.index
-        BFInstruction.__init__(self, OPCodes.BASE_ADDR, op_spec, 0, immediate)
 
-    def get_binary(self):
-        self.op_spec = (self.scratchpad_ID << 3) + self.index
-        addr_index = (self.address >> (self.index*21))
-        # print('address binary: {}'.format(addr_index))
-        self.immediate = addr_index % (1 << 16)
-        self.loop_id = (addr_index >> 16) % (1 << 5)
-        return super(BaseAddressInstruction, self).get_binary()
+    def emit(self, stream):
+        return stream.base_address(self.scratchpad_ID, self.index, self.address)
 
 class LoopInstruction(BFInstruction):
 
     def __init__(self, loop_level, loop_id, loop_iterations):
-        BFInstruction.__init__(self, OPCodes.LOOP, loop_level, loop_id, loop_iterations)
+        self.loop_level = loop_level
+        self.loop_id = loop_id
+        self.loop_iterations = loop_iterations
 
-    def get_binary(self):
-        # print('{0},{1}; Loop: 1 -> {2}'.format(self.op_spec, self.loop_id, self.immediate+1))
-        return super(LoopInstruction, self).get_binary()
+    def emit(self, stream):
+        # print('{0},{1}; Loop: 1 -> {2}'.format(self.loop_level, self.loop_id, self.loop_iterations+1))
+        return stream.loop(self.loop_level, self.loop_id, self.loop_iterations)
 
 class AccessInstruction(BFInstruction):
 
     def __init__(self, access_type, scratchpad_ID, mem_bitwidth, loop_id, access_size):
-        self.scratchpad_ID = scratchpad_ID
-        self.mem_bitwidth = int(math.log(mem_bitwidth) / math.log(2))
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.mem_bitwidth << 0
-        if access_type == AccessType.LD:
-            op_code = OPCodes.LDMEM
-        elif access_type == AccessType.ST:
-            op_code = OPCodes.STMEM
-        elif access_type == AccessType.RD:
-            op_code = OPCodes.RDBUF
-        elif access_type == AccessType.WR:
-            op_code = OPCodes.WRBUF
-        else:
+        if access_type not in (AccessType.LD, AccessType.ST, AccessType.RD, AccessType.WR):
             raise Exception('Expected Access type in range {0, 1, 2, 3}')
-        BFInstruction.__init__(self, op_code, op_spec, loop_id, access_size)
+        self.access_type = access_type
+        self.scratchpad_ID = scratchpad_ID
+        self.mem_bitwidth = mem_bitwidth
+        self.loop_id = loop_id
+        self.access_size = access_size
 
-    def get_binary(self):
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.mem_bitwidth << 0
-        self.op_spec = op_spec
-        return super(AccessInstruction, self).get_binary()
+    def emit(self, stream):
+        return stream.access(self.access_type, self.scratchpad_ID, self.mem_bitwidth, self.loop_id,
+                             self.access_size)
 
 class LDMemInstruction(AccessInstruction):
 
@@ -262,23 +260,17 @@ class SetupInstruction(BFInstruction):
     def __init__(self, op0_bitwidth, op1_bitwidth):
         self.op0_bitwidth = op0_bitwidth
         self.op1_bitwidth = op1_bitwidth
-        self.op0_bitwidth_spec = int(math.log(op0_bitwidth) / math.log(2))
-        self.op1_bitwidth_spec = int(math.log(op1_bitwidth) / math.log(2))
-        op_spec = self.op0_bitwidth_spec << 3
-        op_spec += self.op1_bitwidth_spec << 0
-        BFInstruction.__init__(self, OPCodes.SETUP, op_spec, 0, 0)
 
-    def get_binary(self):
-        op_spec = self.op0_bitwidth_spec << 3
-        op_spec += self.op1_bitwidth_spec << 0
-        self.op_spec = op_spec
-        return super(SetupInstruction, self).get_binary()
+    def emit(self, stream):
+        return stream.setup(self.op0_bitwidth, self.op1_bitwidth)
 
 class BlockEndInstruction(BFInstruction):
 
     def __init__(self, last=False):
-        last = int(last)
-        BFInstruction.__init__(self, OPCodes.BLOCK_END, 0, 0, last)
+        self.last = last
+
+    def emit(self, stream):
+        return stream.block_end(self.last)
 
 class PUBlockRepeat(BlockEndInstruction):
     def __init__(self, repeat):
@@ -287,35 +279,178 @@ class PUBlockRepeat(BlockEndInstruction):
 class GenAddrLowInstruction(BFInstruction):
 
     def __init__(self, scratchpad_ID, ld_st, loop_id, immediate):
+        # print('Scratchpad {}, ldst: {}, loop_id: {}, stride: {}'.format(scratchpad_ID, ld_st, loop_id, immediate))
         self.scratchpad_ID = scratchpad_ID
         self.ld_st = ld_st
-        immediate = int(immediate)
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.ld_st << 0
-        immediate = immediate % (1<<16)
-        # print('Scratchpad {}, ldst: {}, loop_id: {}, stride: {}'.format(scratchpad_ID, ld_st, loop_id, immediate))
-        BFInstruction.__init__(self, OPCodes.GENADDRLO, op_spec, loop_id, immediate)
+        self.loop_id = loop_id
+        self.stride = immediate
 
-    def get_binary(self):
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.ld_st << 0
-        self.op_spec = op_spec
-        return super(GenAddrLowInstruction, self).get_binary()
+    def emit(self, stream):
+        return stream.gen_addr_low(self.scratchpad_ID, self.ld_st, self.loop_id, self.stride)
 
 class GenAddrHighInstruction(BFInstruction):
 
     def __init__(self, scratchpad_ID, ld_st, loop_id, immediate):
+        # print('Scratchpad {}, ldst: {}, loop_id: {}, stride: {}'.format(scratchpad_ID, ld_st, loop_id, immediate))
         self.scratchpad_ID = scratchpad_ID
         self.ld_st = ld_st
-        immediate = int(immediate)
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.ld_st << 0
-        immediate = immediate >> 16
-        # print('Scratchpad {}, ldst: {}, loop_id: {}, stride: {}'.format(scratchpad_ID, ld_st, loop_id, immediate))
-        BFInstruction.__init__(self, OPCodes.GENADDRHI, op_spec, loop_id, immediate)
-
-    def get_binary(self):
-        op_spec = self.scratchpad_ID << 3
-        op_spec += self.ld_st << 0
-        self.op_spec = op_spec
-        return super(GenAddrHighInstruction, self).get_binary()
+        self.loop_id = loop_id
+        self.stride = immediate
+
+    def emit(self, stream):
+        return stream.gen_addr_high(self.scratchpad_ID, self.ld_st, self.loop_id, self.stride)
+
+# Bit positions of the fields of an instruction word. Compute instructions
+# use their own layout within the same 32 bits, with the src1_sel bit as the
+# top bit of op_spec, so only they can use all OP_SPEC_BITS.
+OP_CODE_SHIFT = 28
+OP_SPEC_SHIFT = 21
+LOOP_ID_SHIFT = 16
+OP_CODE_BITS = 4
+OP_SPEC_BITS = 7
+BF_OP_SPEC_BITS = 6
+LOOP_ID_BITS = 5
+IMMEDIATE_BITS = 16
+
+def _log2(n):
+    return int(math.log(n) / math.log(2))
+
+_ACCESS_OP_CODES = {AccessType.LD: OPCodes.LDMEM, AccessType.ST: OPCodes.STMEM,
+                    AccessType.RD: OPCodes.RDBUF, AccessType.WR: OPCodes.WRBUF}
+
+class InstructionStream(object):
+    """
+    Instructions stored as one growable column per field
+    The builder methods hold the encoding of the instruction classes above,
+    and append without creating an object per instruction. encode() packs
+    the whole stream at once.
+    """
+    def __init__(self):
+        self.op_code = array.array('B')
+        self.op_spec = array.array('B')
+        self.loop_id = array.array('B')
+        self.immediate = array.array('H')
+
+    def __len__(self):
+        return len(self.op_code)
+
+    def append(self, op_code, op_spec, loop_id, immediate):
+        """
+        Appends an instruction, returns its index
+        The fields can be integral floats, e.g. tile counts from the
+        optimizer.
+        """
+        self.op_code.append(int(op_code))
+        self.op_spec.append(int(op_spec))
+        self.loop_id.append(int(loop_id))
+        self.immediate.append(int(immediate))
+        return len(self.op_code) - 1
+
+    def set(self, index, op_code, op_spec, loop_id, immediate):
+        self.op_code[index] = int(op_code)
+        self.op_spec[index] = int(op_spec)
+        self.loop_id[index] = int(loop_id)
+        self.immediate[index] = int(immediate)
+
+    def append_word(self, word):
+        """
+        Appends an encoded instruction word, e.g. a compute instruction,
+        returns its index
+        """
+        return self.append(word >> OP_CODE_SHIFT,
+                           (word >> OP_SPEC_SHIFT) & ((1 << OP_SPEC_BITS) - 1),
+                           (word >> LOOP_ID_SHIFT) & ((1 << LOOP_ID_BITS) - 1),
+                           word & ((1 << IMMEDIATE_BITS) - 1))
+
+    def extend(self, other):
+        self.op_code.extend(other.op_code)
+        self.op_spec.extend(other.op_spec)
+        self.loop_id.extend(other.loop_id)
+        self.immediate.extend(other.immediate)
+
+    def fields(self):
+        """
+        Returns the op_code, op_spec, loop_id and immediate columns as numpy
+        arrays that share memory with the stream
+        """
+        return (np.frombuffer(self.op_code, dtype=np.uint8),
+                np.frombuffer(self.op_spec, dtype=np.uint8),
+                np.frombuffer(self.loop_id, dtype=np.uint8),
+                np.frombuffer(self.immediate, dtype=np.uint16))
+
+    def encode(self):
+        """
+        Returns the instruction words as a uint32 array
+        Raises ValueError if a field does not fit in its bits.
+        """
+        op_code, op_spec, loop_id, immediate = [f.astype(np.uint32) for f in self.fields()]
+        compute = (op_code == OPCodes.COMPUTE_R) | (op_code == OPCodes.COMPUTE_I)
+        limits = (('op_code', op_code, np.uint32(1 << OP_CODE_BITS)),
+                  ('op_spec', op_spec, np.where(compute, 1 << OP_SPEC_BITS, 1 << BF_OP_SPEC_BITS)),
+                  ('loop_id', loop_id, np.uint32(1 << LOOP_ID_BITS)))
+        for name, column, limit in limits:
+            limit = np.broadcast_to(limit, column.shape)
+            bad = np.flatnonzero(column >= limit)
+            if len(bad) > 0:
+                i = bad[0]
+                raise ValueError('Instruction {} (op_code {}): {} is {}, expected below {}'.format(
+                    i, op_code[i], name, column[i], limit[i]))
+        return ((op_code << OP_CODE_SHIFT) | (op_spec << OP_SPEC_SHIFT) |
+                (loop_id << LOOP_ID_SHIFT) | immediate)
+
+    @classmethod
+    def decode(cls, words):
+        """
+        Returns the InstructionStream for an array of instruction words
+        """
+        words = np.asarray(words, dtype=np.uint32)
+        stream = cls()
+        stream.op_code.frombytes((words >> OP_CODE_SHIFT).astype(np.uint8).tobytes())
+        stream.op_spec.frombytes(((words >> OP_SPEC_SHIFT) & ((1 << OP_SPEC_BITS) - 1)).astype(np.uint8).tobytes())
+        stream.loop_id.frombytes(((words >> LOOP_ID_SHIFT) & ((1 << LOOP_ID_BITS) - 1)).astype(np.uint8).tobytes())
+        stream.immediate.frombytes((words & ((1 << IMMEDIATE_BITS) - 1)).astype(np.uint16).tobytes())
+        return stream
+
+    # Builders, with the encoding of the instruction class of the same name
+
+    def setup(self, op0_bitwidth, op1_bitwidth):
+        return self.append(OPCodes.SETUP, (_log2(op0_bitwidth) << 3) + _log2(op1_bitwidth), 0, 0)
+
+    def base_address(self, scratchpad_ID, index, address):
+        addr_index = address >> (index*21)
+        return self.append(OPCodes.BASE_ADDR, (scratchpad_ID << 3) + index,
+                           (addr_index >> 16) % (1 << 5), addr_index % (1 << 16))
+
+    def loop(self, loop_level, loop_id, loop_iterations):
+        return self.append(OPCodes.LOOP, loop_level, loop_id, loop_iterations)
+
+    def access(self, access_type, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        return self.append(_ACCESS_OP_CODES[access_type], (scratchpad_ID << 3) + _log2(mem_bitwidth),
+                           loop_id, access_size)
+
+    def ld_mem(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        return self.access(AccessType.LD, scratchpad_ID, mem_bitwidth, loop_id, access_size)
+
+    def st_mem(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        return self.access(AccessType.ST, scratchpad_ID, mem_bitwidth, loop_id, access_size)
+
+    def rd_buf(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        return self.access(AccessType.RD, scratchpad_ID, mem_bitwidth, loop_id, access_size)
+
+    def wr_buf(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        return self.access(AccessType.WR, scratchpad_ID, mem_bitwidth, loop_id, access_size)
+
+    def gen_addr_low(self, scratchpad_ID, ld_st, loop_id, immediate):
+        return self.append(OPCodes.GENADDRLO, (scratchpad_ID << 3) + ld_st, loop_id, int(immediate) % (1 << 16))
+
+    def gen_addr_high(self, scratchpad_ID, ld_st, loop_id, immediate):
+        return self.append(OPCodes.GENADDRHI, (scratchpad_ID << 3) + ld_st, loop_id, int(immediate) >> 16)
+
+    def block_end(self, last=False):
+        return self.append(OPCodes.BLOCK_END, 0, 0, int(last))
+
+    def pu_block_start(self, num_instructions):
+        return self.append(OPCodes.PU_BLOCK, 0, 0, num_instructions)
+
+    def pu_block_repeat(self, repeat):
+        return self.block_end(repeat-1)
@@ -0,0 +1,119 @@
+import json
+import hashlib
+import logging
+import sqlite3
+import time
+
+from dnnweaver2.utils.utils import LRUCache
+from dnnweaver2.optimizer.optimizer import COST_MODEL_VERSION
+
+class TilingCache(object):
+    """
+    Content-addressed cache for the loop tiling and ordering of convolution
+    layers. Entries are kept in a bounded in-memory LRU and, when a path is
+    given, in a sqlite database on disk so that they survive across runs.
+    Keys include COST_MODEL_VERSION; bumping it invalidates old entries.
+    """
+
+    def __init__(self, path=None, max_mem_entries=1024, max_disk_entries=65536, log_level=logging.INFO):
+        self.log = logging.getLogger('Tiling cache')
+        self.log.setLevel(log_level)
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.mem = LRUCache(max_mem_entries)
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if self.path is not None:
+            self.log.debug('Opening tiling cache: {}'.format(self.path))
+            self.db = sqlite3.connect(self.path)
+            self.db.execute('CREATE TABLE IF NOT EXISTS tilings '
+                            '(key TEXT PRIMARY KEY, version INTEGER, value TEXT, last_used REAL)')
+            # Entries from an older cost model can never be hit again
+            self.db.execute('DELETE FROM tilings WHERE version != ?', (COST_MODEL_VERSION,))
+            self.db.commit()
+
+    @staticmethod
+    def get_key(conv_params, pool_kernel=None, pool_stride=None, search_params=()):
+        """
+        Returns the cache key for a convolution layer on an accelerator
+        Args:
+            conv_params: A tuple with convolution params, as passed to
+                         optimize_for_order
+            search_params: settings of the search that can change its
+                           result, e.g. the search budget
+        """
+        acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+        if pool_kernel is None:
+            pool_kernel = (1,1,1,1)
+        if pool_stride is None:
+            pool_stride = (1,1,1,1)
+        desc = [COST_MODEL_VERSION,
+                K, O, S, IC, OC, B, iprec, wprec, bool(im2col),
+                list(energy_cost), list(pool_kernel), list(pool_stride),
+                acc_obj.N, acc_obj.M, acc_obj.prec,
+                sorted(acc_obj.sram.items()), acc_obj.mem_if_width,
+                list(search_params)]
+        desc = json.dumps(desc, default=float)
+        return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _encode(tiling, order):
+        return json.dumps({'order': list(order),
+                           'tiling': [[l, list(tiling[l])] for l in order]})
+
+    @staticmethod
+    def _decode(value):
+        value = json.loads(value)
+        order = tuple(value['order'])
+        tiling = {}
+        for l, t in value['tiling']:
+            tiling[l] = tuple(t)
+        return tiling, order
+
+    def get(self, key):
+        """
+        Returns a (tiling, order) tuple, or None on a miss
+        """
+        value = self.mem.get(key)
+        if value is None and self.db is not None:
+            row = self.db.execute('SELECT value FROM tilings WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value = row[0]
+                self.disk_hits += 1
+                self.mem.put(key, value)
+                self.db.execute('UPDATE tilings SET last_used = ? WHERE key = ?', (time.time(), key))
+                self.db.commit()
+        if value is None:
+            self.misses += 1
+            return None
+        # Decode on every hit; callers are free to modify the returned tiling
+        return self._decode(value)
+
+    def put(self, key, tiling, order):
+        value = self._encode(tiling, order)
+        self.mem.put(key, value)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO tilings VALUES (?, ?, ?, ?)',
+                            (key, COST_MODEL_VERSION, value, time.time()))
+            num_entries = self.db.execute('SELECT COUNT(*) FROM tilings').fetchone()[0]
+            if num_entries > self.max_disk_entries:
+                self.log.debug('Evicting {} entries'.format(num_entries - self.max_disk_entries))
+                self.db.execute('DELETE FROM tilings WHERE key IN '
+                                '(SELECT key FROM tilings ORDER BY last_used ASC LIMIT ?)',
+                                (num_entries - self.max_disk_entries,))
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __str__(self):
+        ret = 'Tiling cache'
+        ret += '\n\tMemory entries: {}'.format(len(self.mem))
+        ret += '\n\tMemory hits   : {}'.format(self.mem.hits)
+        ret += '\n\tDisk hits     : {}'.format(self.disk_hits)
+        ret += '\n\tMisses        : {}'.format(self.misses)
+        return ret
@@ -1,7 +1,7 @@
 import math
-import functools
 import time
 import logging
+from collections import namedtuple
 
 from itertools import permutations
 from multiprocessing import Pool, cpu_count
@@ -15,6 +15,17 @@ import numpy as np
 logger = logging.getLogger('{}.{}'.format(__name__, 'Optimizer'))
 logger.setLevel(logging.DEBUG)
 
+# Bump whenever a change to the cost model can change the chosen tiling;
+# cached tilings from older versions are then ignored
+COST_MODEL_VERSION = 2
+
+# Upper bound on the number of worker processes used for the tiling search
+MAX_WORKERS = 16
+
+# Default upper bound on the number of tilings evaluated per layer, summed
+# over all loop orders
+SEARCH_BUDGET = 1 << 16
+
 tile_deps = {}
 tile_deps['B/b']   = {'ibuf': True,  'wbuf': False, 'obuf': True,  'bbuf': False}
 tile_deps['OW/ow'] = {'ibuf': True,  'wbuf': False, 'obuf': True,  'bbuf': False}
@@ -22,19 +33,58 @@ tile_deps['OH/oh'] = {'ibuf': True,  'wbuf': False, 'obuf': True,  'bbuf': False
 tile_deps['IC/ic'] = {'ibuf': True,  'wbuf': True,  'obuf': False, 'bbuf': False}
 tile_deps['OC/oc'] = {'ibuf': False, 'wbuf': True,  'obuf': True,  'bbuf': True}
 
-def get_stats_fast(conv_params, tiling, order_type, verbose=False):
-    """
-    Returns cycles and memory accesses to DRAM, IBUF, OBUF, and WBUF
-        TODOs: Without im2col, the calculation of weight and ibuf size is inexact
-    """
-    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, _, _ = conv_params
+# Loops that always have the same number of tiles in the search
+symmetric_loops = {'OH/oh': 'OW/ow'}
 
-    num_b, b = tiling['B/b']
-    num_ow, ow = tiling['OW/ow']
-    num_oh, oh = tiling['OH/oh']
-    num_ic, ic = tiling['IC/ic']
-    num_oc, oc = tiling['OC/oc']
+# What the tiling search minimizes, see get_objective_cost
+OBJECTIVE_CYCLES = 'cycles'
+OBJECTIVE_ENERGY = 'energy'
+OBJECTIVE_EDP = 'edp'
+OBJECTIVE_DRAM_BUDGET = 'dram_budget'
+OBJECTIVES = (OBJECTIVE_CYCLES, OBJECTIVE_ENERGY, OBJECTIVE_EDP, OBJECTIVE_DRAM_BUDGET)
 
+def get_objective_cost(cycles, energy, dram, objective=OBJECTIVE_CYCLES, dram_budget=None):
+    """
+    Returns the cost of tilings under an objective, a tuple compared
+    lexicographically; the arguments are scalars or numpy arrays
+    Args:
+        cycles, energy: see Stats.total_cycles and Stats.get_energy
+        dram: DRAM reads + writes in bits
+        objective: one of OBJECTIVES
+            cycles: least cycles, then least energy
+            energy: least energy, then least cycles
+            edp: least energy-delay product, then least cycles
+            dram_budget: least cycles among the tilings within dram_budget;
+                         if there are none, least DRAM traffic
+        dram_budget: DRAM traffic budget in bits per layer
+    """
+    if objective == OBJECTIVE_CYCLES:
+        return (cycles, energy)
+    if objective == OBJECTIVE_ENERGY:
+        return (energy, cycles)
+    if objective == OBJECTIVE_EDP:
+        return (energy * cycles, cycles)
+    if objective == OBJECTIVE_DRAM_BUDGET:
+        assert dram_budget is not None, 'The dram_budget objective needs a DRAM budget'
+        return (np.maximum(dram - dram_budget, 0), cycles, energy)
+    raise ValueError('Unknown objective {}, expected one of {}'.format(objective, ', '.join(OBJECTIVES)))
+
+# SRAM access orders, see get_buffer_sizes
+INPUT_STATIONARY = 'is'
+OUTPUT_STATIONARY = 'os'
+WEIGHT_STATIONARY = 'ws'
+
+def get_buffer_sizes(N, M, K, S, iprec, wprec, b, ow, oh, ic, oc):
+    """
+    Returns the buffer sizes of a tile and its SRAM access order
+    Pure kernel of get_stats_fast, cached in the buffer_sizes cache of the
+    accelerator.
+    Returns:
+        writes: dict from buffer to the bits written per tile
+        reads: dict from buffer to the bits read per tile
+        dataflow: the cheapest of INPUT_STATIONARY, OUTPUT_STATIONARY and
+                  WEIGHT_STATIONARY
+    """
     kw = kh = K
 
     ih = (oh - 1) * S + kh
@@ -44,18 +94,74 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
     reads = {}
 
     writes['wbuf'] = \
-            ceil_a_by_b(ic, acc_obj.N) * acc_obj.N * kh * kw * \
-            ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * \
+            ceil_a_by_b(ic, N) * N * kh * kw * \
+            ceil_a_by_b(oc, M) * M * \
             wprec
 
-    writes['ibuf'] = iw * ih * ceil_a_by_b(ic, acc_obj.N) * acc_obj.N * b * iprec
+    writes['ibuf'] = iw * ih * ceil_a_by_b(ic, N) * N * b * iprec
 
     bprec = 32
-    writes['bbuf'] = ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * bprec
+    writes['bbuf'] = ceil_a_by_b(oc, M) * M * bprec
 
     oprec = 64
-    writes['obuf'] = ow * oh * ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * b * oprec
-    reads['obuf'] = ow * oh * ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * b * oprec
+    writes['obuf'] = ow * oh * ceil_a_by_b(oc, M) * M * b * oprec
+    reads['obuf'] = ow * oh * ceil_a_by_b(oc, M) * M * b * oprec
+
+    is_loop = ceil_a_by_b(oc, M) * M
+    os_loop = ceil_a_by_b(ic, N) * N * kh * kw
+    ws_loop = b * oh * ow
+    # Input Stationary energy
+    # kw * kh * ic * oh * ow * b -> oc
+    is_energy = (os_loop * ws_loop) * (iprec    + is_loop * (wprec + oprec))
+    # Output Stationary energy
+    # oc * oh * ow * b -> kw * kh * ic
+    os_energy = (is_loop * ws_loop) * (oprec    + os_loop * (iprec + wprec))
+    # Weight Stationary energy
+    # kw * kh * ic * oc -> b * ow * oh
+    ws_energy = (os_loop * is_loop) * (wprec    + ws_loop * (iprec + oprec))
+
+    min_energy = min(is_energy, ws_energy, os_energy)
+    if is_energy == min_energy:
+        dataflow = INPUT_STATIONARY
+    elif os_energy == min_energy:
+        dataflow = OUTPUT_STATIONARY
+    else:
+        dataflow = WEIGHT_STATIONARY
+    return writes, reads, dataflow
+
+def get_stats_fast(conv_params, tiling, order_type, verbose=False, resident_input=False, resident_output=False):
+    """
+    Returns cycles and memory accesses to DRAM, IBUF, OBUF, and WBUF
+        TODOs: Without im2col, the calculation of weight and ibuf size is inexact
+    Args:
+        resident_input: the input activations are already in IBUF, written
+                        there by the previous layer. Requires a single
+                        tile for the B, OW, OH and IC loops.
+        resident_output: the output activations are passed on chip to the
+                         next layer instead of being written to DRAM
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, _, _ = conv_params
+
+    num_b, b = tiling['B/b']
+    num_ow, ow = tiling['OW/ow']
+    num_oh, oh = tiling['OH/oh']
+    num_ic, ic = tiling['IC/ic']
+    num_oc, oc = tiling['OC/oc']
+
+    kw = kh = K
+    oprec = 64
+
+    # Buffer sizes do not depend on the loop order, and are shared by all
+    # the orders searched for a tile
+    key = (acc_obj.N, acc_obj.M, K, S, iprec, wprec, b, ow, oh, ic, oc)
+    cache = acc_obj.get_cache('buffer_sizes')
+    sizes = cache.get(key)
+    if sizes is None:
+        sizes = get_buffer_sizes(acc_obj.N, acc_obj.M, K, S, iprec, wprec, b, ow, oh, ic, oc)
+        cache.put(key, sizes)
+    writes, reads, dataflow = sizes
+    writes = dict(writes)
+    reads = dict(reads)
 
     # Skip if overutilizing resources
     overflow = False
@@ -120,23 +226,19 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
         stats.reads[namespace] = reads[namespace]
         stats.writes['dram'] += reads[namespace]
 
-    is_loop = ceil_a_by_b(oc, acc_obj.M) * acc_obj.M
-    os_loop = ceil_a_by_b(ic, acc_obj.N) * acc_obj.N * kh * kw
-    ws_loop = b * oh * ow
-    # Input Stationary energy
-    # kw * kh * ic * oh * ow * b -> oc
-    is_energy = (os_loop * ws_loop) * (iprec    + is_loop * (wprec + oprec))
-    # Output Stationary energy
-    # oc * oh * ow * b -> kw * kh * ic
-    os_energy = (is_loop * ws_loop) * (oprec    + os_loop * (iprec + wprec))
-    # Weight Stationary energy
-    # kw * kh * ic * oc -> b * ow * oh
-    ws_energy = (os_loop * is_loop) * (wprec    + ws_loop * (iprec + oprec))
+    # Activations that stay on chip across layers never go through DRAM
+    if resident_input:
+        if num_b * num_ow * num_oh * num_ic > 1:
+            return
+        stats.reads['dram'] -= writes['ibuf']
+        max_write_size['ibuf'] = 0
+    if resident_output:
+        stats.writes['dram'] -= max_read_size['obuf'] * num_b * num_ow * num_oh * num_oc
+        max_read_size['obuf'] = 0
 
-    min_energy = min(is_energy, ws_energy, os_energy)
     num_tiles = num_b * num_ow * num_oh * num_ic * num_oc
 
-    if is_energy == min_energy:
+    if dataflow == INPUT_STATIONARY:
         if verbose:
             logger.debug('SRAM access order: Input Stationary')
         stats.reads['ibuf'] += num_tiles * (kw * kh * ic * oh * ow * b) * iprec
@@ -144,7 +246,7 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
         stats.writes['obuf'] += num_tiles * (kw * kh * ic * oh * ow * b) * oc * oprec
         stats.reads['wbuf'] += num_tiles * (kw * kh * ic * oh * ow * b) * oc * wprec
 
-    elif os_energy == min_energy:
+    elif dataflow == OUTPUT_STATIONARY:
         if verbose:
             logger.debug('SRAM access order: Output Stationary')
         stats.reads['ibuf'] += num_tiles * (oc * oh * ow * b) * (kw * kh * ic) * iprec
@@ -188,92 +290,518 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
 
     return stats
 
-def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequential=True):
+# Statistics of a grid of tilings that do not depend on the loop order,
+# see get_tile_stats. Arrays are read-only and may be shared between calls.
+#   Num_tiles: dict from loop to its number of tiles
+#   Writes, Reads: dict from buffer to the bits written or read per tile
+#   Valid: False for tilings that overflow the SRAM
+#   Sram_reads, Sram_writes: SRAM accesses of the cheapest dataflow
+#   Compute_cycles: cycles of the systolic array for all tiles
+TileStats = namedtuple('TileStats', ['Num_tiles', 'Writes', 'Reads', 'Valid', 'Sram_reads', 'Sram_writes',
+                                     'Compute_cycles'])
+
+def get_tile_stats(conv_params, tiling):
+    """
+    Returns the TileStats of a grid of tilings, see get_stats_vectorized
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, _, _ = conv_params
+
+    num_b, b = tiling['B/b']
+    num_ow, ow = tiling['OW/ow']
+    num_oh, oh = tiling['OH/oh']
+    num_ic, ic = tiling['IC/ic']
+    num_oc, oc = tiling['OC/oc']
+
+    # Use float64 throughout; all intermediate values are exact integers
+    # well below 2**53 for realistic layer sizes. Copies, since the
+    # arrays are made read-only.
+    num_b, b, num_ow, ow, num_oh, oh, num_ic, ic, num_oc, oc = \
+            [np.array(x, dtype=np.float64) for x in \
+             (num_b, b, num_ow, ow, num_oh, oh, num_ic, ic, num_oc, oc)]
+    shape = np.broadcast(num_b, num_ow, num_oh, num_ic, num_oc).shape
+    num_tiles_dict = {'B/b': num_b, 'OW/ow': num_ow, 'OH/oh': num_oh,
+                      'IC/ic': num_ic, 'OC/oc': num_oc}
+
+    kw = kh = K
+
+    ih = (oh - 1) * S + kh
+    iw = (ow - 1) * S + kw
+
+    _ic = np.ceil(ic / acc_obj.N) * acc_obj.N
+    _oc = np.ceil(oc / acc_obj.M) * acc_obj.M
+
+    writes = {}
+    reads = {}
+
+    writes['wbuf'] = _ic * kh * kw * _oc * wprec
+    writes['ibuf'] = iw * ih * _ic * b * iprec
+
+    bprec = 32
+    writes['bbuf'] = _oc * bprec
+
+    oprec = 64
+    writes['obuf'] = ow * oh * _oc * b * oprec
+    reads['obuf'] = ow * oh * _oc * b * oprec
+
+    # Mask out tilings that overutilize resources
+    valid = np.ones(shape, dtype=bool)
+    for namespace in writes:
+        valid &= writes[namespace] <= acc_obj.sram[namespace]/2
+
+    is_loop = _oc
+    os_loop = _ic * kh * kw
+    ws_loop = b * oh * ow
+    # Input Stationary energy
+    is_energy = (os_loop * ws_loop) * (iprec    + is_loop * (wprec + oprec))
+    # Output Stationary energy
+    os_energy = (is_loop * ws_loop) * (oprec    + os_loop * (iprec + wprec))
+    # Weight Stationary energy
+    ws_energy = (os_loop * is_loop) * (wprec    + ws_loop * (iprec + oprec))
+
+    min_energy = np.minimum(np.minimum(is_energy, ws_energy), os_energy)
+    is_mask = is_energy == min_energy
+    os_mask = np.logical_and(np.logical_not(is_mask), os_energy == min_energy)
+    num_tiles = num_b * num_ow * num_oh * num_ic * num_oc
+
+    # SRAM accesses for Input, Output and Weight Stationary dataflows
+    ibuf_accesses = num_tiles * (kw * kh * ic * oh * ow * b)
+    macs = ibuf_accesses * oc
+    ibuf_reads = np.where(is_mask, ibuf_accesses, macs)
+    obuf_accesses = np.where(os_mask, num_tiles * (oc * oh * ow * b), macs)
+    wbuf_reads = np.where(np.logical_or(is_mask, os_mask), macs, num_tiles * (kw * kh * ic * oc))
+    sram_reads = {'ibuf': ibuf_reads * iprec, 'obuf': obuf_accesses * oprec, 'wbuf': wbuf_reads * wprec}
+    sram_writes = {'obuf': sram_reads['obuf']}
+
+    compute_cycles = num_tiles * acc_obj.get_compute_cycles_vectorized(ic, oc, ow, oh, b, kw, kh, iprec, wprec, im2col)
+
+    arrays = list(num_tiles_dict.values()) + list(writes.values()) + list(reads.values()) + \
+            list(sram_reads.values()) + [valid, compute_cycles]
+    for a in arrays:
+        a.setflags(write=False)
+    return TileStats(num_tiles_dict, writes, reads, valid, sram_reads, sram_writes, compute_cycles)
+
+def get_stats_vectorized(conv_params, tiling, order_type, resident_input=False, resident_output=False,
+                         tile_stats=None):
+    """
+    Vectorized version of get_stats_fast
+    Evaluates a whole grid of tilings for one loop order at once.
+    Args:
+        conv_params: A tuple with convolution params (with pooling)
+        tiling: dict mapping each loop to a (num_tiles, tile_size) tuple of
+                numpy arrays that broadcast against each other
+        order_type: ordering loop
+        resident_input, resident_output: see get_stats_fast
+        tile_stats: TileStats of tiling, to share them between orders. If
+                    None, they are computed by get_tile_stats
+    Returns:
+        stats: Stats object whose entries are numpy arrays
+        valid: boolean array, False for tilings that overflow the SRAM
+    """
+    acc_obj = conv_params[0]
+    if tile_stats is None:
+        tile_stats = get_tile_stats(conv_params, tiling)
+    num_tiles_dict = tile_stats.Num_tiles
+    writes = dict(tile_stats.Writes)
+    reads = dict(tile_stats.Reads)
+
+    initial_dram_reads = 0
+    final_dram_writes = 0
+    for namespace in writes:
+        initial_dram_reads = initial_dram_reads + writes[namespace]
+    for namespace in reads:
+        final_dram_writes = final_dram_writes + reads[namespace]
+
+    # The reuse pattern only depends on the order, not on the tile sizes
+    rd_cache_hit = {'wbuf': True, 'ibuf': True, 'obuf': True, 'bbuf': True}
+    wr_cache_hit = {'obuf': True}
+    for loop in order_type:
+        num_tiles = num_tiles_dict[loop]
+        for namespace in writes:
+            if rd_cache_hit[namespace]:
+                if tile_deps[loop][namespace]:
+                    writes[namespace] = writes[namespace] * num_tiles
+                    rd_cache_hit[namespace] = False
+            else:
+                writes[namespace] = writes[namespace] * num_tiles
+
+        for namespace in reads:
+            if wr_cache_hit[namespace]:
+                if tile_deps[loop][namespace]:
+                    reads[namespace] = reads[namespace] * num_tiles
+                    wr_cache_hit[namespace] = False
+            else:
+                reads[namespace] = reads[namespace] * num_tiles
+
+    stats = Stats()
+    for namespace in writes:
+        stats.writes[namespace] = writes[namespace]
+        stats.reads['dram'] = stats.reads['dram'] + writes[namespace]
+    for namespace in reads:
+        stats.reads[namespace] = reads[namespace]
+        stats.writes['dram'] = stats.writes['dram'] + reads[namespace]
+
+    # Activations that stay on chip across layers never go through DRAM
+    valid = tile_stats.Valid
+    if resident_input:
+        num_b, num_ow, num_oh, num_ic = [num_tiles_dict[l] for l in ('B/b', 'OW/ow', 'OH/oh', 'IC/ic')]
+        valid = valid & (num_b * num_ow * num_oh * num_ic == 1)
+        stats.reads['dram'] = stats.reads['dram'] - writes['ibuf']
+        initial_dram_reads = initial_dram_reads - tile_stats.Writes['ibuf']
+    if resident_output:
+        output_size = tile_stats.Reads['obuf']
+        num_b, num_ow, num_oh, num_oc = [num_tiles_dict[l] for l in ('B/b', 'OW/ow', 'OH/oh', 'OC/oc')]
+        stats.writes['dram'] = stats.writes['dram'] - output_size * num_b * num_ow * num_oh * num_oc
+        final_dram_writes = final_dram_writes - output_size
+
+    for namespace in tile_stats.Sram_reads:
+        stats.reads[namespace] = stats.reads[namespace] + tile_stats.Sram_reads[namespace]
+    for namespace in tile_stats.Sram_writes:
+        stats.writes[namespace] = stats.writes[namespace] + tile_stats.Sram_writes[namespace]
+
+    latency = np.ceil(initial_dram_reads / acc_obj.mem_if_width) + \
+            np.ceil(final_dram_writes / acc_obj.mem_if_width)
+
+    total_dram_accesses = stats.reads['dram'] + stats.writes['dram']
+    middle_dram_accesses = total_dram_accesses - initial_dram_reads - final_dram_writes
+
+    compute_cycles = tile_stats.Compute_cycles
+    memory_cycles_required = np.ceil(middle_dram_accesses / acc_obj.mem_if_width)
+
+    memory_stalls = np.maximum(0, memory_cycles_required - compute_cycles) + latency
+    stats.total_cycles = compute_cycles + memory_stalls
+    stats.mem_stall_cycles = memory_stalls
+
+    return stats, valid
+
+def _get_reuse_signature(order_type):
+    """
+    Returns, for every buffer, the loops whose number of tiles multiplies
+    its traffic in get_stats_fast. OW/ow and OH/oh always have the same
+    number of tiles, so they are treated as the same loop.
+    """
+    signature = []
+    for namespace in ('wbuf', 'ibuf', 'obuf', 'bbuf'):
+        for idx, loop in enumerate(order_type):
+            if tile_deps[loop][namespace]:
+                break
+        signature.append(tuple(sorted(symmetric_loops.get(l, l) for l in order_type[idx:])))
+    return tuple(signature)
+
+def _is_dominated(signature, other):
+    """
+    True if the traffic for signature is never lower than for other
+    """
+    for loops, other_loops in zip(signature, other):
+        loops = list(loops)
+        for l in other_loops:
+            if l not in loops:
+                return False
+            loops.remove(l)
+    return True
+
+def get_loop_orders(prune=True):
+    """
+    Returns the loop orders to search
+    Args:
+        prune: keep only one order per reuse signature, and skip orders
+               whose traffic is at least that of an earlier order for
+               every tiling. Such orders can never be strictly better, and
+               the search keeps the earliest order on ties, so the result
+               of the search is unchanged.
+    """
     # Generate permutations for the order
     loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
-    order = set(permutations(loops))
+    orders = list(permutations(loops))
+    if not prune:
+        return orders
+
+    pruned_orders = []
+    signatures = []
+    for o in orders:
+        signature = _get_reuse_signature(o)
+        if any(_is_dominated(signature, s) for s in signatures):
+            continue
+        pruned_orders.append(o)
+        signatures.append(signature)
+    return pruned_orders
+
+def get_worker_pool(num_workers=None):
+    """
+    Creates a pool of worker processes for the tiling search
+    Args:
+        num_workers: number of worker processes, bounded by cpu_count()
+                     and MAX_WORKERS
+    """
+    if num_workers is None:
+        num_workers = cpu_count()
+    num_workers = max(1, min(num_workers, cpu_count(), MAX_WORKERS))
+    return Pool(num_workers)
 
-    return_dict = {}
+def _get_conv_params_with_pool(conv_params, pool_kernel=None, pool_stride=None):
     acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
-
-    #print('optimizing for convolution layer: weights {}x{}x{}x{}'.format(OC,IC,K,K))
-    #print('Batch size: {}'.format(B))
-
     if pool_kernel is None:
         pool_kernel = (1,1,1,1)
     if pool_stride is None:
         pool_stride = (1,1,1,1)
-    conv_params_with_pool = acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride
+    return acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride
 
-    if not sequential:
-        _bound_optimizer_method = functools.partial(_optimize_for_order, conv_params_with_pool)
+def _optimize_work_unit(unit):
+    """
+    Searches all the loop orders of a layer
+    The orders share the tile grid cached in the accelerator, so they are
+    searched by the same worker. Returns the layer index, the result per
+    order and the cache lookups made, see Accelerator.get_cache_stats.
+    """
+    layer_idx, conv_params, orders, extended, budget, residency, objective, dram_budget = unit
+    acc_obj = conv_params[0]
+    before = acc_obj.get_cache_stats()
+    results = [_optimize_for_order(conv_params, o, extended=extended, budget=budget,
+                                   residency=residency, objective=objective, dram_budget=dram_budget)
+               for o in orders]
+    after = acc_obj.get_cache_stats()
+    lookups = dict((name, (after[name].Hits - before[name].Hits, after[name].Misses - before[name].Misses))
+                   for name in after)
+    return layer_idx, results, lookups
+
+def _split_budget(conv_params, num_orders, extended, budget):
+    """
+    Splits the per-layer budget across loop orders
+    Returns the number of orders to search and the budget for each order.
+    Extended tile sizes are trimmed first, down to the powers of two. If
+    the power of two grid does not fit for every order, the search stops
+    after the orders that do fit, and at least one order is searched.
+    """
+    if budget is None:
+        return num_orders, None
+    order_budget = max(1, budget // num_orders)
+    tile_sizes = get_search_tile_sizes(conv_params, extended, order_budget)
+    num_tilings = int(np.prod([len(sizes) for sizes in tile_sizes]))
+    return max(1, min(num_orders, budget // num_tilings)), order_budget
+
+def _select_best(results, objective=OBJECTIVE_CYCLES, dram_budget=None):
+    best_cost = None
+    best_tiling = None
+    best_order  = None
+    for r in results:
+        tiling, order_type, cycles, energy, dram, _, _ = r
+        if tiling is None:
+            continue
+        cost = get_objective_cost(cycles, energy, dram, objective, dram_budget)
+        if best_cost is None or cost < best_cost:
+            best_cost = cost
+            best_tiling = tiling
+            best_order = order_type
+    cycles_array = np.stack([r[-2] for r in results])
+    energy_array = np.stack([r[-1] for r in results])
+    return best_tiling, best_order, cycles_array, energy_array
+
+def optimize_layers(layers, sequential=True, pool=None, prune=True, extended=True, budget=SEARCH_BUDGET,
+                    objective=OBJECTIVE_CYCLES, dram_budget=None):
+    """
+    Optimizes tiling and ordering for a batch of convolution layers
+    All layers are submitted to the worker pool at once, one work unit per
+    layer holding all its loop orders.
+    Args:
+        layers: list of (conv_params, pool_kernel, pool_stride) tuples
+        sequential: search in the current process
+        pool: reusable worker pool from get_worker_pool. If None, a
+              temporary pool is created for this call
+        prune: skip equivalent and dominated loop orders
+        extended: also search divisor and SRAM-filling tile sizes
+        budget: maximum number of tilings evaluated per layer, or None
+        objective, dram_budget: see get_objective_cost
+    Returns:
+        list of (best_tiling, best_order, cycles_array, energy_array), one
+        per layer. cycles_array and energy_array have one row per loop order
+        searched: row i is get_loop_orders(prune)[i], and with a budget only
+        the first orders may be searched, see _split_budget. With pruning
+        that is at most 3 rows rather than 120. Each row is indexed by the
+        (b, o, ic, oc) tile sizes of get_search_tile_sizes, and invalid
+        tilings are 0.
+    """
+    layers = [(conv_params, pool_kernel, pool_stride, (False, False))
+              for conv_params, pool_kernel, pool_stride in layers]
+    return _search(layers, sequential, pool, prune, extended, budget, objective, dram_budget)
 
+def _search(layers, sequential, pool, prune, extended, budget, objective=OBJECTIVE_CYCLES, dram_budget=None):
+    """
+    Runs the search for a list of
+    (conv_params, pool_kernel, pool_stride, (resident_input, resident_output))
+    """
+    orders = get_loop_orders(prune)
+
+    units = []
+    for layer_idx, (conv_params, pool_kernel, pool_stride, residency) in enumerate(layers):
+        conv_params_with_pool = _get_conv_params_with_pool(conv_params, pool_kernel, pool_stride)
+        num_orders, order_budget = _split_budget(conv_params_with_pool, len(orders), extended, budget)
+        if num_orders < len(orders):
+            logger.debug('Search budget exhausted after {} of {} loop orders'.format(num_orders, len(orders)))
+        units.append((layer_idx, conv_params_with_pool, orders[:num_orders], extended, order_budget, residency,
+                      objective, dram_budget))
+
+    if sequential:
+        results = [_optimize_work_unit(u) for u in units]
+    else:
+        own_pool = pool is None
+        if own_pool:
+            pool = get_worker_pool()
         try:
-            pool = Pool(cpu_count())
-            results = pool.map_async(_bound_optimizer_method, order).get(10000)
+            chunksize = max(1, len(units) // (4 * cpu_count()))
+            results = pool.map_async(_optimize_work_unit, units, chunksize).get(10000)
+        except KeyboardInterrupt:
+            pool.terminate()
+            pool.join()
+            raise
+        if own_pool:
             pool.close()
             pool.join()
+        # The lookups were made on copies of the accelerators
+        for layer_idx, _, lookups in results:
+            layers[layer_idx][0][0].add_cache_lookups(lookups)
 
-            # for o in order:
-            #     _bound_optimizer_method(o)
-            # exit()
-
-            best_cycles = None
-            best_energy = None
-            min_cycles = min([x[-4] for x in results])
-            min_energy = min([x[-3] for x in results])
-            cycles_list = [x[-2] for x in results]
-            energy_list = [x[-1] for x in results]
-            energy_array = np.stack(energy_list)
-            cycles_array = np.stack(cycles_list)
-            for r in results:
-                tiling, order_type, cycles, energy, _, _ = r
-                # print('{}:\n{}\n\t{:1.2f}, {:1.2f}'.format(order_type, tiling, cycles/float(min_cycles), energy/float(min_energy)))
-                if best_cycles is None or best_cycles > cycles or (best_cycles == cycles and best_energy > energy):
-                    best_cycles = cycles
-                    best_energy = energy
-                    best_tiling = tiling
-                    best_order = order_type
-            return best_tiling, best_order, cycles_array, energy_array
+    return [_select_best(r, objective, dram_budget) for _, r, _ in results]
 
-        except KeyboardInterrupt:
-            pool.terminate()
-            pool.join()
-            return
+def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequential=True, pool=None, prune=True,
+                       extended=True, budget=SEARCH_BUDGET, objective=OBJECTIVE_CYCLES, dram_budget=None):
+    """
+    Optimizes tiling and ordering for a convolution layer
+    Args:
+        conv_params: A tuple with convolution params
+        sequential: search in the current process
+        pool: reusable worker pool from get_worker_pool
+        prune: skip equivalent and dominated loop orders
+        extended: also search divisor and SRAM-filling tile sizes
+        budget: maximum number of tilings evaluated, or None
+        objective, dram_budget: see get_objective_cost
+    Returns:
+        (best_tiling, best_order, cycles_array, energy_array), see
+        optimize_layers for the rows of the arrays
+    """
+    return optimize_layers([(conv_params, pool_kernel, pool_stride)], sequential=sequential, pool=pool, prune=prune,
+                           extended=extended, budget=budget, objective=objective, dram_budget=dram_budget)[0]
 
-    else:
-        best_cycles = None
-        best_energy = None
-        best_tiling = None
-        best_order  = None
-        for o in order:
-            tiling, order_type, cycles, energy, _, _ = _optimize_for_order(conv_params_with_pool, o)
-            if best_cycles is None or best_cycles > cycles:
-                best_cycles = cycles
-                best_energy = energy
-                best_tiling = tiling
-                best_order  = order_type
-            elif best_cycles == cycles and best_energy > energy:
-                best_cycles = cycles
-                best_energy = energy
-                best_tiling = tiling
-                best_order  = order_type
-        return best_tiling, best_order, None, None
-
-def _optimize_for_order(conv_params, order_type, verbose=False):
+def optimize_graph(layers, boundaries, sequential=True, pool=None, prune=True, extended=True, budget=SEARCH_BUDGET,
+                   objective=OBJECTIVE_CYCLES, dram_budget=None):
     """
-    For a given ordering, optimizes tiling
+    Optimizes tiling and ordering for a chain of convolution layers together
+    Activations may stay on chip between adjacent layers: the consumer then
+    reads its whole input from IBUF, and the producer does not write its
+    output to DRAM. Each layer is searched with and without residency on
+    both sides, and the combination with the least total cost is chosen.
+    The result is an estimate only: the code generator always loads and
+    stores activations through DDR, so GraphCompiler uses it for
+    plan_graph and the Simulator, and compile rejects it.
+    Args:
+        layers: list of (conv_params, pool_kernel, pool_stride) tuples, in
+                execution order
+        boundaries: one boolean per pair of adjacent layers, True if the
+                    output of a layer is only consumed by the next one
+        objective, dram_budget: see get_objective_cost. The DRAM budget
+                    applies to each layer, and the traffic over it is
+                    summed over the chain
+    Returns:
+        results: list of (best_tiling, best_order, cycles_array,
+                 energy_array), one per layer
+        resident: one boolean per boundary, True if the activations stay
+                  on chip
+    """
+    assert len(boundaries) == len(layers) - 1
+
+    variants = []
+    for i in range(len(layers)):
+        in_options = (False, True) if i > 0 and boundaries[i-1] else (False,)
+        out_options = (False, True) if i < len(boundaries) and boundaries[i] else (False,)
+        for resident_input in in_options:
+            for resident_output in out_options:
+                variants.append((i, (resident_input, resident_output)))
+
+    search_results = _search([tuple(layers[i]) + (residency,) for i, residency in variants],
+                             sequential, pool, prune, extended, budget, objective, dram_budget)
+
+    def _get_cost(cycles, energy, dram_excess):
+        return get_objective_cost(cycles, energy, dram_excess, objective, 0 if dram_budget is not None else None)
+
+    # (cycles, energy, DRAM traffic over the budget) for every feasible
+    # variant
+    costs = {}
+    layer_results = {}
+    for (i, residency), r in zip(variants, search_results):
+        tiling, order_type, _, _ = r
+        if tiling is None:
+            continue
+        conv_params = _get_conv_params_with_pool(*layers[i])
+        stats = get_stats_fast(conv_params, tiling, order_type,
+                               resident_input=residency[0], resident_output=residency[1])
+        dram = stats.reads['dram'] + stats.writes['dram']
+        dram_excess = max(dram - dram_budget, 0) if dram_budget is not None else 0
+        costs[(i, residency)] = (stats.total_cycles, stats.get_energy(conv_params[10]), dram_excess)
+        layer_results[(i, residency)] = r
+
+    # Dynamic programming over the chain; the state is whether the output
+    # of the current layer stays on chip
+    best = {False: ((0, 0, 0), [])}
+    for i in range(len(layers)):
+        curr = {}
+        for (resident_input, resident_output) in [v for l, v in variants if l == i]:
+            if resident_input not in best or (i, (resident_input, resident_output)) not in costs:
+                continue
+            cost, path = best[resident_input]
+            cost = tuple(a + b for a, b in zip(cost, costs[(i, (resident_input, resident_output))]))
+            if resident_output not in curr or _get_cost(*cost) < _get_cost(*curr[resident_output][0]):
+                curr[resident_output] = (cost, path + [(resident_input, resident_output)])
+        best = curr
+
+    if False not in best:
+        # No feasible tiling for some layer
+        return [(None, None, None, None)] * len(layers), [False] * len(boundaries)
+
+    _, path = best[False]
+    results = [layer_results[(i, residency)] for i, residency in enumerate(path)]
+    resident = [residency[1] for residency in path[:-1]]
+
+    return results, resident
+
+def _get_divisors(n):
+    """
+    Returns the divisors of n in increasing order
+    """
+    small = []
+    large = []
+    d = 1
+    while d * d <= n:
+        if n % d == 0:
+            small.append(d)
+            if d * d != n:
+                large.append(n // d)
+        d += 1
+    return small + large[::-1]
+
+def _merge_tile_sizes(*size_lists):
+    """
+    Concatenates lists of tile sizes, dropping repeated sizes
+    """
+    sizes = []
+    for l in size_lists:
+        for s in l:
+            if s not in sizes:
+                sizes.append(s)
+    return sizes
+
+def get_tile_sizes(conv_params, extended=True):
+    """
+    Returns the candidate tile sizes for the B, O (after pooling), IC and OC
+    loops, each in decreasing order of priority
     Args:
         conv_params: A tuple with convolution params
-        order_type: ordering loop
+        extended: besides powers of two, propose exact divisors of each
+                  loop and the largest exact tiles that fit in the SRAMs.
+                  IC and OC tiles stay multiples of N and M, and only O
+                  tiles that divide the output exactly are proposed.
     """
     acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride = conv_params
-    I = (O - 1) * S + K
 
     pool_O = (O - pool_kernel[1]) / pool_stride[1] + 1
 
-    # print('Pool output: {}'.format(pool_O))
-
     # We do not tile the "K" dimension and compute an entire 2-D conv at a
     # time
     num_O_tiles = int(math.ceil(log2(pool_O))) + 1
@@ -282,93 +810,238 @@ def _optimize_for_order(conv_params, order_type, verbose=False):
     # TODO: Fix?
     if im2col:
         num_OC_tiles = int(math.ceil(log2(OC))) + 1
+        oc_unit = 1
     else:
         num_OC_tiles = int(math.ceil(log2(math.ceil(float(OC)/acc_obj.M)))) + 1
+        oc_unit = acc_obj.M
 
     num_B_tiles = int(math.ceil(log2(B))) + 1
 
-    best_cycles = None
-    best_energy = None
-    best_tiling = None
+    b_sizes = [min(1 << _b, B) for _b in range(num_B_tiles)]
+    o_sizes = [min(1 << _o, pool_O) for _o in range(num_O_tiles)]
+    ic_sizes = [min(1 << _ic, IC) for _ic in range(num_IC_tiles)]
+    oc_sizes = [min((1 << _oc) * oc_unit, OC) for _oc in range(num_OC_tiles)]
 
-    cycle_array = np.zeros((num_B_tiles, num_O_tiles, num_IC_tiles, num_OC_tiles), dtype=np.float)
-    energy_array = np.zeros((num_B_tiles, num_O_tiles, num_IC_tiles, num_OC_tiles), dtype=np.float)
+    if not extended:
+        return b_sizes, o_sizes, ic_sizes, oc_sizes
 
-    for _b in range(num_B_tiles):
-        b = min(1 << _b, B)
-        num_b = ceil_a_by_b(B, b)
+    # Power-of-two output tiles that do not divide the output are never valid
+    o_sizes = [p for p in o_sizes if ceil_a_by_b(pool_O, p) * p == pool_O]
 
-        for _o in range(num_O_tiles):
-            p_ow = min(1 << _o, pool_O)
-            p_oh = p_ow
-            ow = (p_ow-1) * pool_stride[1] + pool_kernel[1]
-            oh = (p_oh-1) * pool_stride[2] + pool_kernel[2]
-            num_ow = ceil_a_by_b(pool_O, p_ow)
-            num_oh = ceil_a_by_b(pool_O, p_oh)
+    b_div = _get_divisors(B)
+    if pool_O == int(pool_O):
+        o_div = _get_divisors(int(pool_O))
+    else:
+        o_div = []
+    if IC % acc_obj.N == 0:
+        ic_div = [d * acc_obj.N for d in _get_divisors(IC // acc_obj.N)]
+    else:
+        ic_div = []
+    if OC % oc_unit == 0:
+        oc_div = [d * oc_unit for d in _get_divisors(OC // oc_unit)]
+    else:
+        oc_div = []
+
+    # Buffer sizes for a tile, as in get_stats_fast
+    def _ibuf(b, p, ic):
+        ow = (p - 1) * pool_stride[1] + pool_kernel[1]
+        oh = (p - 1) * pool_stride[2] + pool_kernel[2]
+        iw = (ow - 1) * S + K
+        ih = (oh - 1) * S + K
+        return iw * ih * ceil_a_by_b(ic, acc_obj.N) * acc_obj.N * b * iprec
+    def _wbuf(ic, oc):
+        return ceil_a_by_b(ic, acc_obj.N) * acc_obj.N * ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * K * K * wprec
+    def _obuf(b, p, oc):
+        ow = (p - 1) * pool_stride[1] + pool_kernel[1]
+        oh = (p - 1) * pool_stride[2] + pool_kernel[2]
+        return ow * oh * ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * b * 64
+    def _fits(b, p, ic, oc):
+        return (_ibuf(b, p, ic) <= acc_obj.sram['ibuf'] / 2 and
+                _wbuf(ic, oc) <= acc_obj.sram['wbuf'] / 2 and
+                _obuf(b, p, oc) <= acc_obj.sram['obuf'] / 2 and
+                ceil_a_by_b(oc, acc_obj.M) * acc_obj.M * 32 <= acc_obj.sram['bbuf'] / 2)
+
+    # Largest exact tile for each loop that fits when every other loop uses
+    # its smallest tile
+    b_min = b_div[0]
+    o_min = min(o_div + o_sizes + [pool_O])
+    ic_min = min(ic_div + ic_sizes)
+    oc_min = min(oc_div + oc_sizes)
+    b_fill = [b for b in b_div if _fits(b, o_min, ic_min, oc_min)][-1:]
+    o_fill = [p for p in o_div if _fits(b_min, p, ic_min, oc_min)][-1:]
+    ic_fill = [ic for ic in ic_div if _fits(b_min, o_min, ic, oc_min)][-1:]
+    oc_fill = [oc for oc in oc_div if _fits(b_min, o_min, ic_min, oc)][-1:]
+
+    return (_merge_tile_sizes(b_fill, b_sizes, b_div),
+            _merge_tile_sizes(o_fill, o_sizes, o_div, [pool_O]),
+            _merge_tile_sizes(ic_fill, ic_sizes, ic_div),
+            _merge_tile_sizes(oc_fill, oc_sizes, oc_div))
+
+def trim_tile_sizes(tile_sizes, budget, keep=None):
+    """
+    Drops the lowest priority tile sizes until the number of tilings is
+    within budget. At least one size is kept for every loop.
+    Args:
+        tile_sizes: lists of tile sizes, as returned by get_tile_sizes
+        budget: maximum number of tilings, or None for no limit
+        keep: lists of tile sizes that are never dropped, or None
+    Returns the trimmed lists, which can be over budget if only sizes from
+    keep are left.
+    """
+    tile_sizes = [list(sizes) for sizes in tile_sizes]
+    if budget is None:
+        return tile_sizes
+    if keep is None:
+        keep = [[] for _ in tile_sizes]
+    while np.prod([len(sizes) for sizes in tile_sizes]) > budget:
+        # Lowest priority droppable size of the longest list
+        droppable = []
+        for i, sizes in enumerate(tile_sizes):
+            drop = [j for j, s in enumerate(sizes) if s not in keep[i]]
+            if len(sizes) > 1 and len(drop) > 0:
+                droppable.append((len(sizes), -i, drop[-1]))
+        if len(droppable) == 0:
+            break
+        _, i, j = max(droppable)
+        tile_sizes[-i].pop(j)
+    return tile_sizes
+
+def get_search_tile_sizes(conv_params, extended=True, budget=None):
+    """
+    Returns the tile sizes searched for one loop order: get_tile_sizes
+    trimmed to budget, without dropping the powers of two
+    """
+    keep = get_tile_sizes(conv_params, extended=False)
+    return trim_tile_sizes(get_tile_sizes(conv_params, extended), budget, keep)
 
-            if num_ow * p_ow != pool_O:
-                # print('p_ow: {}; ow: {}; num_ow: {}'.format(p_ow, ow, num_ow))
-                continue
+def _get_tile_grid(conv_params, extended, budget):
+    """
+    Returns the candidate tilings of a layer for _optimize_for_order, as
+    (b_tiles, ow_tiles, oh_tiles, ic_tiles, oc_tiles, o_valid, tiling,
+    tile_stats)
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride = conv_params
 
-            for _ic in range(num_IC_tiles):
-                ic = min(1 << _ic, IC)
-                num_ic = ceil_a_by_b(IC, ic)
-
-                for _oc in range(num_OC_tiles):
-
-                    if im2col:
-                        oc = min((1 << _oc), OC)
-                    else:
-                        oc = min((1 << _oc) * acc_obj.M, OC)
-
-                    num_oc = ceil_a_by_b(OC, oc)
-
-                    iw = K + (ow - 1) * S
-                    ih = K + (oh - 1) * S
-
-                    tiling = {}
-                    tiling['B/b'] = (num_b, b)
-                    tiling['OW/ow'] = (num_ow, ow)
-                    tiling['OH/oh'] = (num_oh, oh)
-                    tiling['IC/ic'] = (num_ic, ic)
-                    tiling['OC/oc'] = (num_oc, oc)
-
-#                     print(tiling)
-
-                    stats = get_stats_fast(conv_params, tiling, order_type, verbose=verbose)
-                    #break
-                    if stats is None:
-                        continue
-
-                    cycles = stats.total_cycles
-                    cycle_array[_b, _o, _ic, _oc] = cycles
-                    energy = stats.get_energy(energy_cost)
-                    energy_array[_b, _o, _ic, _oc] = energy
-                    mem_cycles = stats.mem_stall_cycles
-
-                    # fail = stats.total_cycles > 1.1* stats.total_cycles
-                    # fail += stats.total_cycles < 0.9* stats.total_cycles
-                    # if fail > 0:
-                    #     logger.error('Simulated cycles: {:,}'.format(cycles))
-                    #     logger.error('Simulated memory cycles: {:,}'.format(mem_cycles))
-                    #     logger.error('new cycles: {:,}'.format(stats.total_cycles))
-                    #     logger.error('new memory cycles: {:,}'.format(stats.mem_stall_cycles))
-                    #     get_stats_fast(conv_params, tiling, order_type, verbose=True)
-                    #     exit()
-
-                    if best_cycles is None or best_cycles > cycles or (best_cycles == cycles and best_energy > energy):
-                    # if best_energy is None or best_energy > energy or (best_energy == energy and best_cycles > cycles):
-                        best_energy = energy
-                        best_cycles = cycles
-                        best_mem_cycles = mem_cycles
-                        best_order = order_type
-                        best_tiling = tiling
-                        # for o in best_order:
-                            # best_tiling.append(tiling[o])
-
-#     if best_cycles is None:
-# #         print('Not found')
-# #         print(conv_params)
-#         stats = get_stats_fast(conv_params, tiling, order_type, verbose=True)
-
-    return (best_tiling, order_type, best_cycles, best_energy, cycle_array, energy_array)
+    pool_O = (O - pool_kernel[1]) / pool_stride[1] + 1
+
+    b_sizes, o_sizes, ic_sizes, oc_sizes = get_search_tile_sizes(conv_params, extended, budget)
+
+    # Enumerate in increasing size so that ties go to the smallest tiles
+    b_sizes, o_sizes, ic_sizes, oc_sizes = [sorted(sizes) for sizes in (b_sizes, o_sizes, ic_sizes, oc_sizes)]
+    num_B_tiles = len(b_sizes)
+    num_O_tiles = len(o_sizes)
+    num_IC_tiles = len(ic_sizes)
+    num_OC_tiles = len(oc_sizes)
+
+    # Candidate (num_tiles, tile_size) for each loop
+    b_tiles = []
+    for b in b_sizes:
+        b_tiles.append((ceil_a_by_b(B, b), b))
+
+    ow_tiles = []
+    oh_tiles = []
+    o_valid = []
+    for p_ow in o_sizes:
+        p_oh = p_ow
+        ow = (p_ow-1) * pool_stride[1] + pool_kernel[1]
+        oh = (p_oh-1) * pool_stride[2] + pool_kernel[2]
+        num_ow = ceil_a_by_b(pool_O, p_ow)
+        num_oh = ceil_a_by_b(pool_O, p_oh)
+        ow_tiles.append((num_ow, ow))
+        oh_tiles.append((num_oh, oh))
+        o_valid.append(num_ow * p_ow == pool_O)
+
+    ic_tiles = []
+    for ic in ic_sizes:
+        ic_tiles.append((ceil_a_by_b(IC, ic), ic))
+
+    oc_tiles = []
+    for oc in oc_sizes:
+        oc_tiles.append((ceil_a_by_b(OC, oc), oc))
+
+    grid_shape = (num_B_tiles, num_O_tiles, num_IC_tiles, num_OC_tiles)
+
+    def _grid(tiles, axis):
+        shape = [1] * len(grid_shape)
+        shape[axis] = len(tiles)
+        num = np.array([float(t[0]) for t in tiles]).reshape(shape)
+        size = np.array([float(t[1]) for t in tiles]).reshape(shape)
+        return num, size
+
+    tiling = {}
+    tiling['B/b'] = _grid(b_tiles, 0)
+    tiling['OW/ow'] = _grid(ow_tiles, 1)
+    tiling['OH/oh'] = _grid(oh_tiles, 1)
+    tiling['IC/ic'] = _grid(ic_tiles, 2)
+    tiling['OC/oc'] = _grid(oc_tiles, 3)
+
+    o_valid = np.array(o_valid).reshape((1, num_O_tiles, 1, 1))
+    o_valid.setflags(write=False)
+    return b_tiles, ow_tiles, oh_tiles, ic_tiles, oc_tiles, o_valid, tiling, get_tile_stats(conv_params, tiling)
+
+def _optimize_for_order(conv_params, order_type, verbose=False, extended=True, budget=None, residency=(False, False),
+                        objective=OBJECTIVE_CYCLES, dram_budget=None):
+    """
+    For a given ordering, optimizes tiling
+    All candidate tilings are scored at once using get_stats_vectorized
+    Args:
+        conv_params: A tuple with convolution params
+        order_type: ordering loop
+        extended: search the tile sizes from get_tile_sizes(extended=True)
+        budget: maximum number of tilings to evaluate
+        residency: (resident_input, resident_output), see get_stats_fast
+        objective, dram_budget: see get_objective_cost
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride = conv_params
+
+    # The grid of tilings and its TileStats are the same for every order
+    # and residency of a layer
+    key = (acc_obj.N, acc_obj.M, tuple(sorted(acc_obj.sram.items())), K, O, S, IC, OC, B, iprec, wprec,
+           bool(im2col), tuple(pool_kernel), tuple(pool_stride), extended, budget)
+    cache = acc_obj.get_cache('tile_stats')
+    grid = cache.get(key)
+    if grid is None:
+        grid = _get_tile_grid(conv_params, extended, budget)
+        cache.put(key, grid)
+    b_tiles, ow_tiles, oh_tiles, ic_tiles, oc_tiles, o_valid, tiling, tile_stats = grid
+    grid_shape = tile_stats.Valid.shape
+
+    resident_input, resident_output = residency
+    stats, valid = get_stats_vectorized(conv_params, tiling, order_type, resident_input=resident_input,
+                                        resident_output=resident_output, tile_stats=tile_stats)
+    valid = valid & o_valid
+
+    cycles = stats.total_cycles
+    energy = stats.get_energy(energy_cost)
+
+    cycle_array = np.where(valid, cycles, 0.)
+    energy_array = np.where(valid, energy, 0.)
+
+    best_tiling = None
+    best_cycles = None
+    best_energy = None
+    best_dram = None
+
+    if valid.any():
+        # Pick the least cost, break ties with the enumeration order
+        candidates = np.flatnonzero(valid)
+        dram = stats.reads['dram'] + stats.writes['dram']
+        cost = get_objective_cost(cycles, energy, dram, objective, dram_budget)
+        # lexsort is stable and sorts by its last key first
+        keys = [np.broadcast_to(c, grid_shape).ravel()[candidates] for c in reversed(cost)]
+        _b, _o, _ic, _oc = np.unravel_index(candidates[np.lexsort(keys)[0]], grid_shape)
+
+        best_tiling = {}
+        best_tiling['B/b'] = b_tiles[_b]
+        best_tiling['OW/ow'] = ow_tiles[_o]
+        best_tiling['OH/oh'] = oh_tiles[_o]
+        best_tiling['IC/ic'] = ic_tiles[_ic]
+        best_tiling['OC/oc'] = oc_tiles[_oc]
+
+        stats = get_stats_fast(conv_params, best_tiling, order_type, verbose=verbose,
+                               resident_input=resident_input, resident_output=resident_output)
+        best_cycles = stats.total_cycles
+        best_energy = stats.get_energy(energy_cost)
+        best_dram = stats.reads['dram'] + stats.writes['dram']
+
+    return (best_tiling, order_type, best_cycles, best_energy, best_dram, cycle_array, energy_array)
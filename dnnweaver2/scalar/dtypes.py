@@ -26,6 +26,8 @@ class FixedPoint(Dtype):
     def __ne__(self, other):
         result = not self.__eq__(other)
         return result
+    def __hash__(self):
+        return hash((self.bits, self.frac_bits))
 
 class Log(Dtype):
     def __init__(self, exp_bits):
@@ -1,10 +1,36 @@
-from dnnweaver2.utils.utils import ceil_a_by_b, log2
+from collections import namedtuple
+
+import numpy as np
+
+from dnnweaver2.utils.utils import ceil_a_by_b, log2, LRUCache
 from dnnweaver2.simulator.stats import Stats
 
+# Maximum number of entries of each cost model cache of an Accelerator.
+# Tile statistics hold a numpy array per tiling grid, so keep fewer of them.
+CACHE_SIZES = {'compute_cycles': 1 << 16,
+               'buffer_sizes': 1 << 16,
+               'tile_stats': 32}
+
+# Hit and miss counters of a cache, see Accelerator.get_cache_stats
+CacheStats = namedtuple('CacheStats', ['Hits', 'Misses', 'Entries'])
+
+def get_loop_cycles(loops, overhead=2):
+    """
+    Returns the cycles of a loop nest
+    Args:
+        loops: tuple of trip counts, outermost first
+        overhead: cycles added by every iteration of each loop
+    """
+    cycles = 1
+    for it in loops:
+        cycles = overhead + it * cycles
+    return cycles
+
 class Accelerator(object):
     def __init__(self, N, M, prec, sram, mem_if_width, frequency):
         """
         accelerator object
+        The cost model kernels are memoized per instance, see get_cache.
         """
         self.N = N
         self.M = M
@@ -12,6 +38,49 @@ class Accelerator(object):
         self.mem_if_width = mem_if_width
         self.frequency = frequency
         self.prec = prec
+        self.caches = dict((name, LRUCache(size)) for name, size in CACHE_SIZES.items())
+
+    def __getstate__(self):
+        # Accelerators are sent to the tiling search workers with every work
+        # unit; the caches are rebuilt there instead of being copied. A unit
+        # holds all the loop orders of a layer, so its lookups still hit.
+        state = self.__dict__.copy()
+        del state['caches']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.caches = dict((name, LRUCache(size)) for name, size in CACHE_SIZES.items())
+
+    def get_cache(self, name):
+        """
+        Returns the LRUCache called name, one of CACHE_SIZES
+        Entries only depend on their key, so they stay valid if the
+        attributes of the accelerator change.
+        """
+        return self.caches[name]
+
+    def get_cache_stats(self):
+        """
+        Returns a dict from cache name to CacheStats
+        With a parallel tiling search, the lookups made by the worker
+        processes are counted, but their entries stay in the workers.
+        """
+        return dict((name, CacheStats(c.hits, c.misses, len(c))) for name, c in self.caches.items())
+
+    def add_cache_lookups(self, lookups):
+        """
+        Adds lookups made on a copy of the accelerator to the counters
+        Args:
+            lookups: dict from cache name to (hits, misses)
+        """
+        for name, (hits, misses) in lookups.items():
+            self.caches[name].hits += hits
+            self.caches[name].misses += misses
+
+    def clear_caches(self):
+        for c in self.caches.values():
+            c.clear()
 
     def get_mem_read_cycles(self, dst, size):
         """
@@ -75,12 +144,32 @@ class Accelerator(object):
         _ic = ceil_a_by_b(ic, self.N)
 
         loops = (b, _oc, oh, ow, kh, kw, _ic)
-        loops = sorted(loops, reverse=True)
+        cache = self.caches['compute_cycles']
+        cycles = cache.get(loops)
+        if cycles is None:
+            cycles = get_loop_cycles(tuple(sorted(loops, reverse=True)))
+            cache.put(loops, cycles)
+        return cycles
+
+    def get_compute_cycles_vectorized(self, ic, oc, ow, oh, b, kw, kh, iprec, wprec, im2col=False):
+        """
+        Vectorized version of get_compute_cycles
+        args:
+            ic, oc, ow, oh, b, kw, kh: numpy arrays (or scalars) that
+                broadcast against each other
+        returns:
+            numpy array with the compute cycles for every element
+        """
+        _oc = np.ceil(np.true_divide(oc, self.M))
+        _ic = np.ceil(np.true_divide(ic, self.N))
+
+        loops = np.broadcast_arrays(b, _oc, oh, ow, kh, kw, _ic)
+        loops = np.sort(np.stack(loops, axis=-1).astype(np.float64), axis=-1)
 
         overhead = 2
-        cycles = 1
-        for it in loops:
-            cycles = overhead + it * cycles
+        cycles = np.ones(loops.shape[:-1], dtype=np.float64)
+        for i in reversed(range(loops.shape[-1])):
+            cycles = overhead + loops[..., i] * cycles
 
         return cycles
 
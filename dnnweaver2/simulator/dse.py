@@ -0,0 +1,252 @@
+import csv
+import itertools
+import json
+import logging
+import os
+from collections import namedtuple
+
+from dnnweaver2 import benchmarks
+from dnnweaver2.compiler import GraphCompiler
+from dnnweaver2.optimizer.optimizer import get_worker_pool, COST_MODEL_VERSION, SEARCH_BUDGET
+from dnnweaver2.simulator.accelerator import Accelerator
+from dnnweaver2.simulator.simulator import Simulator
+
+# One accelerator configuration of the sweep
+#   N, M: systolic array rows and columns
+#   Ibuf_depth, Wbuf_depth, Obuf_depth, Bbuf_depth: entries per buffer, see
+#                                                   get_sram
+#   Mem_if_width: memory interface width in bits
+DesignPoint = namedtuple('DesignPoint', ['N', 'M', 'Ibuf_depth', 'Wbuf_depth', 'Obuf_depth', 'Bbuf_depth',
+                                         'Mem_if_width'])
+
+# Predicted cost of a DesignPoint over all the benchmarks of the sweep
+#   Cycles, Latency: sum over the benchmarks, Latency in seconds
+#   Sram_bits: total SRAM of the accelerator
+#   Dram_bits: DRAM reads + writes, summed over the benchmarks
+#   Benchmark_latency: list of (benchmark, seconds)
+#   Error: why the point is infeasible, e.g. a layer that does not fit in
+#          the SRAM, or None. The costs of infeasible points are None.
+DSEResult = namedtuple('DSEResult', ['Point', 'Cycles', 'Latency', 'Sram_bits', 'Dram_bits',
+                                     'Benchmark_latency', 'Error'])
+
+_OBJECTIVES = ('Latency', 'Sram_bits', 'Dram_bits')
+
+def get_sram(point, prec):
+    """
+    Returns the sram dict of Accelerator for a DesignPoint
+    Each buffer is one array-wide word per entry, twice for double buffering:
+    IBUF N * prec, WBUF N * M * prec, OBUF M * 64 and BBUF M * 32 bits.
+    """
+    return {'ibuf': point.N * prec * point.Ibuf_depth * 2,
+            'wbuf': point.N * point.M * prec * point.Wbuf_depth * 2,
+            'obuf': point.M * 64 * point.Obuf_depth * 2,
+            'bbuf': point.M * 32 * point.Bbuf_depth * 2}
+
+def get_accelerator(point, prec=16, frequency=150e6):
+    """
+    Returns the Accelerator for a DesignPoint
+    """
+    return Accelerator(point.N, point.M, prec, get_sram(point, prec), point.Mem_if_width, frequency)
+
+def get_design_points(array_shapes, ibuf_depths, wbuf_depths, obuf_depths, bbuf_depths, mem_if_widths):
+    """
+    Returns the DesignPoint for every combination of the arguments
+    Args:
+        array_shapes: list of (N, M)
+        *_depths: list of entries for each buffer
+        mem_if_widths: list of memory interface widths in bits
+    """
+    points = []
+    for (n, m), ibuf, wbuf, obuf, bbuf, width in itertools.product(
+            array_shapes, ibuf_depths, wbuf_depths, obuf_depths, bbuf_depths, mem_if_widths):
+        points.append(DesignPoint(n, m, ibuf, wbuf, obuf, bbuf, width))
+    return points
+
+def evaluate_point(point, benchmark_names, prec=16, frequency=150e6, search_budget=SEARCH_BUDGET):
+    """
+    Returns the DSEResult of a DesignPoint
+    Each benchmark graph is tiled for the accelerator and costed by the
+    optimizer's cost model, see Simulator.
+    """
+    acc_obj = get_accelerator(point, prec, frequency)
+    sram_bits = sum(acc_obj.sram.values())
+    cycles = 0
+    latency = 0.
+    dram_bits = 0
+    benchmark_latency = []
+    for name in benchmark_names:
+        # The simulator sets the FPGA padding of the tensors, so every
+        # point gets its own graph
+        graph = benchmarks.get_graph(name, train=False)
+        compiler = GraphCompiler(sequential=True, search_budget=search_budget, log_level=logging.WARNING)
+        try:
+            total = Simulator(acc_obj, compiler, log_level=logging.WARNING).run(graph).total
+        except ValueError as e:
+            return DSEResult(point, None, None, sram_bits, None, None, '{}: {}'.format(name, e))
+        cycles += total.Cycles
+        latency += total.Time
+        dram_bits += total.Dram_read_bits + total.Dram_write_bits
+        benchmark_latency.append((name, total.Time))
+    return DSEResult(point, cycles, latency, sram_bits, dram_bits, benchmark_latency, None)
+
+def _evaluate_work_unit(unit):
+    point, benchmark_names, prec, frequency, search_budget = unit
+    return evaluate_point(point, benchmark_names, prec, frequency, search_budget)
+
+def dominates(a, b):
+    """
+    Returns True if DSEResult a is no worse than b in latency, SRAM bits
+    and DRAM traffic, and better in at least one
+    """
+    a_cost = [getattr(a, o) for o in _OBJECTIVES]
+    b_cost = [getattr(b, o) for o in _OBJECTIVES]
+    return all(x <= y for x, y in zip(a_cost, b_cost)) and a_cost != b_cost
+
+def get_pareto_frontier(results):
+    """
+    Returns the feasible results that no other result dominates, fastest first
+    """
+    feasible = [r for r in results if r.Error is None]
+    frontier = [r for r in feasible if not any(dominates(other, r) for other in feasible)]
+    return sorted(frontier, key=lambda r: [getattr(r, o) for o in _OBJECTIVES])
+
+def get_best_for_budget(results, sram_bits, num_pes=None):
+    """
+    Returns the fastest feasible result within an SRAM budget in bits and,
+    if given, a budget of N * M processing elements, or None
+    """
+    fits = [r for r in results if r.Error is None and r.Sram_bits <= sram_bits and
+            (num_pes is None or r.Point.N * r.Point.M <= num_pes)]
+    if len(fits) == 0:
+        return None
+    return min(fits, key=lambda r: (r.Latency, r.Sram_bits, r.Dram_bits))
+
+def write_results_csv(results, path):
+    """
+    Writes one row per DSEResult, with the latency of every benchmark
+    """
+    names = []
+    for r in results:
+        for name, _ in r.Benchmark_latency or []:
+            if name not in names:
+                names.append(name)
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(DesignPoint._fields) + ['Cycles', 'Latency', 'Sram_bits', 'Dram_bits'] +
+                        ['Latency_{}'.format(n) for n in names] + ['Error'])
+        for r in results:
+            benchmark_latency = dict(r.Benchmark_latency or [])
+            writer.writerow(list(r.Point) + [r.Cycles, r.Latency, r.Sram_bits, r.Dram_bits] +
+                            [benchmark_latency.get(n) for n in names] + [r.Error])
+
+class DesignSpaceExplorer(object):
+    """
+    Sweeps accelerator configurations over benchmark graphs
+    Points are evaluated in a pool of worker processes, each costing the
+    tiling chosen by the optimizer for every layer. With a checkpoint path,
+    every result is appended to that file as it completes, and a later run
+    with the same settings skips the points already there.
+    Args:
+        benchmark_names: names for dnnweaver2.benchmarks.get_graph
+        prec, frequency: precision and clock of every accelerator
+        checkpoint: path of a JSON lines file, or None
+        num_workers, sequential: see GraphCompiler
+        search_budget: tiling search budget per layer, see optimize_layers
+    """
+    def __init__(self, benchmark_names=('yolo2_tiny',), prec=16, frequency=150e6, checkpoint=None,
+                 num_workers=None, sequential=False, search_budget=SEARCH_BUDGET, log_level=logging.INFO):
+        self.benchmark_names = list(benchmark_names)
+        self.prec = prec
+        self.frequency = frequency
+        self.checkpoint = checkpoint
+        self.num_workers = num_workers
+        self.sequential = sequential
+        self.search_budget = search_budget
+        self.log = logging.getLogger('DSE')
+        self.log.setLevel(log_level)
+
+    def _get_config(self):
+        # Results from a checkpoint are only reused for identical settings
+        return [COST_MODEL_VERSION, self.benchmark_names, self.prec, self.frequency, self.search_budget]
+
+    def load_checkpoint(self):
+        """
+        Returns a dict from DesignPoint to DSEResult for the results in the
+        checkpoint that were evaluated with the current settings
+        """
+        results = {}
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return results
+        config = self._get_config()
+        skipped = 0
+        with open(self.checkpoint) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of an interrupted run
+                    continue
+                if record['config'] != config:
+                    skipped += 1
+                    continue
+                r = record['result']
+                point = DesignPoint(*r[0])
+                benchmark_latency = [tuple(l) for l in r[5]] if r[5] is not None else None
+                results[point] = DSEResult(point, r[1], r[2], r[3], r[4], benchmark_latency, r[6])
+        if skipped > 0:
+            self.log.info('Ignored {} checkpointed results with other settings'.format(skipped))
+        return results
+
+    def _save(self, f, result):
+        f.write(json.dumps({'config': self._get_config(), 'result': list(result)}) + '\n')
+        f.flush()
+
+    def run(self, points):
+        """
+        Returns the DSEResult of every DesignPoint in points, in order
+        """
+        done = self.load_checkpoint()
+        todo = []
+        for p in points:
+            if p not in done and p not in todo:
+                todo.append(p)
+        self.log.info('Evaluating {} of {} design points'.format(len(todo), len(points)))
+
+        units = [(p, self.benchmark_names, self.prec, self.frequency, self.search_budget) for p in todo]
+        f = open(self.checkpoint, 'a') if self.checkpoint is not None else None
+        try:
+            if self.sequential:
+                results = (_evaluate_work_unit(u) for u in units)
+                self._collect(results, done, f, len(todo))
+            else:
+                pool = get_worker_pool(self.num_workers)
+                try:
+                    self._collect(pool.imap_unordered(_evaluate_work_unit, units), done, f, len(todo))
+                except KeyboardInterrupt:
+                    pool.terminate()
+                    pool.join()
+                    raise
+                pool.close()
+                pool.join()
+        finally:
+            if f is not None:
+                f.close()
+        return [done[p] for p in points]
+
+    def _collect(self, results, done, f, num_points):
+        for i, r in enumerate(results):
+            done[r.Point] = r
+            if f is not None:
+                self._save(f, r)
+            if r.Error is not None:
+                self.log.debug('{}: infeasible, {}'.format(r.Point, r.Error))
+            else:
+                self.log.debug('{}: {:.3f} ms'.format(r.Point, r.Latency * 1.e3))
+            if (i + 1) % 100 == 0:
+                self.log.info('Evaluated {} of {} design points'.format(i + 1, num_points))
+
+    def pareto(self, points):
+        """
+        Runs the sweep and returns its Pareto frontier, see get_pareto_frontier
+        """
+        return get_pareto_frontier(self.run(points))
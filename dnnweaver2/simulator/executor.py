@@ -0,0 +1,326 @@
+import logging
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from dnnweaver2.isa import OPCodes, ScratchPad, AccessType, InstructionStream
+from dnnweaver2.utils.utils import ceil_a_by_b
+from dnnweaver2.simulator.stats import Stats
+
+# Fields of a 32-bit instruction word, see isa.InstructionStream.encode
+DecodedInstruction = namedtuple('DecodedInstruction', ['Op_code', 'Op_spec', 'Loop_id', 'Immediate'])
+# Counts for one InstructionBlock from InstructionExecutor.run
+#   Stats: DRAM and buffer traffic in bits, and cycles, as get_stats_fast
+#   Tiles: iterations of the outer (tile) loops
+#   Loads, Stores: tile transfers per buffer name
+#   Redundant_loads: loads of a tile that was already loaded before
+#   Tile_bits: size of one tile per buffer name
+#   Compute_iterations: systolic array iterations over all tiles
+#   PU_iterations: PU instructions issued over all tiles
+BlockReport = namedtuple('BlockReport', ['Op_name', 'Stats', 'Tiles', 'Loads', 'Stores', 'Redundant_loads',
+                                         'Tile_bits', 'Compute_iterations', 'PU_iterations'])
+
+# Loop levels (op_spec of LoopInstruction) used by the compiler
+OUTER_LOOP = 16
+COMPUTE_LOOP = 0
+
+# PU loop levels, see PUCompiler.compile_layer
+PU_OBUF_LOOP = 0
+PU_ST_LOOP = 1
+PU_LD0_LOOP = 2
+PU_LD1_LOOP = 3
+PU_TILE_LOOP = 5
+# PU operands and results are 16 bits
+PU_BYTES = 2
+
+# Overhead of the loop controller per loop iteration, as
+# Accelerator.get_compute_cycles
+LOOP_OVERHEAD = 2
+
+BUF_NAMES = {
+    ScratchPad.IBUF: 'ibuf',
+    ScratchPad.WBUF: 'wbuf',
+    ScratchPad.OBUF: 'obuf',
+    ScratchPad.BIAS: 'bbuf'
+}
+
+def decode(word):
+    """
+    Splits an instruction word into its fields
+    """
+    word = int(word) & 0xffffffff
+    return DecodedInstruction(word >> 28, (word >> 21) & 0x3f, (word >> 16) & 0x1f, word & 0xffff)
+
+class _Loop(object):
+    def __init__(self, level, count):
+        self.level = level
+        self.count = count
+        # (scratchpad, access type) -> stride
+        self.strides = {}
+        self._high = {}
+
+    def gen_addr(self, inst, high):
+        key = (inst.Op_spec >> 3, inst.Op_spec & 7)
+        if high:
+            self._high[key] = inst.Immediate
+        else:
+            self.strides[key] = (self._high.pop(key, 0) << 16) + inst.Immediate
+
+    def stride(self, buf, access_type):
+        return self.strides.get((buf, access_type), 0)
+
+class _PUBlock(object):
+    def __init__(self):
+        self.loops = []
+        self.num_compute = 0
+        self.repeats = 1
+
+    def loop_counts(self, level, nonzero_stride=False):
+        counts = [l.count for l in self.loops if l.level == level and
+                  (not nonzero_stride or any(s != 0 for s in l.strides.values()))]
+        return int(np.prod(counts))
+
+class _ConvBlock(object):
+    def __init__(self):
+        self.base_addr = {}
+        self.outer_loops = []
+        self.compute_loops = []
+        # scratchpad -> {'elem_bytes', 'st', 'loops'}
+        self.mem = OrderedDict()
+        self.pu = None
+        self.last = False
+
+class InstructionExecutor(object):
+    """
+    Executes the instruction array from GraphCompiler.compile on a model of
+    the accelerator, and counts transfers and compute iterations per block
+    The model walks the loop nests encoded in the instructions. Each of
+    IBUF, WBUF, OBUF and BIAS holds one tile. A tile is loaded from DDR when
+    the address generated by the outer loops changes, and OBUF is stored
+    before it is replaced. The cycle estimate follows get_stats_fast, so it
+    can be compared with the prediction of the optimizer.
+    """
+    def __init__(self, acc_obj, log_level=logging.INFO):
+        self.log = logging.getLogger('Instruction Executor')
+        self.log.setLevel(log_level)
+        self.acc_obj = acc_obj
+        N, M = acc_obj.N, acc_obj.M
+        # Elements per DDR access of each buffer, the last dimensions of
+        # tensor_tile_shape in GraphCompiler._conv_compile
+        self.lanes = {
+            ScratchPad.IBUF: N,
+            ScratchPad.WBUF: N * M,
+            ScratchPad.OBUF: M,
+            ScratchPad.BIAS: N
+        }
+
+    def parse(self, inst_array):
+        """
+        Splits the instruction array into blocks, one per macro node
+        """
+        blocks = []
+        block = None
+        loop = None
+        pu_remaining = None
+        fields = [f.tolist() for f in InstructionStream.decode(inst_array).fields()]
+        for inst in zip(*fields):
+            inst = DecodedInstruction(*inst)
+            op = inst.Op_code
+
+            if pu_remaining is not None:
+                if pu_remaining == 0:
+                    if op != OPCodes.BLOCK_END:
+                        raise ValueError('Expected the end of a PU block, got opcode {}'.format(op))
+                    block.pu.repeats = inst.Immediate + 1
+                    pu_remaining = None
+                    loop = None
+                    continue
+                pu_remaining -= 1
+                if op == OPCodes.LOOP:
+                    loop = _Loop(inst.Op_spec, inst.Immediate + 1)
+                    block.pu.loops.append(loop)
+                elif op in (OPCodes.GENADDRLO, OPCodes.GENADDRHI):
+                    if loop is None:
+                        raise ValueError('Address generation outside of a loop')
+                    loop.gen_addr(inst, op == OPCodes.GENADDRHI)
+                elif op in (OPCodes.COMPUTE_R, OPCodes.COMPUTE_I):
+                    block.pu.num_compute += 1
+                continue
+
+            if op == OPCodes.SETUP:
+                if block is not None:
+                    raise ValueError('Setup instruction inside a block')
+                block = _ConvBlock()
+                loop = None
+                continue
+            if block is None:
+                raise ValueError('Instruction with opcode {} outside of a block'.format(op))
+
+            if op == OPCodes.BASE_ADDR:
+                buf, index = inst.Op_spec >> 3, inst.Op_spec & 7
+                part = ((inst.Loop_id << 16) + inst.Immediate) << (21 * index)
+                if index == 0:
+                    block.base_addr[buf] = part
+                else:
+                    block.base_addr[buf] = block.base_addr.get(buf, 0) % (1 << 21) + part
+            elif op == OPCodes.LOOP:
+                loop = _Loop(inst.Op_spec, inst.Immediate + 1)
+                if inst.Op_spec == OUTER_LOOP:
+                    block.outer_loops.append(loop)
+                elif inst.Op_spec == COMPUTE_LOOP:
+                    block.compute_loops.append(loop)
+                else:
+                    block.mem[inst.Op_spec - 1]['loops'].append(loop)
+            elif op in (OPCodes.GENADDRLO, OPCodes.GENADDRHI):
+                if loop is None:
+                    raise ValueError('Address generation outside of a loop')
+                loop.gen_addr(inst, op == OPCodes.GENADDRHI)
+            elif op in (OPCodes.LDMEM, OPCodes.STMEM):
+                buf = inst.Op_spec >> 3
+                if buf not in block.mem:
+                    block.mem[buf] = {'elem_bytes': 1 << (inst.Op_spec & 7), 'st': False, 'loops': []}
+                if op == OPCodes.STMEM:
+                    block.mem[buf]['st'] = True
+            elif op == OPCodes.PU_BLOCK:
+                block.pu = _PUBlock()
+                pu_remaining = inst.Immediate
+                loop = None
+            elif op == OPCodes.BLOCK_END:
+                block.last = inst.Immediate == 1
+                blocks.append(block)
+                block = None
+            else:
+                raise ValueError('Unexpected opcode {} in a convolution block'.format(op))
+
+        if block is not None or pu_remaining is not None:
+            raise ValueError('Instruction array ends inside a block')
+        return blocks
+
+    def _tile_addresses(self, block, buf, access_type):
+        """
+        Returns the DDR address of the tile of buf for every outer loop
+        iteration, in execution order. The first outer loop is the innermost.
+        """
+        addr = np.zeros(1, dtype=np.int64)
+        for loop in reversed(block.outer_loops):
+            stride = loop.stride(buf, access_type)
+            addr = np.add.outer(addr, np.arange(loop.count, dtype=np.int64) * stride).reshape(-1)
+        return block.base_addr.get(buf, 0) + addr
+
+    @staticmethod
+    def _num_transfers(addr):
+        """
+        Number of times a tile is transferred, once per run of equal addresses
+        """
+        return 1 + int(np.count_nonzero(addr[1:] != addr[:-1]))
+
+    def execute_block(self, block, name):
+        acc_obj = self.acc_obj
+        stats = Stats()
+        tiles = int(np.prod([l.count for l in block.outer_loops]))
+        loads = OrderedDict()
+        stores = OrderedDict()
+        redundant = OrderedDict()
+        tile_bits = OrderedDict()
+        initial_bits = 0
+        final_bits = 0
+
+        for buf, mem in block.mem.items():
+            namespace = BUF_NAMES[buf]
+            accesses = int(np.prod([l.count for l in mem['loops']]))
+            bits = accesses * self.lanes[buf] * mem['elem_bytes'] * 8
+            tile_bits[namespace] = bits
+
+            addr = self._tile_addresses(block, buf, AccessType.LD)
+            loads[namespace] = self._num_transfers(addr)
+            redundant[namespace] = loads[namespace] - np.unique(addr).size
+            stats.writes[namespace] += loads[namespace] * bits
+            stats.reads['dram'] += loads[namespace] * bits
+            initial_bits += bits
+
+            if mem['st']:
+                addr = self._tile_addresses(block, buf, AccessType.ST)
+                stores[namespace] = self._num_transfers(addr)
+                stats.reads[namespace] += stores[namespace] * bits
+                stats.writes['dram'] += stores[namespace] * bits
+                final_bits += bits
+
+        # Systolic array: loops run innermost first, with a fixed overhead
+        # per iteration
+        iterations = int(np.prod([l.count for l in block.compute_loops]))
+        cycles_per_tile = 1
+        for l in block.compute_loops:
+            cycles_per_tile = LOOP_OVERHEAD + l.count * cycles_per_tile
+        compute_cycles = tiles * cycles_per_tile
+
+        pu_cycles = 0
+        pu_iterations = 0
+        if block.pu is not None:
+            pu = block.pu
+            invocations = pu.loop_counts(PU_TILE_LOOP)
+            pu_iterations = invocations * pu.repeats * pu.num_compute
+            pu_cycles = pu_iterations
+            vector_bits = self.lanes[ScratchPad.OBUF] * PU_BYTES * 8
+            st_bits = pu.loop_counts(PU_ST_LOOP) * vector_bits
+            ld_bits = 0
+            for level in (PU_LD0_LOOP, PU_LD1_LOOP):
+                if any(l.level == level for l in pu.loops):
+                    ld_bits += pu.loop_counts(level, nonzero_stride=True) * vector_bits
+            stats.writes['dram'] += invocations * st_bits
+            stats.reads['dram'] += invocations * ld_bits
+            final_bits += st_bits
+
+        busy_cycles = max(compute_cycles, pu_cycles)
+        latency = acc_obj.get_mem_read_cycles('dram', initial_bits) + \
+                acc_obj.get_mem_write_cycles('dram', final_bits)
+        middle_bits = max(0, stats.reads['dram'] + stats.writes['dram'] - initial_bits - final_bits)
+        memory_cycles = ceil_a_by_b(middle_bits, acc_obj.mem_if_width)
+        stats.mem_stall_cycles = max(0, memory_cycles - busy_cycles) + latency
+        stats.total_cycles = busy_cycles + stats.mem_stall_cycles
+
+        return BlockReport(name, stats, tiles, loads, stores, redundant, tile_bits,
+                           tiles * iterations, pu_iterations)
+
+    def run(self, inst_array, names=None):
+        """
+        Executes an instruction array and returns a BlockReport per block
+        Args:
+            names: names of the blocks, e.g. the macro nodes of the compiler
+        """
+        blocks = self.parse(inst_array)
+        if names is None:
+            names = ['block{}'.format(i) for i in range(len(blocks))]
+        if len(names) != len(blocks):
+            raise ValueError('Found {} blocks, expected {}'.format(len(blocks), len(names)))
+        if len(blocks) > 0 and not blocks[-1].last:
+            self.log.warning('The last block is not marked as last')
+        reports = []
+        for block, name in zip(blocks, names):
+            report = self.execute_block(block, name)
+            self.log.debug('{}: {:,} cycles, {:,} tiles, loads {}, stores {}'.format(
+                name, report.Stats.total_cycles, report.Tiles, dict(report.Loads), dict(report.Stores)))
+            reports.append(report)
+        return reports
+
+def compare_with_optimizer(reports, predicted_stats, log=None):
+    """
+    Returns (name, executed cycles, predicted cycles, executed DRAM bits,
+    predicted DRAM bits) per block, and logs them if log is given
+    Args:
+        predicted_stats: GraphCompiler.predicted_stats
+    """
+    assert len(reports) == len(predicted_stats)
+    rows = []
+    for report, predicted in zip(reports, predicted_stats):
+        executed = report.Stats
+        rows.append((report.Op_name,
+                     executed.total_cycles, predicted.total_cycles,
+                     executed.reads['dram'] + executed.writes['dram'],
+                     predicted.reads['dram'] + predicted.writes['dram']))
+    if log is not None:
+        log.info('{:>20} {:>14} {:>14} {:>16} {:>16}'.format(
+            'block', 'cycles', 'predicted', 'DRAM bits', 'predicted'))
+        for name, cycles, p_cycles, dram, p_dram in rows:
+            log.info('{:>20} {:>14,} {:>14,} {:>16,} {:>16,}'.format(
+                str(name)[-20:], int(cycles), int(p_cycles), int(dram), int(p_dram)))
+    return rows
@@ -0,0 +1,133 @@
+import csv
+import logging
+from collections import namedtuple
+
+from dnnweaver2.simulator.simulator import SimulationReport, simulate
+
+COMPUTE_BOUND = 'compute'
+BANDWIDTH_BOUND = 'bandwidth'
+
+# Position of one layer on the roofline of an accelerator
+#   Ops: multiply-accumulates of the layer
+#   Dram_bytes: DRAM reads + writes of the chosen tiling, in bytes
+#   Intensity: Ops / Dram_bytes
+#   Ops_per_cycle: predicted multiply-accumulates per cycle
+#   Attainable: roofline at Intensity, min(N * M, Intensity * bytes per cycle)
+#   Efficiency: Ops_per_cycle / Attainable
+#   Bound: COMPUTE_BOUND if Intensity is at or above the ridge point, else
+#          BANDWIDTH_BOUND
+RooflinePoint = namedtuple('RooflinePoint', ['Name', 'Ops', 'Dram_bytes', 'Intensity', 'Ops_per_cycle',
+                                             'Attainable', 'Efficiency', 'Bound'])
+
+_FIELDS = list(RooflinePoint._fields)
+
+def get_roofline_point(layer, acc_obj):
+    """
+    Returns the RooflinePoint for the LayerStats of a layer
+    """
+    peak_ops = acc_obj.N * acc_obj.M
+    peak_bytes = acc_obj.mem_if_width / 8.
+    dram_bytes = (layer.Dram_read_bits + layer.Dram_write_bits) // 8
+    intensity = float(layer.Ops) / dram_bytes if dram_bytes > 0 else float('inf')
+    attainable = min(peak_ops, intensity * peak_bytes)
+    bound = COMPUTE_BOUND if intensity * peak_bytes >= peak_ops else BANDWIDTH_BOUND
+    return RooflinePoint(layer.Name, layer.Ops, dram_bytes, intensity, layer.Ops_per_cycle, attainable,
+                         layer.Ops_per_cycle / attainable if attainable > 0 else 0., bound)
+
+class RooflineReport(object):
+    """
+    Roofline of an accelerator with the RooflinePoint of every layer
+    Args:
+        report: SimulationReport, see Simulator.run
+    """
+    def __init__(self, report):
+        assert isinstance(report, SimulationReport)
+        acc_obj = report.acc_obj
+        self.acc_obj = acc_obj
+        # multiply-accumulates and DRAM bytes per cycle
+        self.peak_ops = acc_obj.N * acc_obj.M
+        self.peak_bytes = acc_obj.mem_if_width / 8.
+        # Intensity above which a layer can run at peak_ops
+        self.ridge = self.peak_ops / self.peak_bytes
+        self.layers = [get_roofline_point(l, acc_obj) for l in report.layers]
+        self.total = get_roofline_point(report.total, acc_obj)
+        self.log = logging.getLogger('Roofline')
+
+    def bandwidth_bound(self):
+        """
+        Returns the layers below the ridge point, slowest first
+        """
+        layers = [l for l in self.layers if l.Bound == BANDWIDTH_BOUND]
+        return sorted(layers, key=lambda l: float(l.Ops) / l.Ops_per_cycle if l.Ops_per_cycle > 0 else 0.,
+                      reverse=True)
+
+    def __str__(self):
+        ret = 'Peak: {:,} ops/cycle, {:.1f} bytes/cycle, ridge at {:.1f} ops/byte'.format(
+                self.peak_ops, self.peak_bytes, self.ridge)
+        ret += '\n{:<40} {:>16} {:>14} {:>10} {:>10} {:>10} {:>8} {:>10}'.format(
+                'Layer', 'Ops', 'DRAM (B)', 'Ops/B', 'Ops/cycle', 'Roof', 'Eff', 'Bound')
+        for l in self.layers + [self.total]:
+            ret += '\n{:<40} {:>16,} {:>14,} {:>10.1f} {:>10.1f} {:>10.1f} {:>7.1%} {:>10}'.format(
+                    l.Name[:40], l.Ops, l.Dram_bytes, l.Intensity, l.Ops_per_cycle, l.Attainable,
+                    l.Efficiency, l.Bound)
+        return ret
+
+    def to_csv(self, path):
+        """
+        Writes one row per layer, and a last row for the whole graph
+        """
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(_FIELDS)
+            for l in self.layers + [self.total]:
+                writer.writerow(list(l))
+        self.log.debug('Wrote roofline of {} layers to {}'.format(len(self.layers), path))
+
+    def plot(self, path=None):
+        """
+        Plots the roofline and the layers on log-log axes
+        Needs matplotlib.
+        Args:
+            path: file to save the figure to, or None to return it unsaved
+        """
+        try:
+            import matplotlib
+            if path is not None:
+                matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+        except ImportError:
+            raise ImportError('RooflineReport.plot needs matplotlib')
+
+        finite = [l.Intensity for l in self.layers if l.Intensity != float('inf')]
+        x_min = min(finite + [self.ridge]) / 4.
+        x_max = max(finite + [self.ridge]) * 4.
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.plot([x_min, self.ridge, x_max],
+                [x_min * self.peak_bytes, self.peak_ops, self.peak_ops], 'k-', label='Roofline')
+        ax.axvline(self.ridge, color='grey', linestyle=':')
+        for bound, color in ((COMPUTE_BOUND, 'tab:blue'), (BANDWIDTH_BOUND, 'tab:red')):
+            layers = [l for l in self.layers if l.Bound == bound and l.Intensity != float('inf')]
+            ax.scatter([l.Intensity for l in layers], [l.Ops_per_cycle for l in layers],
+                       color=color, label='{}-bound'.format(bound))
+            for l in layers:
+                ax.annotate(l.Name, (l.Intensity, l.Ops_per_cycle), fontsize=6,
+                            xytext=(3, 3), textcoords='offset points')
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Arithmetic intensity (ops/DRAM byte)')
+        ax.set_ylabel('Ops/cycle')
+        ax.set_title('{}x{} array, {}-bit memory interface'.format(
+            self.acc_obj.N, self.acc_obj.M, self.acc_obj.mem_if_width))
+        ax.legend()
+
+        if path is not None:
+            fig.savefig(path)
+            plt.close(fig)
+        return fig
+
+def roofline(graph, acc_obj, compiler=None):
+    """
+    Returns the RooflineReport of graph on acc_obj, see simulate
+    """
+    return RooflineReport(simulate(graph, acc_obj, compiler))
@@ -1,3 +1,55 @@
+import json
+from collections import namedtuple
+
+# Energy of an accelerator per namespace, in nJ
+#   Leak, Core_dyn: per processing element per cycle, leakage for every
+#                   cycle and dynamic energy for every non-stalled cycle
+#   *_read, *_write: per bit accessed in each buffer
+#   Dram: per bit read or written
+EnergyCost = namedtuple('EnergyCost', ['Leak', 'Core_dyn', 'Wbuf_read', 'Wbuf_write', 'Ibuf_read', 'Ibuf_write',
+                                       'Bbuf_read', 'Bbuf_write', 'Obuf_read', 'Obuf_write', 'Dram'])
+
+# 16-bit fixed point multiply-accumulate and SRAM banks of a few KB at 45nm;
+# DRAM at 6 pJ/bit as assumed by Stats.get_energy
+DEFAULT_ENERGY_COST = EnergyCost(Leak=2.e-5, Core_dyn=5.e-4,
+                                 Wbuf_read=2.e-4, Wbuf_write=2.4e-4,
+                                 Ibuf_read=1.5e-4, Ibuf_write=1.8e-4,
+                                 Bbuf_read=1.5e-4, Bbuf_write=1.8e-4,
+                                 Obuf_read=1.5e-4, Obuf_write=1.8e-4,
+                                 Dram=6.e-3)
+
+def load_energy_cost(path):
+    """
+    Returns the EnergyCost in a JSON file
+    The file holds an object whose keys are lower case EnergyCost fields,
+    e.g. {"core_dyn": 4e-4, "dram": 2e-2}; missing fields are taken from
+    DEFAULT_ENERGY_COST.
+    """
+    with open(path) as f:
+        values = json.load(f)
+    fields = dict((k.lower(), k) for k in EnergyCost._fields)
+    for k in values:
+        if k.lower() not in fields:
+            raise ValueError('Unknown energy cost {} in {}, expected one of {}'.format(
+                k, path, ', '.join(sorted(fields))))
+    return DEFAULT_ENERGY_COST._replace(**dict((fields[k.lower()], float(v)) for k, v in values.items()))
+
+def get_energy_cost(energy_cost, acc_obj):
+    """
+    Returns the EnergyCost used by Stats.get_energy for an EnergyCost, with
+    the per processing element costs scaled to the array
+    """
+    num_pe = acc_obj.N * acc_obj.M
+    return energy_cost._replace(Leak=energy_cost.Leak * num_pe, Core_dyn=energy_cost.Core_dyn * num_pe)
+
+def _get_energy_cost(energy_cost, dram_cost):
+    # Older callers pass a 10-tuple without the DRAM cost
+    if isinstance(energy_cost, EnergyCost):
+        return energy_cost
+    if len(energy_cost) == len(EnergyCost._fields):
+        return EnergyCost(*energy_cost)
+    return EnergyCost(*(tuple(energy_cost) + (dram_cost,)))
+
 class Stats(object):
     """
     Stores the stats from the simulator
@@ -57,50 +109,54 @@ class Stats(object):
         return ret
 
     def get_energy(self, energy_cost, dram_cost=6.e-3):
-        leak_cost, core_dyn_cost, wbuf_read_cost, wbuf_write_cost, ibuf_read_cost, ibuf_write_cost, bbuf_read_cost, bbuf_write_cost, obuf_read_cost, obuf_write_cost = energy_cost
-        dyn_energy = (self.total_cycles - self.mem_stall_cycles) * core_dyn_cost
+        """
+        Returns the energy in nJ for an EnergyCost, see get_energy_cost
+        dram_cost is only used for a legacy 10-tuple without the DRAM cost.
+        """
+        c = _get_energy_cost(energy_cost, dram_cost)
+        dyn_energy = (self.total_cycles - self.mem_stall_cycles) * c.Core_dyn
 
-        dyn_energy += self.reads['wbuf'] * wbuf_read_cost
-        dyn_energy += self.writes['wbuf'] * wbuf_write_cost
+        dyn_energy += self.reads['wbuf'] * c.Wbuf_read
+        dyn_energy += self.writes['wbuf'] * c.Wbuf_write
 
-        dyn_energy += self.reads['ibuf'] * ibuf_read_cost
-        dyn_energy += self.writes['ibuf'] * ibuf_write_cost
+        dyn_energy += self.reads['ibuf'] * c.Ibuf_read
+        dyn_energy += self.writes['ibuf'] * c.Ibuf_write
 
-        dyn_energy += self.reads['bbuf'] * bbuf_read_cost
-        dyn_energy += self.writes['bbuf'] * bbuf_write_cost
+        dyn_energy += self.reads['bbuf'] * c.Bbuf_read
+        dyn_energy += self.writes['bbuf'] * c.Bbuf_write
 
-        dyn_energy += self.reads['obuf'] * obuf_read_cost
-        dyn_energy += self.writes['obuf'] * obuf_write_cost
+        dyn_energy += self.reads['obuf'] * c.Obuf_read
+        dyn_energy += self.writes['obuf'] * c.Obuf_write
 
-        # Assuming that the DRAM requires 6 pJ/bit
-        dyn_energy += self.reads['dram'] * dram_cost
-        dyn_energy += self.writes['dram'] * dram_cost
+        # DRAM energy per bit read or written
+        dyn_energy += self.reads['dram'] * c.Dram
+        dyn_energy += self.writes['dram'] * c.Dram
 
         # Leakage Energy
-        leak_energy = self.total_cycles * leak_cost * 0
+        leak_energy = self.total_cycles * c.Leak
         return dyn_energy + leak_energy
 
     def get_energy_breakdown(self, energy_cost, dram_cost=6.e-3):
-        leak_cost, core_dyn_cost, wbuf_read_cost, wbuf_write_cost, ibuf_read_cost, ibuf_write_cost, bbuf_read_cost, bbuf_write_cost, obuf_read_cost, obuf_write_cost = energy_cost
-        core_energy = (self.total_cycles - self.mem_stall_cycles) * core_dyn_cost
+        c = _get_energy_cost(energy_cost, dram_cost)
+        core_energy = (self.total_cycles - self.mem_stall_cycles) * c.Core_dyn
         breakdown = [core_energy]
 
-        sram_energy = self.reads['wbuf'] * wbuf_read_cost
-        sram_energy += self.writes['wbuf'] * wbuf_write_cost
+        sram_energy = self.reads['wbuf'] * c.Wbuf_read
+        sram_energy += self.writes['wbuf'] * c.Wbuf_write
 
-        sram_energy += self.reads['ibuf'] * ibuf_read_cost
-        sram_energy += self.writes['ibuf'] * ibuf_write_cost
+        sram_energy += self.reads['ibuf'] * c.Ibuf_read
+        sram_energy += self.writes['ibuf'] * c.Ibuf_write
 
-        sram_energy += self.reads['bbuf'] * bbuf_read_cost
-        sram_energy += self.writes['bbuf'] * bbuf_write_cost
+        sram_energy += self.reads['bbuf'] * c.Bbuf_read
+        sram_energy += self.writes['bbuf'] * c.Bbuf_write
 
-        sram_energy += self.reads['obuf'] * obuf_read_cost
-        sram_energy += self.writes['obuf'] * obuf_write_cost
+        sram_energy += self.reads['obuf'] * c.Obuf_read
+        sram_energy += self.writes['obuf'] * c.Obuf_write
 
         breakdown.append(sram_energy)
-        breakdown.append(0)
-        dram_energy = self.reads['dram'] * dram_cost
-        dram_energy += self.writes['dram'] * dram_cost
+        breakdown.append(self.total_cycles * c.Leak)
+        dram_energy = self.reads['dram'] * c.Dram
+        dram_energy += self.writes['dram'] * c.Dram
         breakdown.append(dram_energy)
         return breakdown
 
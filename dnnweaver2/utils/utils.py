@@ -1,4 +1,5 @@
 import math
+from collections import OrderedDict
 
 def floor_a_by_b(a, b):
     return int(float(a) / b)
@@ -21,3 +22,41 @@ def lookup_pandas_dataframe(data, lookup_dict):
     # assert len(data) == 1, ("Found {} entries for dict {}".format(len(data), lookup_dict))
     return data
 
+
+class LRUCache(object):
+    '''
+    Bounded least-recently-used cache with hit/miss counters
+    '''
+    def __init__(self, maxsize=1024):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        if key in self.data:
+            value = self.data.pop(key)
+            self.data[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if key in self.data:
+            self.data.pop(key)
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
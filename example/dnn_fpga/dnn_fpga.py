@@ -8,10 +8,10 @@ import logging
 from dnnweaver2.fpga.fpgamanager import FPGAManager
 import dnnweaver2.simulator.accelerator
 
-def initialize_yolo_graph(weight_pickle, debug_mode=False):
+def initialize_yolo_graph(weight_pickle, debug_mode=False, double_buffer=False):
     yolo_graph = dnnweaver2.benchmarks.get_graph('yolo2_tiny', train=False)
 
-    fpga_spec = dnnweaver2.compiler.FPGASpec(num_ddr=1, size_ddr=1024, bandwidth_per_ddr=512)
+    fpga_spec = dnnweaver2.compiler.FPGASpec(num_ddr=1, size_ddr=1<<30, bandwidth_per_ddr=512)
     fpga_compiler = dnnweaver2.compiler.GraphCompiler(fpga_spec)
 
     sram ={
@@ -22,13 +22,13 @@ def initialize_yolo_graph(weight_pickle, debug_mode=False):
     }
 
     acc_obj = dnnweaver2.simulator.accelerator.Accelerator(N=32,M=32,prec=16,mem_if_width=256,frequency=100e6,sram=sram)
-    inst_array = fpga_compiler.compile(graph=yolo_graph, acc_obj=acc_obj)
+    inst_array = fpga_compiler.compile(graph=yolo_graph, acc_obj=acc_obj, double_buffer=double_buffer)
 
     fpga_manager = FPGAManager(pci_cl_ctrl_device="/dev/xdma0_user", c2h_dma_device="/dev/xdma0_c2h_0", h2c_dma_device="/dev/xdma0_h2c_0")
     fpga_manager.initialize_graph_tensors(yolo_graph)
     yolo_graph.load_params_from_pickle(weight_pickle)
     fpga_manager.write('pci_cl_data', 0, inst_array)
-    fpga_manager.initialize_graph(yolo_graph, 32, 32)
+    fpga_manager.initialize_graph(yolo_graph, 32, 32, double_buffer=fpga_compiler.double_buffer)
 
     return fpga_manager
 
@@ -43,3 +43,8 @@ def fpga_inference(fpga_manager, inp):
     fpga_manager.wait_fpga_execution()
     onp = fpga_manager.recv_output_nparr()
     return onp
+
+def fpga_pipelined_inference(fpga_manager, inputs):
+    # Requires initialize_yolo_graph(..., double_buffer=True)
+    for onp in fpga_manager.run_pipeline(inputs):
+        yield onp
@@ -35,12 +35,6 @@ def get_bbox(tfnet, box_input, h, w):
         })
     return boxesInfo
 
-def fp32tofxp16_tensor(tensor, num_frac_bits):
-    pow_nfb_tensor = np.full(tensor.shape, pow(2, num_frac_bits), dtype=np.int32)
-    shifted_tensor = tensor * pow_nfb_tensor
-    casted_tensor = np.int16(shifted_tensor)
-    return casted_tensor
-
 def fxp16tofp32_tensor(tensor, num_frac_bits):
     pow_nfb_tensor = np.full(tensor.shape, np.float32(pow(2, num_frac_bits)), dtype=np.float32)
     shifted_tensor = np.float32(tensor) / pow_nfb_tensor
@@ -70,11 +64,10 @@ def run_fpga(tin, bf_weight_pickle):
 
     out_tensors_d = collections.OrderedDict()
     fxp_out_tensors_d = collections.OrderedDict()
-    _tin = fp32tofxp16_tensor(tin, 8)
-
     fpga_manager = dnn_fpga.initialize_yolo_graph(bf_weight_pickle)
     start = time()
-    tout = dnn_fpga.fpga_inference(fpga_manager, _tin)
+    # The float image is quantized by FPGAManager.send_input_image
+    tout = dnn_fpga.fpga_inference(fpga_manager, tin)
     end = time()
     fps = 1.0 / (end - start)
     fxp_tout = copy.deepcopy(tout)
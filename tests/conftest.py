@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnnweaver2.simulator.accelerator import Accelerator
+
+@pytest.fixture
+def acc_obj():
+    """
+    32x32 array with the buffers of the DSE reference point
+    """
+    sram = {'ibuf': 32*16*2048*2, 'wbuf': 32*32*16*4096*2, 'obuf': 64*32*2048*2, 'bbuf': 32*32*2048*2}
+    return Accelerator(32, 32, 16, sram, 256, 150e6)
@@ -0,0 +1,22 @@
+import logging
+
+import numpy as np
+
+from dnnweaver2 import benchmarks
+from dnnweaver2.compiler import GraphCompiler
+from dnnweaver2.isa import InstructionStream, LoopInstruction, OPCodes
+
+def test_stream_takes_integral_floats():
+    stream = InstructionStream()
+    stream.loop(1, 1, 14.0 - 1)
+    assert stream.encode()[0] == LoopInstruction(1, 1, 13).get_binary()
+
+def test_compile_without_extended_tiles(acc_obj):
+    # The power of two search returns tile counts as floats
+    graph = benchmarks.get_graph('yolo2_tiny', train=False)
+    compiler = GraphCompiler(sequential=True, extended_tiles=False, log_level=logging.WARNING)
+    inst_array = compiler.compile(graph, acc_obj)
+    assert inst_array.dtype == np.uint32
+    op_code = InstructionStream.decode(inst_array).fields()[0]
+    assert sum(b.Length for b in compiler.block_index) == len(inst_array)
+    assert all(op_code[b.Offset + b.Length - 1] == OPCodes.BLOCK_END for b in compiler.block_index)
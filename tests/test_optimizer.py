@@ -0,0 +1,25 @@
+import logging
+
+from dnnweaver2 import benchmarks
+from dnnweaver2.compiler import GraphCompiler
+from dnnweaver2.simulator.accelerator import Accelerator
+
+def _get_acc_obj(acc_obj):
+    return Accelerator(acc_obj.N, acc_obj.M, acc_obj.prec, dict(acc_obj.sram), acc_obj.mem_if_width,
+                       acc_obj.frequency)
+
+def _compile(acc_obj, sequential):
+    graph = benchmarks.get_graph('yolo2_tiny', train=False)
+    with GraphCompiler(sequential=sequential, num_workers=2, log_level=logging.WARNING) as compiler:
+        inst_array = compiler.compile(graph, acc_obj)
+    return inst_array, acc_obj.get_cache_stats()
+
+def test_parallel_search_hits_tile_stats_cache(acc_obj):
+    seq_inst, seq_stats = _compile(_get_acc_obj(acc_obj), sequential=True)
+    par_inst, par_stats = _compile(_get_acc_obj(acc_obj), sequential=False)
+    assert (par_inst == seq_inst).all()
+    # Every loop order after the first of a layer reuses its tile grid
+    assert par_stats['tile_stats'].Hits > 0
+    assert par_stats['tile_stats'].Hits == seq_stats['tile_stats'].Hits
+    assert par_stats['tile_stats'].Misses == seq_stats['tile_stats'].Misses
+    assert par_stats['buffer_sizes'].Hits > 0
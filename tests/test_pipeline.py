@@ -0,0 +1,106 @@
+import logging
+
+import numpy as np
+import pytest
+
+from dnnweaver2 import benchmarks
+from dnnweaver2.compiler import GraphCompiler
+from dnnweaver2.fpga.fpgamanager import FPGAManager
+from dnnweaver2.fpga.memspace import NumpyMemSpace
+from dnnweaver2.tensorOps.cnn import Convolution
+
+class EmulatedAccelerator(NumpyMemSpace):
+    """
+    NumpyMemSpace that runs a stand-in for the graph when started
+    A run overwrites every activation the hardware writes, then writes an
+    output computed from the input, both at the addresses selected by the
+    double buffer patches in the instruction memory.
+    """
+    def __init__(self, compiler, graph, tin, tout, ddr_size=1<<28):
+        super(EmulatedAccelerator, self).__init__(ddr_size=ddr_size, log_level=logging.WARNING)
+        self.double_buffer = compiler.double_buffer
+        self.tin = tin
+        self.tout = tout
+        self.activations = [(t.fpga_addr, compiler.fpga_manager.get_alloc_size(t))
+                            for t in graph.tensor_registry.values()
+                            if t.op is not None and t is not self.tout and t.fpga_addr is not None]
+        self.num_runs = 0
+
+    def _get_buffer(self):
+        idx, inst, alt_inst = self.double_buffer.Patches[0]
+        word = self._slice('pci_cl_data', idx * 4, 4).view(np.uint32)[0]
+        return 1 if word == alt_inst else 0
+
+    def write(self, namespace, addr, data):
+        super(EmulatedAccelerator, self).write(namespace, addr, data)
+        if namespace == 'pci_cl_ctrl' and addr == 0 and data == 1:
+            self._run()
+
+    def _run(self):
+        buf = self._get_buffer()
+        in_addr = (self.tin.fpga_addr, self.double_buffer.Input_addr)[buf]
+        out_addr = (self.tout.fpga_addr, self.double_buffer.Output_addr)[buf]
+        data = self._slice('ddr', in_addr, int(self.tin.fpga_size_in_bytes)).view(np.int16)
+        checksum = int(data.astype(np.int64).sum())
+        for addr, size in self.activations:
+            self._slice('ddr', addr, size)[:] = 0x55
+        num_words = int(self.tout.fpga_size_in_bytes) // 2
+        out = ((np.arange(num_words, dtype=np.int64) + checksum) % 32749).astype(np.int16)
+        self._slice('ddr', out_addr, out.nbytes)[:] = out.view(np.uint8)
+        self.num_runs += 1
+
+def _get_ranges(compiler, graph):
+    return [(t.name, t.fpga_addr, t.fpga_addr + compiler.fpga_manager.get_alloc_size(t))
+            for t in graph.tensor_registry.values() if t.fpga_addr is not None]
+
+@pytest.fixture
+def pipeline(acc_obj):
+    graph = benchmarks.get_graph('yolo2_tiny', train=False)
+    compiler = GraphCompiler(sequential=True, log_level=logging.WARNING)
+    inst_array = compiler.compile(graph, acc_obj, double_buffer=True)
+
+    tin = [op.data for op in graph.op_registry.values() if isinstance(op, Convolution) and op.data.op is None][0]
+    tout = [t for t in graph.tensor_registry.values() if len(t.output_nodes) == 0][0]
+    memspace = EmulatedAccelerator(compiler, graph, tin, tout)
+    fpga_manager = FPGAManager(backend=memspace, collect_counters=False, log_level=logging.WARNING)
+    fpga_manager.initialize_graph_tensors(graph)
+    fpga_manager.write('pci_cl_data', 0, inst_array)
+    fpga_manager.initialize_graph(graph, acc_obj.M, acc_obj.N, double_buffer=compiler.double_buffer)
+    return compiler, graph, fpga_manager
+
+def test_double_buffers_do_not_overlap_planned_tensors(pipeline):
+    compiler, graph, fpga_manager = pipeline
+    tin, tout = fpga_manager.input_t, fpga_manager.output_t
+    buffers = [(tin.name, tin.fpga_addr, compiler.fpga_manager.get_alloc_size(tin)),
+               ('alternate input', compiler.double_buffer.Input_addr, compiler.fpga_manager.get_alloc_size(tin)),
+               (tout.name, tout.fpga_addr, compiler.fpga_manager.get_alloc_size(tout)),
+               ('alternate output', compiler.double_buffer.Output_addr, compiler.fpga_manager.get_alloc_size(tout))]
+    ranges = _get_ranges(compiler, graph)
+    for name, addr, size in buffers:
+        for other, lo, hi in ranges:
+            if other == name:
+                continue
+            assert addr + size <= lo or hi <= addr, '{} overlaps {}'.format(name, other)
+    for i, (name, addr, size) in enumerate(buffers):
+        for other, other_addr, other_size in buffers[i+1:]:
+            assert addr + size <= other_addr or other_addr + other_size <= addr, \
+                    '{} overlaps {}'.format(name, other)
+
+def test_run_pipeline_matches_single_shot(pipeline):
+    compiler, graph, fpga_manager = pipeline
+    rng = np.random.RandomState(0)
+    inputs = [rng.randint(-1024, 1024, size=fpga_manager.input_t.shape).astype(np.int16) for _ in range(4)]
+
+    expected = []
+    for inp in inputs:
+        fpga_manager.send_input_nparr(inp)
+        fpga_manager.start()
+        fpga_manager.wait_fpga_execution()
+        expected.append(fpga_manager.recv_output_nparr().copy())
+    assert not all(np.array_equal(expected[0], e) for e in expected[1:])
+
+    outputs = [o.copy() for o in fpga_manager.run_pipeline(inputs)]
+    assert fpga_manager.fpga_memspace.num_runs == 2 * len(inputs)
+    assert len(outputs) == len(inputs)
+    for out, exp in zip(outputs, expected):
+        np.testing.assert_array_equal(out, exp)